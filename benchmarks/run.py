@@ -0,0 +1,289 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+from blockchain.block import Block, GENESIS_TIMESTAMP
+from blockchain.tally import TallyIndex
+from blockchain.transaction import Transaction
+from blockchain.wallet import Wallet, sign_data, verify_signature, generate_key_pair, SIGNATURE_SCHEMES
+from blockchain.key_cache import key_cache
+from mining.proof_of_work import ProofOfWork
+from mining.difficulty import target_for_leading_zeros
+from network.framing import FrameReader, encode_message, WIRE_BINARY, WIRE_JSON
+from network.message import Message
+from network.peer import Peer
+from utils.hash_util import calculate_hash
+
+# fixed seed so every run builds the same synthetic data
+SEED = 1234
+CANDIDATES = ["Candidate A", "Candidate B", "Candidate C"]
+
+
+def _measure(func, repeat, number=1):
+    # timing `number` calls `repeat` times, reporting per-call seconds
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+    return {
+        'best': min(timings),
+        'median': statistics.median(timings),
+        'repeat': repeat,
+        'number': number
+    }
+
+
+def _synthetic_transactions(count, rng):
+    # unsigned-looking votes with random filler, hashing does not check signatures
+    transactions = []
+    for i in range(count):
+        transactions.append(Transaction(
+            sender='voter-%d-%016x' % (i, rng.getrandbits(64)),
+            recipient="ELECTION",
+            data={"vote": rng.choice(CANDIDATES)},
+            signature='%0512x' % rng.getrandbits(2048)
+        ))
+    return transactions
+
+
+def _synthetic_chain(blocks, votes_per_block, rng):
+    chain = [Block(0, "0", [], timestamp=GENESIS_TIMESTAMP)]
+    for i in range(1, blocks + 1):
+        block = Block(i, chain[-1].hash, _synthetic_transactions(votes_per_block, rng),
+                      timestamp=GENESIS_TIMESTAMP + i)
+        chain.append(block)
+    return chain
+
+
+def bench_calculate_hash(quick):
+    # hashing blocks of growing size the way the original block hash did, and the merkle header hash
+    rng = random.Random(SEED)
+    results = {}
+    for size in ([10, 100, 1000] if quick else [10, 100, 1000, 10000]):
+        transactions = _synthetic_transactions(size, rng)
+        repeat = 3 if size >= 1000 else 5
+
+        def flat_hash():
+            calculate_hash(1, "0" * 64, GENESIS_TIMESTAMP, transactions, 0)
+
+        def header_hash():
+            # fresh transactions each time so the cached serializations do not hide the cost
+            block = Block(1, "0" * 64, [Transaction.from_dict(tx.to_dict()) for tx in transactions],
+                          timestamp=GENESIS_TIMESTAMP)
+            block.calculate_block_hash()
+
+        results[str(size)] = {
+            'calculate_hash': _measure(flat_hash, repeat),
+            'block_hash': _measure(header_hash, repeat)
+        }
+    return results
+
+
+def bench_proof_of_work(quick):
+    # mining fixed blocks at a fixed target, so the number of hashes is the same on every run
+    difficulty = 4
+    target = target_for_leading_zeros(difficulty)
+    blocks = 3 if quick else 8
+    hashes = 0
+    elapsed = 0.0
+    for i in range(blocks):
+        block = Block(i + 1, "0" * 64, [], timestamp=GENESIS_TIMESTAMP + i, target=target)
+        miner = ProofOfWork(block)
+        with contextlib.redirect_stdout(io.StringIO()):
+            miner.mine()
+        hashes += sum(stats['hashes'] for stats in miner.worker_stats)
+        elapsed += sum(stats['elapsed'] for stats in miner.worker_stats)
+    return {
+        'difficulty': difficulty,
+        'blocks': blocks,
+        'hashes': hashes,
+        'hash_rate': hashes / elapsed if elapsed > 0 else 0.0
+    }
+
+
+def bench_signatures(quick):
+    # signing and verifying vote hashes per scheme, cold and with the key cache warm
+    results = {}
+    for scheme in sorted(SIGNATURE_SCHEMES):
+        wallet = Wallet(scheme=scheme)
+        messages = [calculate_hash('vote', i) for i in range(20 if quick else 100)]
+        signatures = [sign_data(message, wallet.private_key) for message in messages]
+        iterations = iter(range(10 ** 9))
+
+        def sign_one():
+            sign_data(messages[next(iterations) % len(messages)], wallet.private_key)
+
+        def verify_all():
+            for message, signature in zip(messages, signatures):
+                verify_signature(message, signature, wallet.public_key, scheme)
+
+        def verify_cold():
+            key_cache.clear()
+            verify_signature(messages[0], signatures[0], wallet.public_key, scheme)
+
+        sign = _measure(sign_one, 3, len(messages))
+        verify = _measure(verify_all, 3)
+        verify['best'] /= len(messages)
+        verify['median'] /= len(messages)
+        results[scheme] = {
+            'keygen': _measure(lambda: generate_key_pair(scheme), 3, 1 if quick else 5),
+            'sign': dict(sign, per_second=1.0 / sign['median']),
+            'verify': dict(verify, per_second=1.0 / verify['median']),
+            'verify_cold_key': _measure(verify_cold, 5)
+        }
+    return results
+
+
+def bench_tally(quick):
+    # counting one more block on top of chains of growing length, the path every new tip takes,
+    # taking it back out again as a reorganization does, and reading the running counts
+    rng = random.Random(SEED)
+    results = {}
+    for blocks in ([10, 100] if quick else [10, 100, 1000]):
+        chain = _synthetic_chain(blocks + 1, 100, rng)
+        tally = TallyIndex()
+        for block in chain[:-1]:
+            tally.apply_block(block)
+        tip = chain[-1]
+        results[str(blocks)] = {
+            'votes': blocks * 100,
+            'apply_block': _measure(lambda: tally.apply_block(tip), 5, 100),
+            # as many reverts as applies, so the counts end up those of the chain again
+            'revert_block': _measure(lambda: tally.revert_block(tip), 5, 100),
+            'snapshot': _measure(tally.snapshot, 5, 1000)
+        }
+    return results
+
+
+class _CountingNode:
+    # stands in for Node so only the framing and decoding are measured
+    def __init__(self):
+        self.handled = 0
+
+    def handle_message(self, message, peer):
+        self.handled += 1
+
+
+def bench_message_codec(quick):
+    # serializing and parsing large block messages, then pushing the frames through a peer's buffer
+    rng = random.Random(SEED)
+    chain = _synthetic_chain(4 if quick else 16, 250, rng)
+    message = Message('BLOCKS', chain[1:], sender_id='bench')
+    encoded = message.to_json()
+    results = {
+        'payload_bytes': len(encoded),
+        'to_json': _measure(lambda: Message('BLOCKS', chain[1:]).to_json(), 5),
+        'from_json': _measure(lambda: Message.from_json(encoded), 5)
+    }
+
+    node = _CountingNode()
+    local, remote = socket.socketpair()
+    peer = Peer(local, ('bench', 0), node)
+    try:
+        for wire_format in (WIRE_BINARY, WIRE_JSON):
+            frames = encode_message(message, wire_format) * 8
+
+            def process():
+                peer.reader = FrameReader()
+                peer.reader.feed(frames)
+                peer._process_buffer()
+
+            timing = _measure(process, 3)
+            timing['messages_per_second'] = 8 / timing['median']
+            results['process_buffer_' + wire_format] = timing
+    finally:
+        peer.running = False
+        remote.close()
+        local.close()
+    return results
+
+
+BENCHMARKS = {
+    'calculate_hash': bench_calculate_hash,
+    'proof_of_work': bench_proof_of_work,
+    'signatures': bench_signatures,
+    'tally': bench_tally,
+    'message_codec': bench_message_codec
+}
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def _flatten(results, prefix=''):
+    # dotted-path -> number for the timing figures worth comparing
+    values = {}
+    for key, value in results.items():
+        path = prefix + key
+        if isinstance(value, dict):
+            values.update(_flatten(value, path + '.'))
+        elif key in ('median', 'hash_rate') and isinstance(value, (int, float)):
+            values[path] = value
+    return values
+
+
+def compare(previous, current):
+    # printing how each median moved against an earlier run, hash rates are better when higher
+    old = _flatten(previous['results'])
+    new = _flatten(current['results'])
+    for path in sorted(new):
+        if path not in old or not old[path]:
+            continue
+        ratio = new[path] / old[path]
+        if path.endswith('hash_rate'):
+            ratio = 1.0 / ratio if ratio else float('inf')
+        marker = '  <-- slower' if ratio > 1.10 else ''
+        print(f"{path:60s} {ratio:6.2f}x{marker}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the voting chain's hot paths")
+    parser.add_argument('--quick', action='store_true', help='smaller inputs for a fast smoke run')
+    parser.add_argument('--only', action='append', choices=sorted(BENCHMARKS),
+                        help='run just these benchmarks (repeatable)')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='earlier JSON results to compare against')
+    args = parser.parse_args(argv)
+
+    report = {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'quick': args.quick,
+        'started_at': time.time(),
+        'results': {}
+    }
+    for name in args.only or BENCHMARKS:
+        print(f"Running {name}...", file=sys.stderr)
+        report['results'][name] = BENCHMARKS[name](args.quick)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
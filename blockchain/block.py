@@ -1,32 +1,146 @@
+import hashlib
+import json
+import struct
 import time
-from utils.hash_util import calculate_hash
+from blockchain.merkle import MerkleTree
+from blockchain.transaction import Transaction
+from mining.difficulty import INITIAL_TARGET, target_to_hex, target_from_hex
+
+# fixed-size header: index, previous hash, timestamp, merkle root, target, nonce
+HEADER_PREFIX_FORMAT = '>Q32sd32s32s'
+NONCE_FORMAT = '>Q'
+HEADER_SIZE = struct.calcsize(HEADER_PREFIX_FORMAT) + struct.calcsize(NONCE_FORMAT)
+
+# fixed so every node starts from the same genesis block
+GENESIS_TIMESTAMP = 1735689600.0
+
+
+def hash_to_bytes(hex_hash):
+    # packing a hex digest into 32 bytes, short values like the genesis "0" are zero-padded
+    return bytes.fromhex(hex_hash.rjust(64, '0'))
+
 
 class Block:
-    def __init__(self, index, previous_hash, transactions, timestamp=None, nonce=0):
+    # fixed attribute set, no per-instance __dict__
+    __slots__ = ('index', 'timestamp', 'previous_hash', 'transactions', 'nonce', 'target',
+                 'merkle_tree', 'merkle_root', 'hash')
+
+    def __init__(self, index, previous_hash, transactions, timestamp=None, nonce=0, target=INITIAL_TARGET):
         self.index = index
         self.timestamp = timestamp if timestamp else time.time()
         self.previous_hash = previous_hash
-        self.transactions = transactions
+        self.transactions = tuple(transactions)
         self.nonce = nonce
+        # the hash has to be at most this 256-bit integer, recorded in the header
+        self.target = target
+        self.merkle_tree = self.build_merkle_tree()
+        self.merkle_root = self.merkle_tree.root
         self.hash = self.calculate_block_hash()
-        
-    def calculate_block_hash(self):
-        # generating the hash for the block using all key attributes
-        return calculate_hash(
+
+    @classmethod
+    def from_header(cls, header):
+        # a header-only block, standing in for a block whose state came from a snapshot
+        block = cls.__new__(cls)
+        block.index = header['index']
+        block.timestamp = header['timestamp']
+        block.previous_hash = header['previous_hash']
+        block.transactions = ()
+        block.nonce = header['nonce']
+        block.target = target_from_hex(header['target'])
+        block.merkle_tree = None
+        block.merkle_root = header['merkle_root']
+        block.hash = header['hash']
+        return block
+
+    def has_body(self):
+        return self.merkle_tree is not None
+
+    def build_merkle_tree(self):
+        # building the tree over the txids once, the header only commits to its root
+        return MerkleTree([tx.calculate_txid() for tx in self.transactions])
+
+    def get_transaction_proof(self, position):
+        # inclusion proof for the transaction at the given position
+        return self.merkle_tree.get_proof(position)
+
+    def header_prefix(self):
+        # everything in the header except the nonce, constant while mining
+        return struct.pack(
+            HEADER_PREFIX_FORMAT,
             self.index,
-            self.previous_hash,
-            self.timestamp,
-            self.transactions,
-            self.nonce
+            hash_to_bytes(self.previous_hash),
+            float(self.timestamp),
+            hash_to_bytes(self.merkle_root),
+            self.target.to_bytes(32, 'big')
         )
-    
+
+    def calculate_block_hash(self):
+        # generating the hash for the block from its fixed-size header
+        header = self.header_prefix() + struct.pack(NONCE_FORMAT, self.nonce)
+        return hashlib.sha256(header).hexdigest()
+
+    @staticmethod
+    def hash_header(header):
+        # recomputing a block hash from header fields alone, no body needed
+        packed = struct.pack(
+            HEADER_PREFIX_FORMAT,
+            header['index'],
+            hash_to_bytes(header['previous_hash']),
+            float(header['timestamp']),
+            hash_to_bytes(header['merkle_root']),
+            hash_to_bytes(header['target'])
+        ) + struct.pack(NONCE_FORMAT, header['nonce'])
+        return hashlib.sha256(packed).hexdigest()
+
+    def header(self):
+        # the header fields, enough to re-check the hash and the merkle root
+        return {
+            'index': self.index,
+            'timestamp': self.timestamp,
+            'previous_hash': self.previous_hash,
+            'merkle_root': self.merkle_root,
+            'target': target_to_hex(self.target),
+            'nonce': self.nonce,
+            'hash': self.hash
+        }
+
+    def canonical_json(self):
+        # the sorted-keys serialization, stitched from the transactions' cached ones
+        # so only the small header is encoded again
+        header_json = json.dumps(self.header(), sort_keys=True)
+        if not self.has_body():
+            return header_json
+        # "transactions" sorts after every header key, so appending it keeps the order canonical
+        transactions_json = ', '.join(tx.canonical_json() for tx in self.transactions)
+        return header_json[:-1] + ', "transactions": [' + transactions_json + ']}'
+
     def to_dict(self):
         # converting block into a dictionary, mostly for serialization
+        if not self.has_body():
+            return self.header()
         return {
             'index': self.index,
             'timestamp': self.timestamp,
             'previous_hash': self.previous_hash,
             'transactions': [tx.to_dict() for tx in self.transactions],
+            'merkle_root': self.merkle_root,
+            'target': target_to_hex(self.target),
             'nonce': self.nonce,
             'hash': self.hash
         }
+
+    @classmethod
+    def from_dict(cls, block_data):
+        # rebuilding a block, keeping the hash it claims so validation can compare
+        if 'transactions' not in block_data:
+            return cls.from_header(block_data)
+        block = cls(
+            index=block_data['index'],
+            previous_hash=block_data['previous_hash'],
+            transactions=[Transaction.from_dict(tx) for tx in block_data['transactions']],
+            timestamp=block_data['timestamp'],
+            nonce=block_data['nonce'],
+            target=target_from_hex(block_data['target'])
+        )
+        block.hash = block_data.get('hash', block.hash)
+        return block
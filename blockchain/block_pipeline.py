@@ -0,0 +1,152 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from blockchain.block import Block
+from blockchain.orphan_pool import OrphanPool
+from blockchain.validation import check_block, check_block_header
+from mining.difficulty import MAX_FUTURE_DRIFT
+from utils.metrics import registry
+
+# where fork choice put a block, passed to the submit callback
+EXTENDED = 'extended'
+REORGANIZED = 'reorganized'
+SIDE = 'side'
+ORPHAN = 'orphan'
+DUPLICATE = 'duplicate'
+INVALID = 'invalid'
+
+blocks_received = registry.counter('blocks_received_total', 'Fork choice outcomes of received blocks', ['result'])
+block_queue_depth = registry.gauge('block_queue_depth', 'Received blocks waiting for checks')
+orphan_blocks = registry.gauge('orphan_blocks', 'Checked blocks waiting for their parent')
+
+
+def _check(block_data):
+    # rebuilding the block (txids and merkle tree) and checking hash and signatures, None when bad
+    try:
+        block = Block.from_dict(block_data)
+    except Exception:
+        return None
+    return block if check_block(block) else None
+
+
+class BlockPipeline:
+    # Received blocks get cheap header checks on the caller's thread, hashing and signature
+    # checks on a worker pool, then fork choice in arrival order
+
+    def __init__(self, blockchain, workers=None, batch_size=16, max_queue=256):
+        self.blockchain = blockchain
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=max_queue)
+        # blocks that passed every check but whose parent we do not have yet
+        self.orphans = OrphanPool()
+        self.executor = None
+        self.thread = None
+        self.running = False
+        self.lock = threading.Lock()
+        block_queue_depth.set_function(self.queue.qsize)
+        orphan_blocks.set_function(lambda: len(self.orphans))
+
+    def start(self):
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+            self.thread = threading.Thread(target=self._dispatch)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        with self.lock:
+            if not self.running:
+                return
+            self.running = False
+        self.thread.join(2.0)
+        self.executor.shutdown(wait=False)
+
+    def submit(self, block_data, callback=None, block=True, timeout=None):
+        # queueing a received block, callback(block, status) runs once fork choice has placed it
+        # an orphan reports ORPHAN right away and again once its parent shows up
+        # returns False only when the queue stays full, bad blocks are reported through the callback
+        if not self._precheck(block_data):
+            self._report(None, INVALID, callback)
+            return True
+
+        if not self.running:
+            self.start()
+        try:
+            self.queue.put((block_data, callback), block=block, timeout=timeout)
+            return True
+        except queue.Full:
+            return False
+
+    def _precheck(self, block_data):
+        if not isinstance(block_data, dict) or not check_block_header(block_data):
+            return False
+        if len(block_data['transactions']) > self.blockchain.max_block_transactions:
+            return False
+        return block_data['timestamp'] <= time.time() + MAX_FUTURE_DRIFT
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def _next_batch(self):
+        # waiting for one block, then taking whatever else is already queued
+        try:
+            batch = [self.queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _dispatch(self):
+        while self.running:
+            batch = self._next_batch()
+            if batch:
+                # cryptography releases the GIL, so blocks of a batch are checked in parallel
+                # while map hands the results back in arrival order for fork choice
+                results = self.executor.map(_check, [block_data for block_data, _ in batch])
+                for (_, callback), block in zip(batch, results):
+                    if block is None:
+                        self._report(None, INVALID, callback)
+                    else:
+                        self._connect(block, callback)
+
+            # parents may also arrive through headers-first sync rather than through here
+            for parent_hash in self.orphans.parents():
+                if self.blockchain.has_block(parent_hash):
+                    self._connect_children(parent_hash)
+
+    def _connect(self, block, callback):
+        status = self.blockchain.connect_block(block)
+        if status == ORPHAN:
+            self.orphans.add(block, callback)
+        self._report(block, status, callback)
+        if status in (EXTENDED, REORGANIZED, SIDE):
+            self._connect_children(block.hash)
+
+    def _connect_children(self, parent_hash):
+        # connecting orphans that were waiting for parent_hash, then their own children
+        waiting = [parent_hash]
+        while waiting:
+            for block, callback in self.orphans.pop_children(waiting.pop()):
+                status = self.blockchain.connect_block(block)
+                self._report(block, status, callback)
+                if status in (EXTENDED, REORGANIZED, SIDE):
+                    waiting.append(block.hash)
+
+    def _report(self, block, status, callback):
+        blocks_received.labels(status).inc()
+        if callback:
+            try:
+                callback(block, status)
+            except Exception as e:
+                print(f"Error in block callback: {str(e)}")
@@ -0,0 +1,214 @@
+import json
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+from blockchain.block import Block, hash_to_bytes
+
+# one fixed-size index record per block: the header plus where its body lives
+# index, timestamp, nonce, previous hash, merkle root, hash, target, body offset, body length
+INDEX_RECORD = struct.Struct('>QdQ32s32s32s32sQI')
+
+# version 2 added the target to the header, stores from before it are not read
+SEGMENT_FILE = 'blocks.v2.dat'
+INDEX_FILE = 'blocks.v2.idx'
+
+
+class BlockStore:
+    # Append-only block segment file with a memory-mapped offset index
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.segment = open(os.path.join(directory, SEGMENT_FILE), 'ab+')
+        self.index = open(os.path.join(directory, INDEX_FILE), 'ab+')
+        self.index_map = None
+        self.count = 0
+        self.heights_by_hash = {}
+        self._recover()
+
+    def _recover(self):
+        # dropping a torn record left behind by a crash in the middle of an append
+        index_size = os.fstat(self.index.fileno()).st_size
+        segment_size = os.fstat(self.segment.fileno()).st_size
+        count = index_size // INDEX_RECORD.size
+
+        self._remap(count)
+        while count > 0:
+            offset, length = self._unpack(count - 1)[7:9]
+            if offset + length <= segment_size:
+                break
+            count -= 1
+
+        if count * INDEX_RECORD.size != index_size:
+            self.index.truncate(count * INDEX_RECORD.size)
+        self._remap(count)
+
+        # only the hashes are read at startup, bodies stay on disk until asked for
+        for height in range(count):
+            self.heights_by_hash[self._unpack(height)[5].hex()] = height
+
+    def _remap(self, count):
+        if self.index_map is not None:
+            self.index_map.close()
+            self.index_map = None
+        self.count = count
+        if count:
+            self.index_map = mmap.mmap(self.index.fileno(), count * INDEX_RECORD.size,
+                                       access=mmap.ACCESS_READ)
+
+    def _unpack(self, height):
+        return INDEX_RECORD.unpack_from(self.index_map, height * INDEX_RECORD.size)
+
+    def __len__(self):
+        return self.count
+
+    def append(self, block):
+        self.extend([block])
+
+    def extend(self, blocks):
+        # appending several blocks with one fsync per file, e.g. the headers below a snapshot
+        with self.lock:
+            self.segment.seek(0, os.SEEK_END)
+            offset = self.segment.tell()
+            records = []
+            for block in blocks:
+                body = block.canonical_json().encode()
+                self.segment.write(body)
+                records.append(INDEX_RECORD.pack(
+                    block.index,
+                    float(block.timestamp),
+                    block.nonce,
+                    hash_to_bytes(block.previous_hash),
+                    hash_to_bytes(block.merkle_root),
+                    hash_to_bytes(block.hash),
+                    block.target.to_bytes(32, 'big'),
+                    offset,
+                    len(body)
+                ))
+                offset += len(body)
+            self.segment.flush()
+            os.fsync(self.segment.fileno())
+
+            # the index records go last so a crash never points at a missing body
+            self.index.write(b''.join(records))
+            self.index.flush()
+            os.fsync(self.index.fileno())
+
+            for height, block in enumerate(blocks, self.count):
+                self.heights_by_hash[block.hash] = height
+            self._remap(self.count + len(records))
+
+    def read_header(self, height):
+        with self.lock:
+            index, timestamp, nonce, previous_hash, merkle_root, block_hash, target = self._unpack(height)[:7]
+        return {
+            'index': index,
+            'timestamp': timestamp,
+            'previous_hash': "0" if index == 0 else previous_hash.hex(),
+            'merkle_root': merkle_root.hex(),
+            'target': target.hex(),
+            'nonce': nonce,
+            'hash': block_hash.hex()
+        }
+
+    def read_block(self, height):
+        with self.lock:
+            offset, length = self._unpack(height)[7:9]
+            body = os.pread(self.segment.fileno(), length, offset)
+        return Block.from_dict(json.loads(body))
+
+    def height_of(self, block_hash):
+        return self.heights_by_hash.get(block_hash)
+
+    def truncate(self, height):
+        # cutting the store back so it holds only blocks below height
+        with self.lock:
+            if height >= self.count:
+                return
+            offset = self._unpack(height)[7]
+            for h in range(height, self.count):
+                self.heights_by_hash.pop(self._unpack(h)[5].hex(), None)
+
+            self._remap(0)
+            self.index.truncate(height * INDEX_RECORD.size)
+            self.segment.truncate(offset)
+            self.index.flush()
+            self.segment.flush()
+            self._remap(height)
+
+    def close(self):
+        with self.lock:
+            self._remap(0)
+            self.segment.close()
+            self.index.close()
+
+
+class StoredChain:
+    # List-like view of a BlockStore that faults block bodies in on access
+
+    def __init__(self, store, cache_size=256):
+        self.store = store
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.store)
+
+    def _resolve(self, height):
+        if height < 0:
+            height += len(self.store)
+        if height < 0 or height >= len(self.store):
+            raise IndexError("chain index out of range")
+        return height
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(len(self)))]
+
+        height = self._resolve(item)
+        with self.cache_lock:
+            block = self.cache.get(height)
+            if block is not None:
+                self.cache.move_to_end(height)
+                return block
+
+        block = self.store.read_block(height)
+        self._cache(height, block)
+        return block
+
+    def __iter__(self):
+        for height in range(len(self)):
+            yield self[height]
+
+    def _cache(self, height, block):
+        with self.cache_lock:
+            self.cache[height] = block
+            self.cache.move_to_end(height)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def append(self, block):
+        self.store.append(block)
+        self._cache(len(self) - 1, block)
+
+    def extend(self, blocks):
+        # written in one go and not cached, this is for bulk loads
+        self.store.extend(blocks)
+
+    def header(self, height):
+        return self.store.read_header(self._resolve(height))
+
+    def height_of(self, block_hash):
+        return self.store.height_of(block_hash)
+
+    def truncate(self, height):
+        # dropping every block from height upwards
+        with self.cache_lock:
+            for cached_height in [h for h in self.cache if h >= height]:
+                del self.cache[cached_height]
+        self.store.truncate(height)
+
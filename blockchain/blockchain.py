@@ -1,19 +1,110 @@
-from blockchain.block import Block
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from blockchain.block import Block, GENESIS_TIMESTAMP
 from blockchain.transaction import Transaction
 from mining.proof_of_work import ProofOfWork
-from blockchain.voter_registry import VoterRegistry
+from blockchain.voter_registry import VoterRegistry, voter_digest
+from blockchain.digest_set import DigestSet
+from blockchain.tally import TallyIndex
+from blockchain.verifier import SignatureVerifier
+from blockchain.mempool import Mempool
+from blockchain.block_store import StoredChain
+from blockchain.block_pipeline import BlockPipeline, EXTENDED, REORGANIZED, SIDE, ORPHAN, DUPLICATE, INVALID
+from blockchain.validation import check_block, check_block_batch, check_linkage, check_vote
+from blockchain.snapshot import Snapshot, SNAPSHOT_INTERVAL, SNAPSHOT_CONFIRMATIONS
+from mining.difficulty import (
+    INITIAL_TARGET, BLOCK_INTERVAL, RETARGET_WINDOW, MAX_FUTURE_DRIFT,
+    next_target, check_retarget, target_from_hex, work_of
+)
+from utils.metrics import registry
+
+# node state exported on /metrics, gauges are read from the blockchain when scraped
+chain_height = registry.gauge('chain_height', 'Index of the tip block')
+mempool_transactions = registry.gauge('mempool_transactions', 'Transactions waiting to be mined')
+mempool_bytes = registry.gauge('mempool_bytes', 'Serialized size of the mempool')
+verify_queue_depth = registry.gauge('verify_queue_depth', 'Transactions waiting for signature checks')
+transactions_seen = registry.counter('transactions_total', 'Transactions through the verifier', ['result'])
+validation_seconds = registry.histogram('chain_validation_seconds', 'Time spent in is_chain_valid', ['mode'])
+tip_work = registry.gauge('chain_tip_work', 'Expected hashes to mine a block at the tip target')
+reorgs = registry.counter('chain_reorgs_total', 'Switches to a branch with more work')
+reorg_depth = registry.histogram('chain_reorg_depth', 'Blocks taken off the chain per reorg',
+                                 buckets=(1, 2, 3, 5, 10, 20, 50, 100, 500))
+
+# blocks off the main chain kept around in case their branch overtakes it
+MAX_SIDE_BLOCKS = 500
+# seconds add_transaction waits for a place in the verification queue and again for the verdict
+VERIFY_TIMEOUT = 10.0
 
 class Blockchain:
-    def __init__(self):
+    def __init__(self, mining_workers=1, store=None, voter_registry=None, block_interval=BLOCK_INTERVAL,
+                 snapshots=None):
         # initializing chain, mempool, and difficulty
         # setting up voter tracking and network node
-        self.chain = []
-        self.pending_transactions = []
-        self.mining_difficulty = 4
-        self.voter_registry = VoterRegistry()
-        self.votes_cast = set()
+        # with a block store the chain lives on disk and survives restarts
+        self.store = store
+        self.chain = StoredChain(store) if store is not None else []
+        self.mempool = Mempool(on_evict=self._on_mempool_evict)
+        # called with each accepted vote that aged out of the mempool unmined
+        self.evict_listeners = []
+        # caps on what a single block may carry
+        self.max_block_transactions = 1000
+        self.max_block_bytes = 1024 * 1024
+        # retargeting aims for one block every block_interval seconds, starting from initial_target
+        self.block_interval = block_interval
+        self.initial_target = INITIAL_TARGET
+        self.mining_workers = mining_workers
+        self.current_miner = None
+        self.last_hash_rate = 0.0
+        self.transaction_locations = {}
+        self.tally = TallyIndex()
+        self.verifier = SignatureVerifier()
+        self.voter_registry = voter_registry if voter_registry is not None else VoterRegistry()
+        # voters with a vote in the chain or the mempool, keyed by public key digest
+        self.votes_cast = DigestSet(key=voter_digest)
         self.network_node = None
-        self._create_genesis_block()
+        self.derived_state_lock = threading.Lock()
+        self.derived_state_ready = True
+        # indexing transactions under the snapshot the derived state was resumed from
+        self.history_indexer = None
+        # blocks up to this height have already passed is_chain_valid
+        self.validated_height = 0
+        self.validation_lock = threading.Lock()
+        # guarding every change to the chain, mining and peer threads both extend it
+        self.chain_lock = threading.RLock()
+        self.block_heights = dict(store.heights_by_hash) if store is not None else {}
+        # cumulative work up to each height, fork choice follows the chain with the most
+        self.chain_work = []
+        # block hash -> (block, cumulative work) for blocks on other branches, oldest first
+        self.side_blocks = OrderedDict()
+        # checks and fork choice for blocks received from peers
+        self.block_pipeline = BlockPipeline(self)
+        # with a snapshot store, derived state is written out every snapshot_interval blocks
+        self.snapshots = snapshots
+        self.snapshot_interval = SNAPSHOT_INTERVAL
+        self.snapshot_lock = threading.Lock()
+        # blocks up to base_height are headers only, their state came from the base snapshot
+        self.base_height = 0
+
+        chain_height.set_function(lambda: len(self.chain) - 1)
+        mempool_transactions.set_function(lambda: len(self.mempool))
+        mempool_bytes.set_function(lambda: self.mempool.total_bytes)
+        verify_queue_depth.set_function(self.verifier.pending)
+        tip_work.set_function(lambda: work_of(target_from_hex(self.get_header(len(self.chain) - 1)['target'])))
+
+        if len(self.chain) == 0:
+            self._create_genesis_block()
+        else:
+            # only headers were read from disk, the indexes are rebuilt on first use
+            self.derived_state_ready = False
+            base = snapshots.base() if snapshots is not None else None
+            if base is not None and base['height'] < len(self.chain) and \
+                    self.get_header(base['height'])['hash'] == base['hash']:
+                self.base_height = base['height']
+                self.validated_height = base['height']
+                self.voter_registry.load_snapshot_voters(Snapshot(base['path']).registered_digests())
         
     def set_network_node(self, node):
         # setting the node reference for network communication
@@ -21,22 +112,362 @@ class Blockchain:
         
     def _create_genesis_block(self):
         # creating the first block of the chain with index 0 and empty txns
-        genesis_block = Block(0, "0", [])
-        self.chain.append(genesis_block)
+        genesis_block = Block(0, "0", [], timestamp=GENESIS_TIMESTAMP)
+        self._append_block(genesis_block)
         return genesis_block
+
+    def _ensure_derived_state(self):
+        # rebuilding tally, tx locations and votes cast from a chain loaded from disk
+        if self.derived_state_ready:
+            return
+        with self.derived_state_lock:
+            if not self.derived_state_ready:
+                self._rebuild_derived_state()
+                self.derived_state_ready = True
+
+    def _resume_snapshot(self):
+        # the newest snapshot we took of our own chain that is still on it, else the base if there is one
+        if self.snapshots is None:
+            return None
+        for info in self.snapshots.local():
+            if self.base_height < info['height'] < len(self.chain) and \
+                    self.get_header(info['height'])['hash'] == info['hash']:
+                return Snapshot(info['path'])
+        if self.base_height:
+            return Snapshot(self.snapshots.base()['path'])
+        return None
+
+    def _rebuild_derived_state(self):
+        # starting from the newest usable snapshot, then replaying only the blocks above it
+        self.transaction_locations = {}
+        self.chain_work = []
+        votes_cast = DigestSet(key=voter_digest)
+        snapshot = self._resume_snapshot()
+        if snapshot is not None:
+            votes_cast.update(snapshot.voted_digests())
+            self.tally.load(snapshot.vote_counts, snapshot.height)
+            for height in range(snapshot.height + 1):
+                self._add_chain_work(target_from_hex(self.get_header(height)['target']))
+        else:
+            self.tally.load({}, -1)
+
+        chain_voters = []
+        for height in range(len(self.chain_work), len(self.chain)):
+            block = self.chain[height]
+            self._index_block_transactions(block)
+            self._add_chain_work(block.target)
+            self.tally.apply_block(block)
+            for transaction in block.transactions:
+                if transaction.sender != "BLOCKCHAIN_REWARD":
+                    chain_voters.append(voter_digest(transaction.sender))
+        votes_cast.update(chain_voters)
+
+        # dropping pending votes from voters whose vote is already in a block
+        self.mempool.remove_senders([s for s in self.mempool.senders() if s in votes_cast])
+        votes_cast.update(self.mempool.senders())
+        self.votes_cast = votes_cast
+
+        # blocks under a snapshot of our own still have bodies, their transactions are indexed in the background
+        if snapshot is not None and snapshot.height > self.base_height:
+            self.history_indexer = threading.Thread(
+                target=self._index_history, args=(self.base_height + 1, snapshot.height + 1)
+            )
+            self.history_indexer.daemon = True
+            self.history_indexer.start()
+
+    def _index_history(self, start, stop):
+        # a block at a time under the chain lock, always the block now at that height
+        for height in range(start, stop):
+            with self.chain_lock:
+                if height >= len(self.chain):
+                    return
+                self._index_block_transactions(self.chain[height])
+
+    @property
+    def pending_transactions(self):
+        # snapshot of the mempool, oldest first
+        return self.mempool.transactions()
+
+    def _on_mempool_evict(self, transaction):
+        # a vote that aged out was never counted, so the voter may submit again
+        self.votes_cast.discard(transaction.sender)
+        for listener in self.evict_listeners:
+            listener(transaction)
+
+    def _append_block(self, block):
+        # adding a block to the chain and indexing where its transactions live
+        self._ensure_derived_state()
+        # counting first, so a block the tally cannot take never reaches the chain
+        self.tally.apply_block(block)
+        try:
+            self.chain.append(block)
+        except Exception:
+            self.tally.revert_block(block)
+            raise
+        self.block_heights[block.hash] = block.index
+        self.side_blocks.pop(block.hash, None)
+        self._index_block_transactions(block)
+        self._add_chain_work(block.target)
+        self._schedule_snapshot(block.index)
+
+    def _add_chain_work(self, target):
+        previous = self.chain_work[-1] if self.chain_work else 0
+        self.chain_work.append(previous + work_of(target))
+
+    def _index_block_transactions(self, block):
+        for position, transaction in enumerate(block.transactions):
+            self.transaction_locations[transaction.calculate_txid()] = (block.index, position)
+
+    def try_switch_branch(self, fork_height, branch):
+        # switching to our chain up to fork_height plus branch if that carries more work,
+        # only the branch needs checking and only the blocks above the fork are rewound
+        with self.chain_lock:
+            if not branch or fork_height >= len(self.chain):
+                return False
+            if not check_linkage([self.get_header(fork_height)] + [block.header() for block in branch]):
+                return False
+            if not all(check_block(block) for block in branch):
+                return False
+            if not self.check_header_targets([block.header() for block in branch]):
+                return False
+
+            if not self._reorganize(fork_height, branch):
+                return False
+
+        self.abort_mining()
+        return True
+
+    def submit_block(self, block_data, callback=None, block=True, timeout=None):
+        # handing a block received from a peer to the block pipeline
+        # returns False when the pipeline queue stays full
+        return self.block_pipeline.submit(block_data, callback, block=block, timeout=timeout)
+
+    def has_block(self, block_hash):
+        return block_hash in self.block_heights or block_hash in self.side_blocks
+
+    def chain_work_at(self, height):
+        self._ensure_derived_state()
+        return self.chain_work[height]
+
+    def connect_block(self, block):
+        # fork choice for a block that passed check_block: extend the tip, keep it on a side
+        # branch, or switch to its branch once that carries more work than ours
+        with self.chain_lock:
+            self._ensure_derived_state()
+            if self.has_block(block.hash):
+                return DUPLICATE
+            if block.timestamp > time.time() + MAX_FUTURE_DRIFT:
+                return INVALID
+
+            parent_height = self.height_of(block.previous_hash)
+            parent_side = self.side_blocks.get(block.previous_hash)
+            if parent_height is None and parent_side is None:
+                return ORPHAN
+            parent_index = parent_height if parent_height is not None else parent_side[0].index
+            if block.index != parent_index + 1:
+                return INVALID
+
+            history = self._ancestor_headers(block.previous_hash)
+            if history is None or not self.check_header_targets([block.header()], history):
+                return INVALID
+
+            if parent_height == len(self.chain) - 1:
+                if not self._has_only_new_votes(block):
+                    return INVALID
+                self._connect_tip(block)
+                status = EXTENDED
+            else:
+                parent_work = self.chain_work[parent_height] if parent_height is not None else parent_side[1]
+                work = parent_work + work_of(block.target)
+                self._add_side_block(block, work)
+                # equal work keeps the branch we saw first
+                if work <= self.chain_work[-1] or not self._reorganize_to(block.hash):
+                    return SIDE
+                status = REORGANIZED
+
+        self.abort_mining()
+        return status
+
+    def _ancestor_headers(self, block_hash):
+        # the retarget window ending at block_hash, which may sit on a side branch
+        headers = []
+        while block_hash in self.side_blocks and len(headers) <= RETARGET_WINDOW:
+            block = self.side_blocks[block_hash][0]
+            headers.append(block.header())
+            block_hash = block.previous_hash
+        headers.reverse()
+        if len(headers) > RETARGET_WINDOW:
+            return headers
+
+        height = self.height_of(block_hash)
+        if height is None:
+            # an ancestor was evicted from the side blocks, the branch can no longer be checked
+            return None
+        return (self.retarget_history(height + 1) + headers)[-(RETARGET_WINDOW + 1):]
+
+    def _add_side_block(self, block, work):
+        self.side_blocks[block.hash] = (block, work)
+        while len(self.side_blocks) > MAX_SIDE_BLOCKS:
+            self.side_blocks.popitem(last=False)
+
+    def _reorganize_to(self, block_hash):
+        # walking the side branch ending at block_hash back to where it leaves our chain
+        branch = []
+        while block_hash in self.side_blocks:
+            block = self.side_blocks[block_hash][0]
+            branch.append(block)
+            block_hash = block.previous_hash
+        fork_height = self.height_of(block_hash)
+        if fork_height is None:
+            return False
+        branch.reverse()
+        return self._reorganize(fork_height, branch)
+
+    def _reorganize(self, fork_height, branch):
+        # rewinding to fork_height and applying branch, whose blocks already passed check_block
+        # and the target checks; the mempool, tally and votes cast are updated block by block
+        self._ensure_derived_state()
+        # the blocks below the base snapshot have no bodies to rewind
+        if fork_height < self.base_height:
+            return False
+        old_blocks = [self.chain[height] for height in range(fork_height + 1, len(self.chain))]
+        old_work = self.chain_work[fork_height + 1:]
+        rewound_voters = set()
+        for block in old_blocks:
+            rewound_voters.update(tx.sender for tx in block.transactions if tx.sender != "BLOCKCHAIN_REWARD")
+
+        # every voter may appear at most once in the chain as it would be after the switch,
+        # only the valid prefix of the branch is kept
+        branch_voters = set()
+        valid = 0
+        for block in branch:
+            voters = [tx.sender for tx in block.transactions if tx.sender != "BLOCKCHAIN_REWARD"]
+            if len(set(voters)) != len(voters) or any(
+                    voter in branch_voters or (
+                        voter in self.votes_cast and not self.mempool.has_sender(voter)
+                        and voter not in rewound_voters
+                    ) for voter in voters):
+                break
+            branch_voters.update(voters)
+            valid += 1
+        for block in branch[valid:]:
+            self.side_blocks.pop(block.hash, None)
+        branch = branch[:valid]
+
+        work = self.chain_work[fork_height] + sum(work_of(block.target) for block in branch)
+        if not branch or work <= self.chain_work[-1]:
+            return False
+
+        for block in reversed(old_blocks):
+            self._rewind_block(block)
+        self._truncate_chain(fork_height + 1)
+        for block in branch:
+            self._connect_tip(block)
+
+        # the switched-away blocks stay as a side branch, their votes go back to the mempool
+        for block, block_work in zip(old_blocks, old_work):
+            self._add_side_block(block, block_work)
+            for transaction in block.transactions:
+                voter = transaction.sender
+                if voter == "BLOCKCHAIN_REWARD" or voter in self.votes_cast:
+                    continue
+                if self.mempool.add(transaction):
+                    self.votes_cast.add(voter)
+
+        with self.validation_lock:
+            self.validated_height = min(self.validated_height, fork_height)
+
+        reorgs.inc()
+        reorg_depth.observe(len(old_blocks))
+        return True
+
+    def _rewind_block(self, block):
+        # taking a tip block back out of every index, the chain itself is truncated afterwards
+        self.tally.revert_block(block)
+        for transaction in block.transactions:
+            self.transaction_locations.pop(transaction.calculate_txid(), None)
+            if transaction.sender != "BLOCKCHAIN_REWARD":
+                self.votes_cast.discard(transaction.sender)
+        self.block_heights.pop(block.hash, None)
+        self.chain_work.pop()
+
+    def _truncate_chain(self, height):
+        if self.store is not None:
+            self.chain.truncate(height)
+        else:
+            del self.chain[height:]
+
+    def get_vote_counts(self):
+        # current results straight from the tally index
+        self._ensure_derived_state()
+        vote_counts, _ = self.tally.snapshot()
+        return vote_counts
     
     def get_latest_block(self):
         # fetching the last block in the current chain
         return self.chain[-1]
     
-    def add_transaction(self, transaction):
-        # verifying the signature before doing anything else
-        if transaction.verify_signature():
-            voter_address = transaction.sender
+    def add_transaction(self, transaction, timeout=VERIFY_TIMEOUT):
+        # submitting to the verification stage and waiting for the verdict
+        # when the verifier does not answer in time the admission is cancelled, so a stalled
+        # verifier never hangs the caller and a vote reported as failed is not admitted later
+        done = threading.Event()
+        cancelled = threading.Event()
+        verdict = []
+
+        def on_verified(tx, accepted):
+            verdict.append(accepted)
+            done.set()
+
+        if not self.submit_transaction(transaction, on_verified, timeout=timeout, cancelled=cancelled):
+            return False
+        if done.wait(timeout):
+            return verdict[0]
+
+        # admission happens under the chain lock, so after this it either already happened or never will
+        with self.chain_lock:
+            cancelled.set()
+            txid = transaction.calculate_txid()
+            return txid in self.mempool or self.get_transaction_location(txid) is not None
+
+    def submit_transaction(self, transaction, callback=None, broadcast=True, block=True, timeout=None,
+                           cancelled=None):
+        # handing the transaction to the verifier without waiting for the result
+        # returns False when the verification queue stays full
+        return self.verifier.submit(
+            transaction,
+            lambda tx, valid: self._on_transaction_verified(tx, valid, callback, broadcast, cancelled),
+            block=block,
+            timeout=timeout
+        )
+
+    def _on_transaction_verified(self, transaction, valid, callback, broadcast, cancelled=None):
+        accepted = valid and self._admit_transaction(transaction, broadcast, cancelled)
+        transactions_seen.labels('accepted' if accepted else 'rejected').inc()
+        if callback:
+            callback(transaction, accepted)
 
-            # checking if the sender is in the registry
-            if not self.voter_registry.is_registered(voter_address):
-                print(f"Voter {voter_address} is not registered.")
+    def _admit_transaction(self, transaction, broadcast=True, cancelled=None):
+        # runs on the verifier thread once the signature has been checked
+        voter_address = transaction.sender
+
+        # only votes for a single named candidate are taken
+        if not check_vote(transaction):
+            print("Malformed vote rejected.")
+            return False
+
+        # checking if the sender is in the registry
+        if not self.voter_registry.is_registered(voter_address):
+            print(f"Voter {voter_address} is not registered.")
+            return False
+
+        # the duplicate check and the add happen under the chain lock so a block
+        # connecting the same voter in between cannot let the vote be counted twice
+        self._ensure_derived_state()
+        with self.chain_lock:
+            # the caller already gave up waiting and reported the vote as failed
+            if cancelled is not None and cancelled.is_set():
+                print("Verification timed out, vote not admitted.")
                 return False
 
             # preventing the same voter from voting more than once
@@ -45,16 +476,16 @@ class Blockchain:
                 return False
 
             # adding transaction to the mempool and marking as voted
-            self.pending_transactions.append(transaction)
+            if not self.mempool.add(transaction):
+                print("Mempool is full, rejecting transaction.")
+                return False
             self.votes_cast.add(voter_address)
 
-            # broadcasting the transaction if a node is connected
-            if self.network_node:
-                self.network_node.broadcast_transaction(transaction)
+        # broadcasting the transaction if a node is connected
+        if broadcast and self.network_node:
+            self.network_node.broadcast_transaction(transaction)
 
-            return True
-
-        return False
+        return True
     
     def register_voter(self, voter_address):
         # adding a voter to the registry
@@ -67,48 +498,332 @@ class Blockchain:
             recipient=miner_address,
             data={"type": "REWARD", "amount": 1}
         )
-        self.pending_transactions.append(reward_transaction)
+        selected = self.mempool.select_for_block(
+            self.max_block_transactions - 1, self.max_block_bytes
+        )
+        transactions = selected + [reward_transaction]
         
         # creating the new block with pending transactions
         block = Block(
             index=len(self.chain),
             previous_hash=self.get_latest_block().hash,
-            transactions=self.pending_transactions
+            transactions=transactions,
+            target=self.next_target()
         )
         
         # doing the actual mining using proof of work
-        pow_algorithm = ProofOfWork(block, self.mining_difficulty)
-        mined_block = pow_algorithm.mine()
+        pow_algorithm = ProofOfWork(block, self.mining_workers)
+        self.current_miner = pow_algorithm
+        try:
+            mined_block = pow_algorithm.mine()
+        finally:
+            self.current_miner = None
+        self.last_hash_rate = pow_algorithm.hash_rate
+
+        # keeping the mempool as it is if mining got aborted
+        if mined_block is None:
+            return None
         
-        # saving the block to the chain
-        self.chain.append(mined_block)
+        # saving the block to the chain, unless a peer's block moved the tip meanwhile
+        with self.chain_lock:
+            if mined_block.previous_hash != self.get_latest_block().hash:
+                print("Chain tip changed while mining, discarding block")
+                return None
+            self._append_block(mined_block)
+
+            # clearing the mined transactions from the mempool
+            self._remove_from_mempool(mined_block)
 
         # letting the network know about the new block
         if self.network_node:
             self.network_node.broadcast_block(mined_block)
         
-        # clearing the mempool after mining
-        self.pending_transactions = []
-        
         return mined_block
-    
-    def is_chain_valid(self):
-        # walking through the chain to verify hashes and proof of work
-        for i in range(1, len(self.chain)):
-            current_block = self.chain[i]
-            previous_block = self.chain[i-1]
-            
-            # checking if the stored hash matches the recalculated one
-            if current_block.hash != current_block.calculate_block_hash():
+
+    def _remove_from_mempool(self, block):
+        # dropping pending transactions that are in the block or from voters it includes
+        self.mempool.remove_block(block)
+
+    def add_block(self, block):
+        # appending a block received from a peer if it extends our tip and checks out
+        with self.chain_lock:
+            latest_block = self.get_latest_block()
+            if block.previous_hash != latest_block.hash or block.index != latest_block.index + 1:
+                return False
+            if not self._has_only_new_votes(block):
+                return False
+            if block.timestamp > time.time() + MAX_FUTURE_DRIFT:
+                return False
+            if not check_block(block) or not self.check_header_targets([block.header()]):
+                return False
+
+            self._connect_tip(block)
+
+        # whatever we were mining on top of the old tip is stale now
+        self.abort_mining()
+        return True
+
+    def _connect_tip(self, block):
+        # appending a checked block from elsewhere and marking its voters as having voted
+        self._append_block(block)
+        self._remove_from_mempool(block)
+        for transaction in block.transactions:
+            if transaction.sender != "BLOCKCHAIN_REWARD":
+                self.votes_cast.add(transaction.sender)
+
+    def _has_only_new_votes(self, block):
+        # a voter may appear once in a block and never if already in the chain
+        self._ensure_derived_state()
+        seen = set()
+        for transaction in block.transactions:
+            voter = transaction.sender
+            if voter == "BLOCKCHAIN_REWARD":
+                continue
+            if voter in seen or (voter in self.votes_cast and not self.mempool.has_sender(voter)):
                 return False
+            seen.add(voter)
+        return True
+
+    def height_of(self, block_hash):
+        return self.block_heights.get(block_hash)
+
+    def get_header(self, height):
+        # reading a header without loading the body when the chain is on disk
+        if self.store is not None:
+            return self.chain.header(height)
+        return self.chain[height].header()
+
+    def get_headers(self, start, count):
+        with self.chain_lock:
+            end = min(len(self.chain), start + count)
+            return [self.get_header(height) for height in range(start, end)]
+
+    def retarget_history(self, height):
+        # headers of the blocks that set the target for the block at height, genesis left out
+        start = max(1, height - RETARGET_WINDOW - 1)
+        return [self.get_header(h) for h in range(start, height)]
+
+    def next_target(self, height=None):
+        # the target a block at height (by default the next one) has to carry
+        if height is None:
+            height = len(self.chain)
+        return next_target(self.retarget_history(height), self.block_interval, self.initial_target)
+
+    def check_header_targets(self, headers, history=None):
+        # headers follow history, or without it our own chain right below headers[0]
+        if history is None:
+            history = self.retarget_history(headers[0]['index'])
+        return check_retarget(headers, history, self.block_interval, self.initial_target)
+
+    def get_block_locator(self):
+        # tip hashes dense at first, then exponentially sparser back to genesis
+        with self.chain_lock:
+            locator = []
+            height = len(self.chain) - 1
+            step = 1
+            while height > 0:
+                locator.append(self.get_header(height)['hash'])
+                if len(locator) >= 10:
+                    step *= 2
+                height -= step
+            locator.append(self.get_header(0)['hash'])
+            return locator
+
+    def find_fork_point(self, locator):
+        # the highest locator hash we also have is where the two chains agree
+        for block_hash in locator:
+            height = self.height_of(block_hash)
+            if height is not None:
+                return height
+        return None
+
+    def get_transaction_location(self, tx_hash):
+        # (block index, position) of a mined transaction, or None
+        self._ensure_derived_state()
+        return self.transaction_locations.get(tx_hash)
+
+    def get_transaction_proof(self, tx_hash):
+        # building an inclusion proof of a transaction against its block header
+        self._ensure_derived_state()
+        location = self.transaction_locations.get(tx_hash)
+        if location is None:
+            return None
+
+        block_index, position = location
+        block = self.chain[block_index]
+        return {
+            'tx_hash': tx_hash,
+            'position': position,
+            'block': block.header(),
+            'proof': block.get_transaction_proof(position)
+        }
+
+    def _schedule_snapshot(self, height):
+        # snapshotting in the background every snapshot_interval blocks, a few blocks below the tip
+        snapshot_height = height - SNAPSHOT_CONFIRMATIONS
+        if self.snapshots is None or snapshot_height <= self.base_height or snapshot_height % self.snapshot_interval:
+            return
+        thread = threading.Thread(target=self.take_snapshot, args=(snapshot_height,))
+        thread.daemon = True
+        thread.start()
 
-            # making sure the chain is linked correctly
-            if current_block.previous_hash != previous_block.hash:
+    def take_snapshot(self, height=None):
+        # writing the registry, votes cast and tally as of height (by default a few blocks below the tip)
+        with self.snapshot_lock:
+            with self.chain_lock:
+                self._ensure_derived_state()
+                tip = len(self.chain) - 1
+                if height is None:
+                    height = tip - SNAPSHOT_CONFIRMATIONS
+                if height <= self.base_height or height > tip:
+                    return None
+                block_hash = self.get_header(height)['hash']
+
+                # taking back what the blocks above height added, and the votes only in the mempool
+                vote_counts, _ = self.tally.snapshot()
+                tally = TallyIndex()
+                tally.load(vote_counts, tip)
+                excluded = set(voter_digest(sender) for sender in self.mempool.senders())
+                for h in range(tip, height, -1):
+                    block = self.chain[h]
+                    tally.revert_block(block)
+                    for transaction in block.transactions:
+                        if transaction.sender != "BLOCKCHAIN_REWARD":
+                            excluded.add(voter_digest(transaction.sender))
+                vote_counts, _ = tally.snapshot()
+                # both are copies taken now, so writing them needs no lock
+                voted = self.votes_cast.digests()
+                registered = self.voter_registry.digests()
+
+            info = self.snapshots.write(
+                height, block_hash, vote_counts,
+                (digest for digest in voted if digest not in excluded), registered
+            )
+        print(f"Wrote state snapshot at height {height} ({info['size']} bytes)")
+        if self.network_node:
+            self.network_node.snapshot_sync.announce(info)
+        return info
+
+    def bootstrap(self, snapshot_info, headers):
+        # adopting a snapshot taken at headers[-1] instead of replaying the chain up to it:
+        # the headers go in without bodies and the state is loaded from the snapshot
+        snapshot = Snapshot(snapshot_info['path'])
+        with self.chain_lock:
+            if len(self.chain) != 1 or not headers or headers[0]['previous_hash'] != self.chain[0].hash:
                 return False
+            if headers[-1]['index'] != snapshot.height or headers[-1]['hash'] != snapshot.block_hash:
+                return False
+            self._ensure_derived_state()
+
+            self.snapshots.set_base(snapshot_info)
+            self.voter_registry.load_snapshot_voters(snapshot.registered_digests())
+
+            blocks = [Block.from_header(header) for header in headers]
+            self.chain.extend(blocks)
+            for block in blocks:
+                self.block_heights[block.hash] = block.index
+                self._add_chain_work(block.target)
+
+            votes_cast = DigestSet(key=voter_digest)
+            votes_cast.update(snapshot.voted_digests())
+            self.mempool.remove_senders([s for s in self.mempool.senders() if s in votes_cast])
+            votes_cast.update(self.mempool.senders())
+            self.votes_cast = votes_cast
+            self.tally.load(snapshot.vote_counts, snapshot.height)
+
+            self.base_height = snapshot.height
+            with self.validation_lock:
+                self.validated_height = snapshot.height
+
+        self.abort_mining()
+        print(f"Bootstrapped from the state snapshot at height {snapshot.height}")
+        return True
+
+    def replace_base(self, replay):
+        # the blocks below the base disagreed with the snapshot, their recount becomes the base
+        # instead, without the snapshot's voters since nothing on the chain backs them
+        block_hash = self.get_header(replay.height)['hash']
+        info = self.snapshots.write(replay.height, block_hash, replay.vote_counts(), replay.voted.digests(), ())
+        with self.chain_lock:
+            self.snapshots.set_base(info, verified=True)
+            # our own snapshots above it carried the old base's counts forward
+            self.snapshots.remove_local()
+            self.voter_registry.load_snapshot_voters(())
+            with self.derived_state_lock:
+                self._rebuild_derived_state()
+                self.derived_state_ready = True
+        print(f"Replaced the base snapshot at height {replay.height} with the recounted blocks")
+
+    def abort_mining(self):
+        # stopping the current proof of work search, if there is one
+        miner = self.current_miner
+        if miner is not None:
+            miner.abort()
+            return True
+        return False
+    
+    def is_chain_valid(self, full=False, workers=None):
+        with validation_seconds.labels('full' if full else 'incremental').time():
+            return self._check_chain(full, workers)
+
+    def _check_chain(self, full, workers):
+        # checking only blocks above the validated checkpoint unless a full audit is asked for
+        if full:
+            return self._audit_chain(workers)
+
+        with self.validation_lock:
+            tip = len(self.chain) - 1
+            start = min(self.validated_height, tip) + 1
+            previous_block = self.chain[start - 1]
+
+            for i in range(start, tip + 1):
+                current_block = self.chain[i]
 
-            # verifying that the PoW solution is still valid
-            pow_algorithm = ProofOfWork(current_block, self.mining_difficulty)
-            if not pow_algorithm.validate():
+                # making sure the chain is linked correctly
+                if current_block.previous_hash != previous_block.hash:
+                    return False
+
+                if not check_block(current_block):
+                    return False
+
+                previous_block = current_block
+
+            if tip >= start and not self.check_header_targets(
+                    [self.get_header(i) for i in range(start, tip + 1)]):
                 return False
 
+            self.validated_height = tip
+            return True
+
+    def _audit_chain(self, workers=None):
+        # spreading the per-block checks across processes, then checking linkage in order
+        workers = workers or os.cpu_count() or 1
+        tip = len(self.chain) - 1
+        if tip < 1:
+            return True
+
+        # below the base snapshot only the headers can be checked
+        blocks = [self.chain[i] for i in range(self.base_height + 1, tip + 1)]
+        # workers get the cached serialization, which pickles far cheaper than objects
+        payloads = [block.canonical_json() for block in blocks]
+        chunk_size = max(1, len(blocks) // (workers * 4))
+        chunks = [payloads[i:i + chunk_size] for i in range(0, len(payloads), chunk_size)]
+
+        if workers > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(check_block_batch, chunks))
+        else:
+            results = [check_block_batch(chunk) for chunk in chunks]
+
+        if any(result is not None for result in results):
+            return False
+
+        headers = [self.get_header(i) for i in range(self.base_height + 1)] + [block.header() for block in blocks]
+        if not check_linkage(headers):
+            return False
+        if not self.check_header_targets(headers[1:], history=[]):
+            return False
+
+        with self.validation_lock:
+            self.validated_height = tip
         return True
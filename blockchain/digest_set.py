@@ -0,0 +1,236 @@
+import heapq
+import mmap
+import os
+import tempfile
+import threading
+
+DIGEST_SIZE = 32
+
+
+def _records(buffer, count):
+    # iterating the fixed-size records of a sorted buffer in order
+    for i in range(count):
+        yield buffer[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE]
+
+
+def _file_records(path):
+    with open(path, 'rb') as f:
+        while True:
+            record = f.read(DIGEST_SIZE)
+            if len(record) < DIGEST_SIZE:
+                return
+            yield record
+
+
+class DigestSet:
+    # Set of 32-byte digests kept as one sorted array plus a small unsorted delta
+    # with a path the sorted array is a memory-mapped file and additions go to a log
+
+    def __init__(self, path=None, key=None, merge_threshold=4096):
+        # key turns the values callers pass in (e.g. PEM strings) into digests
+        self.path = path
+        self.key = key
+        self.merge_threshold = merge_threshold
+        self.lock = threading.RLock()
+        self.base = b''
+        self.base_count = 0
+        self.base_file = None
+        self.delta = set()
+        self.removed = set()
+        self.log = None
+
+        if path is not None:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._map_base()
+            self._replay_log()
+
+    def _digest(self, value):
+        return self.key(value) if self.key is not None and not isinstance(value, bytes) else value
+
+    def _map_base(self):
+        if self.base_file is not None:
+            if isinstance(self.base, mmap.mmap):
+                self.base.close()
+            self.base_file.close()
+            self.base_file = None
+        self.base, self.base_count = b'', 0
+
+        if not os.path.exists(self.path):
+            return
+        size = os.path.getsize(self.path)
+        if size < DIGEST_SIZE:
+            return
+        self.base_file = open(self.path, 'rb')
+        self.base = mmap.mmap(self.base_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.base_count = size // DIGEST_SIZE
+
+    def _replay_log(self):
+        # additions since the last merge, one digest per record, a leading 0 byte marks a removal
+        log_path = self.path + '.log'
+        if os.path.exists(log_path):
+            with open(log_path, 'rb') as f:
+                while True:
+                    record = f.read(DIGEST_SIZE + 1)
+                    if len(record) < DIGEST_SIZE + 1:
+                        break
+                    if record[0]:
+                        self._add(record[1:])
+                    else:
+                        self._discard(record[1:])
+        self.log = open(log_path, 'ab')
+
+    def _write_log(self, flag, digest):
+        if self.log is not None:
+            self.log.write(bytes([flag]) + digest)
+            self.log.flush()
+
+    def _base_contains(self, digest):
+        # binary search over the sorted records
+        base = self.base
+        lo, hi = 0, self.base_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            record = base[mid * DIGEST_SIZE:(mid + 1) * DIGEST_SIZE]
+            if record < digest:
+                lo = mid + 1
+            elif record > digest:
+                hi = mid
+            else:
+                return True
+        return False
+
+    def _contains(self, digest):
+        if digest in self.delta:
+            return True
+        return digest not in self.removed and self._base_contains(digest)
+
+    def __contains__(self, value):
+        digest = self._digest(value)
+        with self.lock:
+            return self._contains(digest)
+
+    def _add(self, digest):
+        if digest in self.removed:
+            self.removed.discard(digest)
+        elif not self._base_contains(digest):
+            self.delta.add(digest)
+
+    def _discard(self, digest):
+        if digest in self.delta:
+            self.delta.discard(digest)
+        elif self._base_contains(digest):
+            self.removed.add(digest)
+
+    def add(self, value):
+        # returns False if the digest was already present
+        digest = self._digest(value)
+        with self.lock:
+            if self._contains(digest):
+                return False
+            self._add(digest)
+            self._write_log(1, digest)
+            if len(self.delta) + len(self.removed) > max(self.merge_threshold, self.base_count // 8):
+                self._merge([])
+            return True
+
+    def discard(self, value):
+        digest = self._digest(value)
+        with self.lock:
+            if self._contains(digest):
+                self._discard(digest)
+                self._write_log(0, digest)
+
+    def update(self, values, chunk_size=1000000):
+        # bulk insert in one streaming pass: sorted runs of chunk_size, then a k-way merge
+        runs = []
+        chunk = []
+        try:
+            for value in values:
+                chunk.append(self._digest(value))
+                if len(chunk) >= chunk_size:
+                    runs.append(self._spill(chunk))
+                    chunk = []
+            with self.lock:
+                # folding pending removals in first so re-added digests are not dropped again
+                if self.removed:
+                    self._merge([])
+                before = len(self)
+                if chunk:
+                    chunk.sort()
+                    runs.append(chunk)
+                self._merge(runs)
+                return len(self) - before
+        finally:
+            for run in runs:
+                if isinstance(run, str):
+                    os.remove(run)
+
+    def _spill(self, chunk):
+        # writing a sorted run to a temporary file so memory stays bounded
+        chunk.sort()
+        fd, run_path = tempfile.mkstemp(suffix='.run')
+        with os.fdopen(fd, 'wb') as f:
+            for digest in chunk:
+                f.write(digest)
+        return run_path
+
+    def _merge(self, runs):
+        # folding delta, removals and any sorted runs into a new sorted array
+        sources = [_records(self.base, self.base_count), sorted(self.delta)]
+        for run in runs:
+            sources.append(_file_records(run) if isinstance(run, str) else run)
+        removed = self.removed
+
+        def merged():
+            previous = None
+            for digest in heapq.merge(*sources):
+                if digest != previous and digest not in removed:
+                    yield digest
+                previous = digest
+
+        if self.path is None:
+            self.base = b''.join(merged())
+            self.base_count = len(self.base) // DIGEST_SIZE
+        else:
+            directory = os.path.dirname(self.path) or '.'
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                for digest in merged():
+                    f.write(digest)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._map_base()
+            # everything in the log is now part of the base file
+            self.log.close()
+            self.log = open(self.path + '.log', 'wb')
+
+        self.delta = set()
+        self.removed = set()
+
+    def digests(self):
+        # every digest in sorted order, from a copy taken now so the set can change while it is read
+        with self.lock:
+            base = self.base[:self.base_count * DIGEST_SIZE]
+            base_count = self.base_count
+            delta = sorted(self.delta)
+            removed = set(self.removed)
+        return (digest for digest in heapq.merge(_records(base, base_count), delta) if digest not in removed)
+
+    def __len__(self):
+        with self.lock:
+            return self.base_count + len(self.delta) - len(self.removed)
+
+    def close(self):
+        with self.lock:
+            if self.log is not None:
+                self.log.close()
+                self.log = None
+            if isinstance(self.base, mmap.mmap):
+                self.base.close()
+            if self.base_file is not None:
+                self.base_file.close()
+                self.base_file = None
+            self.base, self.base_count = b'', 0
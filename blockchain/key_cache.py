@@ -0,0 +1,57 @@
+import threading
+from collections import OrderedDict
+from cryptography.hazmat.primitives import serialization
+from utils.metrics import registry
+
+# lookups exported on /metrics, hits are the parses the cache saved
+key_cache_lookups = registry.counter('key_cache_lookups_total', 'Public key lookups in the key cache', ['result'])
+key_cache_entries = registry.gauge('key_cache_entries', 'Parsed public keys held in the key cache')
+
+
+class KeyCache:
+    # Bounded LRU cache of parsed public keys, keyed by PEM text
+    # private keys are never cached, each voter signs once so a cache would only hold secrets
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hit_counter = key_cache_lookups.labels('hit')
+        self.miss_counter = key_cache_lookups.labels('miss')
+        key_cache_entries.set_function(lambda: len(self.entries))
+
+    def _put(self, key, key_obj):
+        with self.lock:
+            self.entries[key] = key_obj
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def _get(self, key, loader):
+        with self.lock:
+            key_obj = self.entries.get(key)
+            if key_obj is not None:
+                self.entries.move_to_end(key)
+                self.hit_counter.inc()
+                return key_obj
+        self.miss_counter.inc()
+
+        # parsing outside the lock so other lookups are not held up
+        key_obj = loader()
+        self._put(key, key_obj)
+        return key_obj
+
+    def get_public_key(self, public_key_pem):
+        return self._get(public_key_pem, lambda: serialization.load_pem_public_key(public_key_pem.encode()))
+
+    def put_public_key(self, public_key_pem, public_key):
+        # storing a public key that was derived rather than parsed
+        self._put(public_key_pem, public_key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+# shared by wallets, the web routes and the peer transaction path
+key_cache = KeyCache()
@@ -0,0 +1,59 @@
+import queue
+import threading
+from blockchain.wallet import generate_key_pair, get_scheme, DEFAULT_SCHEME
+from utils.metrics import registry
+
+# pool figures exported on /metrics
+keys_available = registry.gauge('key_pool_available', 'Pre-generated key pairs ready for registration')
+keys_taken = registry.counter('key_pool_taken_total', 'Key pairs handed out', ['source'])
+
+
+class KeyPool:
+    # Key pairs generated ahead of time on a background thread, so registration only dequeues one
+
+    def __init__(self, scheme=DEFAULT_SCHEME, size=32):
+        # failing early on an unknown scheme rather than in the fill thread
+        get_scheme(scheme)
+        self.scheme = scheme
+        self.pairs = queue.Queue(maxsize=size)
+        self.thread = None
+        self.running = False
+        keys_available.set_function(self.pairs.qsize)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._fill)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(2.0)
+
+    def _fill(self):
+        # keeping the pool topped up, the put blocks while it is full
+        pair = None
+        while self.running:
+            if pair is None:
+                pair = generate_key_pair(self.scheme)
+            try:
+                self.pairs.put(pair, timeout=0.5)
+                pair = None
+            except queue.Full:
+                continue
+
+    def take(self):
+        # (public_key, private_key), generated inline only when the pool has run dry
+        try:
+            pair = self.pairs.get_nowait()
+            keys_taken.labels('pool').inc()
+            return pair
+        except queue.Empty:
+            keys_taken.labels('inline').inc()
+            return generate_key_pair(self.scheme)
+
+    def __len__(self):
+        return self.pairs.qsize()
@@ -0,0 +1,127 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class Mempool:
+    # Pending transactions indexed by txid and sender, bounded by count, bytes and age
+
+    def __init__(self, max_count=50000, max_bytes=64 * 1024 * 1024, max_age=3600.0, on_evict=None):
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # called with each transaction that ages out, so callers can undo side effects
+        self.on_evict = on_evict
+        self.lock = threading.RLock()
+        # txid -> (transaction, size, added_at), oldest first
+        self.entries = OrderedDict()
+        self.by_sender = {}
+        self.total_bytes = 0
+
+    @staticmethod
+    def transaction_size(transaction):
+        return len(transaction.canonical_json())
+
+    def add(self, transaction):
+        # returns False for duplicates or when the pool is still full after expiring old entries
+        txid = transaction.calculate_txid()
+        size = self.transaction_size(transaction)
+
+        with self.lock:
+            if txid in self.entries:
+                return False
+            self.expire()
+            if len(self.entries) + 1 > self.max_count or self.total_bytes + size > self.max_bytes:
+                return False
+
+            self.entries[txid] = (transaction, size, time.time())
+            self.by_sender.setdefault(transaction.sender, set()).add(txid)
+            self.total_bytes += size
+            return True
+
+    def _remove(self, txid):
+        transaction, size, _ = self.entries.pop(txid)
+        txids = self.by_sender.get(transaction.sender)
+        if txids is not None:
+            txids.discard(txid)
+            if not txids:
+                del self.by_sender[transaction.sender]
+        self.total_bytes -= size
+        return transaction
+
+    def remove(self, txids):
+        with self.lock:
+            return [self._remove(txid) for txid in txids if txid in self.entries]
+
+    def remove_senders(self, senders):
+        # dropping every pending transaction from the given senders
+        with self.lock:
+            removed = []
+            for sender in senders:
+                for txid in list(self.by_sender.get(sender, ())):
+                    removed.append(self._remove(txid))
+            return removed
+
+    def remove_block(self, block):
+        # dropping what a block includes, plus anything else from the voters it includes
+        with self.lock:
+            self.remove(tx.calculate_txid() for tx in block.transactions)
+            self.remove_senders(set(tx.sender for tx in block.transactions))
+
+    def expire(self):
+        # evicting by age, entries are kept oldest first so only the front is checked
+        cutoff = time.time() - self.max_age
+        expired = []
+        with self.lock:
+            while self.entries:
+                txid, (_, _, added_at) = next(iter(self.entries.items()))
+                if added_at > cutoff:
+                    break
+                expired.append(self._remove(txid))
+
+        if self.on_evict:
+            for transaction in expired:
+                self.on_evict(transaction)
+        return expired
+
+    def select_for_block(self, max_txs, max_bytes):
+        # oldest first, skipping anything that would push the block over the byte limit
+        selected = []
+        used_bytes = 0
+        with self.lock:
+            for transaction, size, _ in self.entries.values():
+                if len(selected) >= max_txs:
+                    break
+                if used_bytes + size > max_bytes:
+                    continue
+                selected.append(transaction)
+                used_bytes += size
+        return selected
+
+    def oldest_added_at(self):
+        with self.lock:
+            if not self.entries:
+                return None
+            return next(iter(self.entries.values()))[2]
+
+    def get(self, txid):
+        with self.lock:
+            entry = self.entries.get(txid)
+            return entry[0] if entry else None
+
+    def has_sender(self, sender):
+        return sender in self.by_sender
+
+    def transactions(self):
+        with self.lock:
+            return [entry[0] for entry in self.entries.values()]
+
+    def senders(self):
+        with self.lock:
+            return set(self.by_sender)
+
+    def __contains__(self, txid):
+        return txid in self.entries
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,59 @@
+import hashlib
+
+# root used for a block without transactions
+EMPTY_ROOT = '0' * 64
+
+
+def _hash_pair(left, right):
+    return hashlib.sha256(left + right).digest()
+
+
+class MerkleTree:
+    def __init__(self, leaf_hashes):
+        # building every level once, leaves are the hex txids of the block
+        self.levels = [[bytes.fromhex(h) for h in leaf_hashes]]
+
+        while len(self.levels[-1]) > 1:
+            level = self.levels[-1]
+            # duplicating the last node when a level has an odd count
+            if len(level) % 2 == 1:
+                level = level + [level[-1]]
+            self.levels.append([
+                _hash_pair(level[i], level[i + 1]) for i in range(0, len(level), 2)
+            ])
+
+    @property
+    def root(self):
+        if not self.levels[0]:
+            return EMPTY_ROOT
+        return self.levels[-1][0].hex()
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    def get_proof(self, index):
+        # collecting the sibling at every level from the leaf up to the root
+        if index < 0 or index >= len(self):
+            raise IndexError("Leaf index out of range")
+
+        proof = []
+        for level in self.levels[:-1]:
+            if index % 2 == 0:
+                sibling = level[index + 1] if index + 1 < len(level) else level[index]
+                proof.append({'hash': sibling.hex(), 'position': 'right'})
+            else:
+                proof.append({'hash': level[index - 1].hex(), 'position': 'left'})
+            index //= 2
+        return proof
+
+
+def verify_merkle_proof(leaf_hash, proof, root):
+    # folding the proof into the leaf and comparing with the committed root
+    current = bytes.fromhex(leaf_hash)
+    for step in proof:
+        sibling = bytes.fromhex(step['hash'])
+        if step['position'] == 'left':
+            current = _hash_pair(sibling, current)
+        else:
+            current = _hash_pair(current, sibling)
+    return current.hex() == root
@@ -0,0 +1,66 @@
+import threading
+import time
+from collections import OrderedDict
+
+# checked blocks kept while their parent is missing, the oldest are dropped first
+MAX_ORPHANS = 100
+# seconds an orphan waits for its parent before it is forgotten
+ORPHAN_TTL = 600.0
+
+
+class OrphanPool:
+    # Checked blocks whose parent has not arrived yet, indexed by the parent they wait for
+
+    def __init__(self, max_orphans=MAX_ORPHANS, ttl=ORPHAN_TTL):
+        self.max_orphans = max_orphans
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # block hash -> (block, callback, expires), oldest first
+        self.entries = OrderedDict()
+        self.by_parent = {}
+
+    def _remove(self, block_hash):
+        block, callback, _ = self.entries.pop(block_hash)
+        children = self.by_parent.get(block.previous_hash)
+        if children is not None:
+            children.discard(block_hash)
+            if not children:
+                del self.by_parent[block.previous_hash]
+        return block, callback
+
+    def _expire(self, now):
+        while self.entries:
+            block_hash, (_, _, expires) = next(iter(self.entries.items()))
+            if expires > now:
+                break
+            self._remove(block_hash)
+
+    def add(self, block, callback=None):
+        # returns False for a block already waiting
+        now = time.time()
+        with self.lock:
+            self._expire(now)
+            if block.hash in self.entries:
+                return False
+            self.entries[block.hash] = (block, callback, now + self.ttl)
+            self.by_parent.setdefault(block.previous_hash, set()).add(block.hash)
+            while len(self.entries) > self.max_orphans:
+                self._remove(next(iter(self.entries)))
+            return True
+
+    def pop_children(self, parent_hash):
+        # (block, callback) of every orphan waiting for parent_hash, taken out of the pool
+        with self.lock:
+            return [self._remove(block_hash) for block_hash in list(self.by_parent.get(parent_hash, ()))]
+
+    def parents(self):
+        # the parent hashes orphans are waiting for
+        with self.lock:
+            self._expire(time.time())
+            return list(self.by_parent)
+
+    def __contains__(self, block_hash):
+        return block_hash in self.entries
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,309 @@
+import hashlib
+import os
+import shutil
+import struct
+import tempfile
+import threading
+from blockchain.digest_set import DigestSet
+from blockchain.tally import TallyIndex
+from blockchain.voter_registry import voter_digest
+
+# file layout: header, one record per candidate, then the voted and registered digests, each sorted
+SNAPSHOT_MAGIC = b'VSNP'
+SNAPSHOT_VERSION = 1
+# magic, version, height, block hash, candidate count, voted count, registered count
+SNAPSHOT_HEADER = struct.Struct('>4sBQ32sIQQ')
+# candidate name length, then the name in utf-8 and its vote count
+NAME_LENGTH = struct.Struct('>H')
+VOTE_COUNT = struct.Struct('>Q')
+DIGEST_SIZE = 32
+
+# a snapshot is taken every SNAPSHOT_INTERVAL blocks
+SNAPSHOT_INTERVAL = 1000
+# and that many blocks below the tip, so it is rarely on a branch that gets reorganized away
+SNAPSHOT_CONFIRMATIONS = 6
+# snapshots kept on disk besides the one the node bootstrapped from
+SNAPSHOT_KEEP = 2
+
+BASE_FILE = 'base.snap'
+# present once the base snapshot has been checked against the blocks it stands in for
+BASE_VERIFIED_FILE = 'base.verified'
+# file name prefixes telling the snapshots we wrote from the ones downloaded from peers
+LOCAL_PREFIX = 'snapshot'
+DOWNLOAD_PREFIX = 'download'
+
+
+def _write_digests(f, digests):
+    count = 0
+    for digest in digests:
+        f.write(digest)
+        count += 1
+    return count
+
+
+def write_snapshot(f, height, block_hash, vote_counts, voted, registered):
+    # streaming the digests straight to the file, their counts are filled in at the end
+    start = f.tell()
+    f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, bytes(32), 0, 0, 0))
+    for name in sorted(vote_counts):
+        encoded = name.encode('utf-8')
+        f.write(NAME_LENGTH.pack(len(encoded)) + encoded + VOTE_COUNT.pack(vote_counts[name]))
+    voted_count = _write_digests(f, voted)
+    registered_count = _write_digests(f, registered)
+
+    end = f.tell()
+    f.seek(start)
+    f.write(SNAPSHOT_HEADER.pack(
+        SNAPSHOT_MAGIC, SNAPSHOT_VERSION, height, bytes.fromhex(block_hash),
+        len(vote_counts), voted_count, registered_count
+    ))
+    f.seek(end)
+
+
+def file_digest(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class Snapshot:
+    # Read side of a snapshot file, the digest sections are streamed rather than loaded
+
+    def __init__(self, path):
+        # raising ValueError for anything that is not a complete snapshot file
+        self.path = path
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            header = f.read(SNAPSHOT_HEADER.size)
+            if len(header) < SNAPSHOT_HEADER.size:
+                raise ValueError("Snapshot file is truncated")
+            magic, version, height, block_hash, candidates, voted, registered = SNAPSHOT_HEADER.unpack(header)
+            if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                raise ValueError("Not a snapshot file of a known version")
+
+            self.vote_counts = {}
+            for _ in range(candidates):
+                length_bytes = f.read(NAME_LENGTH.size)
+                if len(length_bytes) < NAME_LENGTH.size:
+                    raise ValueError("Snapshot file is truncated")
+                name = f.read(NAME_LENGTH.unpack(length_bytes)[0])
+                count_bytes = f.read(VOTE_COUNT.size)
+                if len(count_bytes) < VOTE_COUNT.size:
+                    raise ValueError("Snapshot file is truncated")
+                self.vote_counts[name.decode('utf-8')] = VOTE_COUNT.unpack(count_bytes)[0]
+            self.voted_offset = f.tell()
+
+        self.height = height
+        self.block_hash = block_hash.hex()
+        self.voted_count = voted
+        self.registered_count = registered
+        self.registered_offset = self.voted_offset + voted * DIGEST_SIZE
+        if self.registered_offset + registered * DIGEST_SIZE != size:
+            raise ValueError("Snapshot file size does not match its header")
+
+    def _digests(self, offset, count, batch=4096):
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            while count > 0:
+                records = f.read(min(count, batch) * DIGEST_SIZE)
+                for i in range(0, len(records), DIGEST_SIZE):
+                    yield records[i:i + DIGEST_SIZE]
+                count -= len(records) // DIGEST_SIZE
+
+    def voted_digests(self):
+        return self._digests(self.voted_offset, self.voted_count)
+
+    def registered_digests(self):
+        return self._digests(self.registered_offset, self.registered_count)
+
+
+class SnapshotStore:
+    # Directory of snapshot files, each known by the sha256 of its contents
+
+    def __init__(self, directory, keep=SNAPSHOT_KEEP):
+        self.directory = directory
+        self.keep = keep
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        # digest -> {'height', 'hash', 'digest', 'size', 'path'}
+        self.snapshots = {}
+        # the snapshot the node bootstrapped from, kept apart so pruning never touches it
+        self.base_info = None
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if name.endswith('.part') or name.endswith('.tmp'):
+                # downloads and writes cut short by a restart
+                os.remove(path)
+            elif name.endswith('.snap'):
+                try:
+                    info = self._describe(path)
+                except ValueError:
+                    print(f"Ignoring unreadable snapshot {path}")
+                    continue
+                if name == BASE_FILE:
+                    info['verified'] = os.path.exists(os.path.join(directory, BASE_VERIFIED_FILE))
+                    self.base_info = info
+                else:
+                    self.snapshots[info['digest']] = info
+
+    def _describe(self, path):
+        snapshot = Snapshot(path)
+        return {
+            'height': snapshot.height,
+            'hash': snapshot.block_hash,
+            'digest': file_digest(path),
+            'size': os.path.getsize(path),
+            'path': path,
+            # written by this node from its own chain, not downloaded from a peer
+            'local': os.path.basename(path).startswith(LOCAL_PREFIX + '-')
+        }
+
+    def _path_for(self, height, block_hash, prefix=LOCAL_PREFIX):
+        return os.path.join(self.directory, '%s-%012d-%s.snap' % (prefix, height, block_hash[:16]))
+
+    def write(self, height, block_hash, vote_counts, voted, registered):
+        # writing to a temporary file first so a crash never leaves half a snapshot behind
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write_snapshot(f, height, block_hash, vote_counts, voted, registered)
+                f.flush()
+                os.fsync(f.fileno())
+            path = self._path_for(height, block_hash)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        info = self._describe(path)
+        with self.lock:
+            self.snapshots[info['digest']] = info
+            self._prune()
+            return info
+
+    def incoming_path(self, digest):
+        return os.path.join(self.directory, 'incoming-%s.part' % digest[:16])
+
+    def add_file(self, path, digest):
+        # taking in a downloaded file, ValueError when it is not the snapshot it claimed to be
+        if file_digest(path) != digest:
+            raise ValueError("Snapshot digest does not match")
+        snapshot = Snapshot(path)
+        target = self._path_for(snapshot.height, snapshot.block_hash, DOWNLOAD_PREFIX)
+        os.replace(path, target)
+        info = self._describe(target)
+        with self.lock:
+            self.snapshots[info['digest']] = info
+            self._prune()
+            return info
+
+    def set_base(self, info, verified=False):
+        # keeping the snapshot a node bootstrapped from for good, it rebuilds state on restart
+        marker = os.path.join(self.directory, BASE_VERIFIED_FILE)
+        if os.path.exists(marker):
+            os.remove(marker)
+        path = os.path.join(self.directory, BASE_FILE)
+        shutil.copyfile(info['path'], path)
+        base = dict(info, path=path, verified=False)
+        with self.lock:
+            self.base_info = base
+        if verified:
+            self.mark_base_verified()
+        return base
+
+    def mark_base_verified(self):
+        with open(os.path.join(self.directory, BASE_VERIFIED_FILE), 'wb') as f:
+            os.fsync(f.fileno())
+        with self.lock:
+            self.base_info['verified'] = True
+
+    def base(self):
+        return self.base_info
+
+    def _all(self):
+        infos = list(self.snapshots.values())
+        if self.base_info is not None:
+            infos.append(self.base_info)
+        return infos
+
+    def local(self):
+        # snapshots this node wrote itself, newest first
+        with self.lock:
+            infos = [info for info in self.snapshots.values() if info['local']]
+        return sorted(infos, key=lambda info: info['height'], reverse=True)
+
+    def remove_local(self):
+        # dropping our own snapshots, e.g. when the state they were built on turned out wrong
+        with self.lock:
+            for info in [info for info in self.snapshots.values() if info['local']]:
+                del self.snapshots[info['digest']]
+                if os.path.exists(info['path']):
+                    os.remove(info['path'])
+
+    def latest(self):
+        with self.lock:
+            infos = self._all()
+            if not infos:
+                return None
+            return max(infos, key=lambda info: info['height'])
+
+    def get(self, digest):
+        with self.lock:
+            for info in self._all():
+                if info['digest'] == digest:
+                    return info
+            return None
+
+    def read_chunk(self, digest, offset, size):
+        info = self.get(digest)
+        if info is None or offset < 0:
+            return None
+        with open(info['path'], 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def _prune(self):
+        # dropping the oldest snapshots past keep, the base is not among them
+        regular = sorted(self.snapshots.values(), key=lambda info: info['height'], reverse=True)
+        for info in regular[self.keep:]:
+            del self.snapshots[info['digest']]
+            if os.path.exists(info['path']):
+                os.remove(info['path'])
+
+
+class SnapshotReplay:
+    # Recounts the blocks a base snapshot stands in for, so the snapshot can be checked against them
+
+    def __init__(self, height):
+        self.height = height
+        self.next_height = 1
+        self.tally = TallyIndex()
+        self.voted = DigestSet()
+        # why the blocks themselves could not be replayed, None while they check out
+        self.error = None
+
+    def add(self, block):
+        # block next_height, already matched to its header and checked
+        for transaction in block.transactions:
+            if transaction.sender == "BLOCKCHAIN_REWARD":
+                continue
+            if not self.voted.add(voter_digest(transaction.sender)):
+                self.error = f"block {block.index} repeats a vote"
+                return False
+        self.tally.apply_block(block)
+        self.next_height += 1
+        return True
+
+    def done(self):
+        return self.next_height > self.height
+
+    def vote_counts(self):
+        return self.tally.snapshot()[0]
+
+    def matches(self, snapshot):
+        # same counts and the same sorted voted digests as the snapshot
+        if self.vote_counts() != snapshot.vote_counts or len(self.voted) != snapshot.voted_count:
+            return False
+        return all(a == b for a, b in zip(self.voted.digests(), snapshot.voted_digests()))
@@ -0,0 +1,45 @@
+import threading
+from collections import Counter
+
+
+def _votes_in_block(block):
+    # yielding the candidate of every vote transaction in a block
+    for transaction in block.transactions:
+        if transaction.recipient == "ELECTION" and "vote" in transaction.data:
+            yield transaction.data["vote"]
+
+
+class TallyIndex:
+    def __init__(self):
+        # keeping running vote counts so results never have to walk the chain
+        self.lock = threading.Lock()
+        self.vote_counts = {}
+        self.height = -1
+
+    def apply_block(self, block):
+        # counting the votes of a newly appended block, all of them or none
+        block_counts = Counter(_votes_in_block(block))
+        with self.lock:
+            for candidate, count in block_counts.items():
+                self.vote_counts[candidate] = self.vote_counts.get(candidate, 0) + count
+            self.height = block.index
+
+    def revert_block(self, block):
+        # taking the votes of a block back out, e.g. when it leaves the chain
+        with self.lock:
+            for candidate in _votes_in_block(block):
+                self.vote_counts[candidate] -= 1
+                if self.vote_counts[candidate] == 0:
+                    del self.vote_counts[candidate]
+            self.height = block.index - 1
+
+    def load(self, vote_counts, height):
+        # starting from counts taken elsewhere, e.g. a state snapshot at height
+        with self.lock:
+            self.vote_counts = dict(vote_counts)
+            self.height = height
+
+    def snapshot(self):
+        # returning a consistent copy of the counts and the height they reflect
+        with self.lock:
+            return dict(self.vote_counts), self.height
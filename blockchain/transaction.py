@@ -1,42 +1,90 @@
+import hashlib
 import json
 from utils.hash_util import calculate_hash
 
 class Transaction:
-    def __init__(self, sender, recipient, data, signature=None):
+    # fixed attribute set, no per-instance __dict__
+    __slots__ = ('sender', 'recipient', 'data', 'signature', 'scheme', '_signing_hash', '_canonical', '_txid')
+
+    def __init__(self, sender, recipient, data, signature=None, scheme=None):
         # setting up transaction participants and payload
         self.sender = sender
         self.recipient = recipient
         self.data = data
         self.signature = signature
-    
+        # signature scheme recorded when signing, None for transactions that predate schemes (RSA-PSS)
+        self.scheme = scheme
+
+    def __setattr__(self, name, value):
+        # transactions are treated as immutable, so replacing a field drops what was derived from it
+        object.__setattr__(self, name, value)
+        if name in ('sender', 'recipient', 'data', 'scheme'):
+            object.__setattr__(self, '_signing_hash', None)
+            object.__setattr__(self, '_canonical', None)
+            object.__setattr__(self, '_txid', None)
+        elif name == 'signature':
+            object.__setattr__(self, '_canonical', None)
+            object.__setattr__(self, '_txid', None)
+
     def calculate_hash(self):
-        # generating hash using transaction content
-        return calculate_hash(
-            self.sender,
-            self.recipient,
-            json.dumps(self.data, sort_keys=True)
-        )
-    
+        # generating hash using transaction content, once
+        # the scheme is signed too so nobody can add or strip it to change the txid,
+        # transactions without one keep the hash they were signed over
+        if self._signing_hash is None:
+            fields = [self.sender, self.recipient, json.dumps(self.data, sort_keys=True)]
+            if self.scheme is not None:
+                fields.append(self.scheme)
+            object.__setattr__(self, '_signing_hash', calculate_hash(*fields))
+        return self._signing_hash
+
+    def canonical_json(self):
+        # the sorted-keys serialization, computed once and reused for hashing and the wire
+        if self._canonical is None:
+            object.__setattr__(self, '_canonical', json.dumps(self.to_dict(), sort_keys=True))
+        return self._canonical
+
+    def calculate_txid(self):
+        # hashing the full transaction, signature included, as its identifier
+        if self._txid is None:
+            object.__setattr__(self, '_txid', hashlib.sha256(self.canonical_json().encode()).hexdigest())
+        return self._txid
+
     def sign_transaction(self, private_key):
         # signing the transaction using sender's private key
-        from blockchain.wallet import sign_data
+        from blockchain.wallet import sign_data, private_key_scheme
+        self.scheme = private_key_scheme(private_key)
         transaction_hash = self.calculate_hash()
         self.signature = sign_data(transaction_hash, private_key)
-        
+
     def verify_signature(self):
         # checking if the signature is valid
         if self.sender == "BLOCKCHAIN_REWARD":
             return True
 
-        from blockchain.wallet import verify_signature
+        from blockchain.wallet import verify_signature, SCHEME_RSA_PSS
         transaction_hash = self.calculate_hash()
-        return verify_signature(transaction_hash, self.signature, self.sender)
-        
+        return verify_signature(transaction_hash, self.signature, self.sender, self.scheme or SCHEME_RSA_PSS)
+
     def to_dict(self):
         # converting the transaction into a serializable dict
-        return {
+        tx_data = {
             'sender': self.sender,
             'recipient': self.recipient,
             'data': self.data,
             'signature': self.signature
         }
+        # left out when unset so older transactions keep their txid
+        if self.scheme is not None:
+            tx_data['scheme'] = self.scheme
+        return tx_data
+
+    @classmethod
+    def from_dict(cls, tx_data):
+        # rebuilding a transaction from its serialized form
+        return cls(
+            sender=tx_data['sender'],
+            recipient=tx_data['recipient'],
+            data=tx_data['data'],
+            signature=tx_data.get('signature'),
+            scheme=tx_data.get('scheme')
+        )
@@ -0,0 +1,87 @@
+import json
+from blockchain.block import Block
+from mining.difficulty import meets_target, target_from_hex, EASIEST_TARGET
+
+# longest candidate name a vote may carry
+MAX_CANDIDATE_LENGTH = 200
+
+
+def check_vote(transaction):
+    # a vote is addressed to the election and carries exactly one candidate name,
+    # anything else would be counted wrongly or not at all by the tally
+    data = transaction.data
+    return transaction.recipient == "ELECTION" and isinstance(data, dict) and list(data) == ['vote'] and \
+        isinstance(data['vote'], str) and 0 < len(data['vote']) <= MAX_CANDIDATE_LENGTH
+
+
+def check_block_header(block_data):
+    # cheap checks on a received block's fields and header, before any transaction is hashed
+    try:
+        if not isinstance(block_data['transactions'], list) or block_data['index'] < 1:
+            return False
+        target = target_from_hex(block_data['target'])
+        if not 0 < target <= EASIEST_TARGET:
+            return False
+        if Block.hash_header(block_data) != block_data['hash']:
+            return False
+        return meets_target(block_data['hash'], target)
+    except Exception:
+        return False
+
+
+def check_block(block):
+    # checks that only need the block itself, so blocks can be checked independently
+    # a header-only block has nothing to check against its header
+    if not block.has_body():
+        return False
+
+    # checking that the header still commits to the block's transactions
+    if block.merkle_root != block.build_merkle_tree().root:
+        return False
+
+    # checking if the stored hash matches the recalculated one
+    if block.hash != block.calculate_block_hash():
+        return False
+
+    # verifying that the PoW solution meets the target in the block's own header,
+    # whether that target was the right one is checked against the chain by check_retarget
+    if not meets_target(block.hash, block.target):
+        return False
+
+    # every transaction is a well-formed vote or a reward, a reward addressed
+    # to the election would be counted as a vote
+    for transaction in block.transactions:
+        if transaction.sender == "BLOCKCHAIN_REWARD":
+            if transaction.recipient == "ELECTION":
+                return False
+        elif not check_vote(transaction):
+            return False
+
+    # verifying every transaction signature, malformed ones count as invalid
+    for transaction in block.transactions:
+        try:
+            if not transaction.verify_signature():
+                return False
+        except Exception:
+            return False
+
+    return True
+
+
+def check_block_batch(block_payloads):
+    # runs in a worker process on serialized blocks, returns the index of the first bad block or None
+    for payload in block_payloads:
+        block_data = json.loads(payload)
+        if not check_block(Block.from_dict(block_data)):
+            return block_data['index']
+    return None
+
+
+def check_linkage(headers):
+    # sequential pass making sure each block points at the one before it
+    for i in range(1, len(headers)):
+        if headers[i]['previous_hash'] != headers[i - 1]['hash']:
+            return False
+        if headers[i]['index'] != headers[i - 1]['index'] + 1:
+            return False
+    return True
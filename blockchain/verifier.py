@@ -0,0 +1,86 @@
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _verify(transaction):
+    # malformed signatures count as invalid rather than crashing the batch
+    try:
+        return transaction.verify_signature()
+    except Exception:
+        return False
+
+
+class SignatureVerifier:
+    # Verifies transaction signatures in batches on a worker pool
+
+    def __init__(self, workers=None, batch_size=64, max_queue=10000):
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.executor = None
+        self.thread = None
+        self.running = False
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+            self.thread = threading.Thread(target=self._dispatch)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        with self.lock:
+            if not self.running:
+                return
+            self.running = False
+        self.thread.join(2.0)
+        self.executor.shutdown(wait=False)
+
+    def submit(self, transaction, callback, block=True, timeout=None):
+        # queueing a transaction, callback(transaction, valid) runs once it is checked
+        # a full queue blocks the caller (or fails after timeout) to push back on senders
+        if not self.running:
+            self.start()
+        try:
+            self.queue.put((transaction, callback), block=block, timeout=timeout)
+            return True
+        except queue.Full:
+            return False
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def _next_batch(self):
+        # waiting for one item, then taking whatever else is already queued
+        try:
+            batch = [self.queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _dispatch(self):
+        while self.running:
+            batch = self._next_batch()
+            if not batch:
+                continue
+
+            # cryptography releases the GIL, so the pool verifies in parallel
+            results = self.executor.map(_verify, [tx for tx, _ in batch])
+
+            for (transaction, callback), valid in zip(batch, results):
+                try:
+                    callback(transaction, valid)
+                except Exception as e:
+                    print(f"Error in verification callback: {str(e)}")
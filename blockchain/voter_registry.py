@@ -1,12 +1,98 @@
+import argparse
+import hashlib
+import heapq
+from blockchain.digest_set import DigestSet, DIGEST_SIZE
+
+
+def voter_digest(voter_address):
+    # fixed 32-byte key for a voter's public key, whatever its PEM length
+    return hashlib.sha256(voter_address.strip().encode()).digest()
+
+
+def _hex_digest(line):
+    # exactly 64 hex characters, anything else would put a key of the wrong length in the roll
+    if len(line) != DIGEST_SIZE * 2:
+        return None
+    try:
+        digest = bytes.fromhex(line)
+    except ValueError:
+        return None
+    return digest if len(digest) == DIGEST_SIZE else None
+
+
+def read_voter_roll(path):
+    # streaming the roll: PEM public key blocks, or one hex-encoded digest per line
+    pem_lines = None
+    with open(path, 'r') as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('-----BEGIN'):
+                pem_lines = [line]
+            elif pem_lines is not None:
+                pem_lines.append(line)
+                if line.startswith('-----END'):
+                    yield voter_digest('\n'.join(pem_lines))
+                    pem_lines = None
+            else:
+                digest = _hex_digest(line)
+                if digest is None:
+                    print(f"Skipping line {number} of {path}: not a hex sha256 digest")
+                    continue
+                yield digest
+
+
 class VoterRegistry:
-    def __init__(self):
-        self.registered_voters = set()
+    def __init__(self, path=None):
+        # with a path the roll is a memory-mapped sorted file that survives restarts
+        self.registered_voters = DigestSet(path, key=voter_digest)
+        # voters taken from the base snapshot, kept in memory and never written to the roll
+        # since no peer can prove them, reloaded from the snapshot on restart
+        self.snapshot_voters = DigestSet(key=voter_digest)
 
     def register_voter(self, voter_address):
-        if voter_address in self.registered_voters:
-            return False 
-        self.registered_voters.add(voter_address)
-        return True
+        return self.registered_voters.add(voter_address)
 
     def is_registered(self, voter_address):
-        return voter_address in self.registered_voters
+        return voter_address in self.registered_voters or voter_address in self.snapshot_voters
+
+    def bulk_import(self, roll_path):
+        # loading a whole electoral roll in one pass, returns how many voters were new
+        return self.registered_voters.update(read_voter_roll(roll_path))
+
+    def load_snapshot_voters(self, digests):
+        # replacing the voters that came with the base snapshot
+        snapshot_voters = DigestSet(key=voter_digest)
+        snapshot_voters.update(digests)
+        self.snapshot_voters = snapshot_voters
+
+    def digests(self):
+        # the roll and the snapshot voters together, sorted and without repeats
+        previous = None
+        for digest in heapq.merge(self.registered_voters.digests(), self.snapshot_voters.digests()):
+            if digest != previous:
+                yield digest
+            previous = digest
+
+    def __len__(self):
+        if not len(self.snapshot_voters):
+            return len(self.registered_voters)
+        # the two sets may overlap, so counting what the merge yields
+        return sum(1 for _ in self.digests())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import an electoral roll into a voter registry file")
+    parser.add_argument('roll', help="file of PEM public keys or hex sha256 digests of them")
+    parser.add_argument('--registry', default='chaindata/voters.bin', help="registry file to update")
+    args = parser.parse_args()
+
+    registry = VoterRegistry(args.registry)
+    added = registry.bulk_import(args.roll)
+    print(f"Imported {added} new voters, {len(registry)} registered in total")
+    registry.registered_voters.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,103 @@
 import hashlib
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from cryptography.hazmat.primitives.asymmetric import rsa, ed25519, padding
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.exceptions import InvalidSignature
+from blockchain.key_cache import key_cache
 import base64
+from utils.metrics import registry
+
+# signature check latency, exported on /metrics
+verify_seconds = registry.histogram(
+    'signature_verify_seconds', 'Time spent verifying one signature', ['scheme'],
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
+)
+
+# signature schemes a transaction can name, transactions without one are RSA-PSS
+SCHEME_RSA_PSS = 'rsa-pss'
+SCHEME_ED25519 = 'ed25519'
+DEFAULT_SCHEME = SCHEME_RSA_PSS
+
+
+class RsaPssScheme:
+    # 2048-bit RSA with PSS padding, the original scheme
+    name = SCHEME_RSA_PSS
+    key_types = (rsa.RSAPrivateKey, rsa.RSAPublicKey)
+
+    def generate_private_key(self):
+        return rsa.generate_private_key(
+            public_exponent=65537,
+            key_size=2048
+        )
+
+    def sign(self, private_key, data):
+        return private_key.sign(
+            data,
+            padding.PSS(
+                mgf=padding.MGF1(hashes.SHA256()),
+                salt_length=padding.PSS.MAX_LENGTH
+            ),
+            hashes.SHA256()
+        )
+
+    def verify(self, public_key, signature, data):
+        # raises InvalidSignature on a bad signature
+        public_key.verify(
+            signature,
+            data,
+            padding.PSS(
+                mgf=padding.MGF1(hashes.SHA256()),
+                salt_length=padding.PSS.MAX_LENGTH
+            ),
+            hashes.SHA256()
+        )
+
+
+class Ed25519Scheme:
+    # much cheaper key generation and verification than RSA, with 64-byte signatures
+    name = SCHEME_ED25519
+    key_types = (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)
+
+    def generate_private_key(self):
+        return ed25519.Ed25519PrivateKey.generate()
+
+    def sign(self, private_key, data):
+        return private_key.sign(data)
+
+    def verify(self, public_key, signature, data):
+        public_key.verify(signature, data)
+
+
+SIGNATURE_SCHEMES = dict((scheme.name, scheme) for scheme in (RsaPssScheme(), Ed25519Scheme()))
+
+
+def get_scheme(name):
+    scheme = SIGNATURE_SCHEMES.get(name)
+    if scheme is None:
+        raise ValueError(f"Unknown signature scheme: {name}")
+    return scheme
+
+
+def scheme_of_key(key_obj):
+    # working out the scheme from a parsed private or public key
+    for scheme in SIGNATURE_SCHEMES.values():
+        if isinstance(key_obj, scheme.key_types):
+            return scheme
+    raise ValueError("Unsupported key type")
+
+
+def load_private_key(private_key):
+    # a wallet keeps the key it parsed, a bare PEM is parsed each time rather than cached
+    if hasattr(private_key, 'private_key_object'):
+        return private_key.private_key_object()
+    return serialization.load_pem_private_key(private_key.encode(), password=None)
+
+
+def private_key_scheme(private_key_pem):
+    return scheme_of_key(load_private_key(private_key_pem)).name
 
 # generating key pair
-def generate_key_pair():
-    private_key = rsa.generate_private_key(
-        public_exponent=65537,
-        key_size=2048
-    )
+def generate_key_pair(scheme=DEFAULT_SCHEME):
+    private_key = get_scheme(scheme).generate_private_key()
     public_key = private_key.public_key().public_bytes(
         encoding=serialization.Encoding.PEM,
         format=serialization.PublicFormat.SubjectPublicKeyInfo
@@ -21,30 +109,19 @@ def generate_key_pair():
     )
     return public_key.decode('utf-8'), private_key_pem.decode('utf-8')
 
-# signing given data
+# signing given data, the key decides the scheme
 def sign_data(data, private_key_pem):
     if not private_key_pem:
         raise ValueError("Private key is required")
-    if hasattr(private_key_pem, 'private_key') and private_key_pem.private_key:
-        private_key_pem = private_key_pem.private_key
     if isinstance(data, str):
         data = data.encode()
-    private_key = serialization.load_pem_private_key(
-        private_key_pem.encode(),
-        password=None
-    )
-    signature = private_key.sign(
-        data,
-        padding.PSS(
-            mgf=padding.MGF1(hashes.SHA256()),
-            salt_length=padding.PSS.MAX_LENGTH
-        ),
-        hashes.SHA256()
-    )
+    private_key = load_private_key(private_key_pem)
+    signature = scheme_of_key(private_key).sign(private_key, data)
     return base64.b64encode(signature).decode('utf-8')
 
 # verifying signature validity
-def verify_signature(data, signature, public_key_pem):
+def verify_signature(data, signature, public_key_pem, scheme=SCHEME_RSA_PSS):
+    # the key has to belong to the scheme the transaction names
     if not public_key_pem:
         raise ValueError("Public key is required")
     if hasattr(public_key_pem, 'public_key') and public_key_pem.public_key:
@@ -52,22 +129,16 @@ def verify_signature(data, signature, public_key_pem):
     if isinstance(data, str):
         data = data.encode()
     signature = base64.b64decode(signature)
-    public_key = serialization.load_pem_public_key(
-        public_key_pem.encode()
-    )
-    try:
-        public_key.verify(
-            signature,
-            data,
-            padding.PSS(
-                mgf=padding.MGF1(hashes.SHA256()),
-                salt_length=padding.PSS.MAX_LENGTH
-            ),
-            hashes.SHA256()
-        )
-        return True
-    except InvalidSignature:
+    public_key = key_cache.get_public_key(public_key_pem)
+    key_scheme = scheme_of_key(public_key)
+    if key_scheme.name != scheme:
         return False
+    with verify_seconds.labels(key_scheme.name).time():
+        try:
+            key_scheme.verify(public_key, signature, data)
+            return True
+        except InvalidSignature:
+            return False
 
 # creating wallet address
 def generate_address_from_public_key(public_key):
@@ -83,27 +154,39 @@ def generate_address_from_public_key(public_key):
 
 # wallet definition
 class Wallet:
-    def __init__(self):
+    def __init__(self, private_key=None, scheme=DEFAULT_SCHEME):
         self.public_key = None
-        self.private_key = None
-        self.generate_key_pair()
+        self.private_key = private_key
+        self._private_key_obj = None
+        # with an existing key the scheme follows from the key itself
+        self.scheme = scheme
+        if private_key:
+            self.generate_public_key()
+        else:
+            self.generate_key_pair()
     
     def generate_key_pair(self):
-        self.public_key, self.private_key = generate_key_pair()
+        self.public_key, self.private_key = generate_key_pair(self.scheme)
     
     def generate_public_key(self):
         if not self.private_key:
             raise ValueError("Private key is not set")
-        private_key_obj = serialization.load_pem_private_key(
-            self.private_key.encode(),
-            password=None
-        )
+        private_key_obj = self.private_key_object()
         public_key_pem = private_key_obj.public_key().public_bytes(
             encoding=serialization.Encoding.PEM,
             format=serialization.PublicFormat.SubjectPublicKeyInfo
         )
         self.public_key = public_key_pem.decode('utf-8')
+        self.scheme = scheme_of_key(private_key_obj).name
+        # the vote signed with this key gets verified next, so seed the public entry too
+        key_cache.put_public_key(self.public_key, private_key_obj.public_key())
     
+    def private_key_object(self):
+        # parsed once per wallet, and gone with it
+        if self._private_key_obj is None:
+            self._private_key_obj = serialization.load_pem_private_key(self.private_key.encode(), password=None)
+        return self._private_key_obj
+
     def sign_transaction(self, transaction):
         transaction_string = transaction.to_dict(for_signature=True)
         signature = self.sign_data(str(transaction_string))
@@ -120,8 +203,8 @@ class Wallet:
         return generate_address_from_public_key(self.public_key)
     
     @staticmethod
-    def verify_signature(data, signature, public_key_pem):
-        return verify_signature(data, signature, public_key_pem)
+    def verify_signature(data, signature, public_key_pem, scheme=SCHEME_RSA_PSS):
+        return verify_signature(data, signature, public_key_pem, scheme)
     
     @staticmethod
     def generate_address(public_key):
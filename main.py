@@ -1,18 +1,33 @@
 from blockchain.blockchain import Blockchain
-from blockchain.wallet import Wallet
+from blockchain.block_store import BlockStore
+from blockchain.snapshot import SnapshotStore
+from blockchain.voter_registry import VoterRegistry
+from blockchain.wallet import Wallet, DEFAULT_SCHEME
 from network.node import Node
+from mining.scheduler import MiningScheduler
 from web.app import start_web_server
+import os
 import threading
 import time
 
 def main():
-    # Initializing blockchain
-    blockchain = Blockchain()
+    # Initializing blockchain from the on-disk block store and voter roll, mining on every available core
+    data_dir = os.environ.get('CHAIN_DATA_DIR', 'chaindata')
+    blockchain = Blockchain(
+        mining_workers=os.cpu_count() or 1,
+        store=BlockStore(data_dir),
+        voter_registry=VoterRegistry(os.path.join(data_dir, 'voters.bin')),
+        snapshots=SnapshotStore(os.path.join(data_dir, 'snapshots'))
+    )
     
-    # Initializing network node
-    node = Node(blockchain)
+    # Initializing network node, P2P_TRANSPORT=threaded falls back to a thread per peer
+    node = Node(blockchain, transport=os.environ.get('P2P_TRANSPORT', 'asyncio'))
     blockchain.set_network_node(node)
     
+    # SEED_PEERS="host:port,host:port" gives the connection manager somewhere to start dialing
+    seeds = [entry.rsplit(':', 1) for entry in os.environ.get('SEED_PEERS', '').split(',') if entry.strip()]
+    node.connections.add_seeds((host.strip(), int(port)) for host, port in seeds)
+    
     network_thread = threading.Thread(target=node.start)
     network_thread.daemon = True
     network_thread.start()
@@ -21,9 +36,22 @@ def main():
     print("Starting network node...")
     time.sleep(1)
     
+    # Mining in the background once MINE_AFTER_TXS votes are pending or MINE_AFTER_SECONDS have passed
+    scheduler = MiningScheduler(
+        blockchain,
+        min_transactions=int(os.environ.get('MINE_AFTER_TXS', 10)),
+        max_wait=float(os.environ.get('MINE_AFTER_SECONDS', 30))
+    )
+    scheduler.start()
+    
     # Starting web server
     print("Starting web interface on http://localhost:5000")
-    start_web_server(blockchain)
+    # New voters get SIGNATURE_SCHEME keys ('rsa-pss' or 'ed25519'), votes of both kinds are accepted
+    start_web_server(
+        blockchain,
+        mining_scheduler=scheduler,
+        signature_scheme=os.environ.get('SIGNATURE_SCHEME', DEFAULT_SCHEME)
+    )
 
 if __name__ == "__main__":
     main()
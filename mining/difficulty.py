@@ -0,0 +1,74 @@
+import statistics
+
+# a block is valid when its hash, read as a 256-bit integer, is at most the block's target
+# the easiest target allowed, half of all hashes qualify
+EASIEST_TARGET = (1 << 255) - 1
+# the target the chain starts from, the same work as the old four leading hex zeros
+INITIAL_TARGET = (1 << 240) - 1
+
+# seconds the network aims to spend per block
+BLOCK_INTERVAL = 30.0
+# blocks whose timestamps and targets feed each retarget
+RETARGET_WINDOW = 20
+# the window's timespan counts as at most this many times faster or slower than planned
+MAX_ADJUSTMENT = 4
+# a block's timestamp must be later than the median of this many blocks before it
+MEDIAN_TIME_SPAN = 11
+# seconds a block's timestamp may run ahead of our own clock
+MAX_FUTURE_DRIFT = 120.0
+
+
+def target_for_leading_zeros(zeros):
+    # the target equal to the old "zeros leading hex zeros" rule
+    return (1 << (256 - 4 * zeros)) - 1
+
+
+def target_to_hex(target):
+    return '%064x' % target
+
+
+def target_from_hex(target_hex):
+    return int(target_hex, 16)
+
+
+def meets_target(block_hash, target):
+    return int(block_hash, 16) <= target
+
+
+def work_of(target):
+    # expected number of hashes to find a block at this target
+    return (1 << 256) // (target + 1)
+
+
+def next_target(window, block_interval=BLOCK_INTERVAL, initial_target=INITIAL_TARGET):
+    # window holds the headers before the new block, oldest first, genesis left out
+    # the new target is the window's average target scaled by how far its timespan missed the plan
+    window = window[-(RETARGET_WINDOW + 1):]
+    if len(window) < 2:
+        return initial_target
+
+    expected = (len(window) - 1) * block_interval
+    actual = window[-1]['timestamp'] - window[0]['timestamp']
+    actual = min(max(actual, expected / MAX_ADJUSTMENT), expected * MAX_ADJUSTMENT)
+
+    targets = [target_from_hex(header['target']) for header in window[1:]]
+    average = sum(targets) // len(targets)
+    # milliseconds keep the scaling in integers, so every node computes the same target
+    target = average * int(actual * 1000) // int(expected * 1000)
+    return min(max(target, 1), EASIEST_TARGET)
+
+
+def check_retarget(headers, history, block_interval=BLOCK_INTERVAL, initial_target=INITIAL_TARGET):
+    # checking that each header carries the target its predecessors call for and a sane timestamp
+    # history holds the headers right before headers[0], oldest first, genesis left out
+    window = list(history)
+    for header in headers:
+        if target_from_hex(header['target']) != next_target(window, block_interval, initial_target):
+            return False
+        recent = [h['timestamp'] for h in window[-MEDIAN_TIME_SPAN:]]
+        if recent and header['timestamp'] <= statistics.median(recent):
+            return False
+        window.append(header)
+        if len(window) > RETARGET_WINDOW + 1:
+            window.pop(0)
+    return True
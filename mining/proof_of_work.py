@@ -1,28 +1,172 @@
+import hashlib
+import multiprocessing
+import queue
+import struct
 import time
+from mining.difficulty import meets_target
+from utils.metrics import registry
+
+# how many nonces a worker tries between checks of the stop flag
+CHECK_INTERVAL = 1000
+
+
+def _search_nonces(header_prefix, target, start, step, stop_event, result_queue, worker_id):
+    # trying every step-th nonce starting at start until someone finds a solution
+    # the constant part of the header is hashed once, each try only feeds the nonce
+    # target is the 32-byte big-endian target, so comparing raw digests orders them as integers
+    midstate = hashlib.sha256(header_prefix)
+    pack_nonce = struct.Struct('>Q').pack
+    nonce = start
+    hashes = 0
+    start_time = time.time()
+    found = None
+
+    while not stop_event.is_set():
+        for _ in range(CHECK_INTERVAL):
+            attempt = midstate.copy()
+            attempt.update(pack_nonce(nonce))
+            hashes += 1
+
+            if attempt.digest() <= target:
+                found = (nonce, attempt.hexdigest())
+                break
+
+            nonce += step
+
+        if found:
+            stop_event.set()
+            break
+
+    elapsed = time.time() - start_time
+    result_queue.put({
+        'worker_id': worker_id,
+        'hashes': hashes,
+        'elapsed': elapsed,
+        'hash_rate': hashes / elapsed if elapsed > 0 else 0.0,
+        'solution': found
+    })
+
+
+# mining figures exported on /metrics
+hashes_tried = registry.counter('pow_hashes_total', 'Nonces tried by the miner')
+hash_rate_gauge = registry.gauge('pow_hash_rate', 'Hashes per second of the last mining attempt')
+mining_seconds = registry.histogram('pow_mining_seconds', 'Time spent per mining attempt', ['outcome'])
+
 
 class ProofOfWork:
-    def __init__(self, block, difficulty):
+    def __init__(self, block, workers=1):
         self.block = block
-        self.difficulty = difficulty
-        self.target = '0' * difficulty  
-        # Target with leading zeros
-        
+        # the block's target as 32 big-endian bytes, compared directly against digests
+        self.target = block.target.to_bytes(32, 'big')
+        self.workers = max(1, workers)
+        self.worker_stats = []
+        self._stop_event = None
+        self._aborted = False
+
     def mine(self):
+        if self.workers > 1:
+            return self._mine_parallel()
+
         nonce = 0
         start_time = time.time()
-        
-        while True:
-            self.block.nonce = nonce
-            current_hash = self.block.calculate_block_hash()
-            
-            if current_hash.startswith(self.target):
-                end_time = time.time()
-                print(f"Block mined! Nonce: {nonce}, Hash: {current_hash}")
-                print(f"Mining took: {end_time - start_time:.2f} seconds")
-                self.block.hash = current_hash
-                return self.block
-                
+        midstate = hashlib.sha256(self.block.header_prefix())
+        pack_nonce = struct.Struct('>Q').pack
+
+        found = None
+        while not self._aborted:
+            attempt = midstate.copy()
+            attempt.update(pack_nonce(nonce))
+            if attempt.digest() <= self.target:
+                found = attempt.hexdigest()
+                break
+
             nonce += 1
-            
+
+        elapsed = time.time() - start_time
+        hashes = nonce + 1 if found else nonce
+        self.worker_stats = [{
+            'worker_id': 0,
+            'hashes': hashes,
+            'elapsed': elapsed,
+            'hash_rate': hashes / elapsed if elapsed > 0 else 0.0
+        }]
+        self._record_metrics(elapsed, found is not None)
+
+        if not found:
+            return None
+
+        print(f"Block mined! Nonce: {nonce}, Hash: {found}")
+        print(f"Mining took: {elapsed:.2f} seconds")
+        self.block.nonce = nonce
+        self.block.hash = found
+        return self.block
+
+    def _mine_parallel(self):
+        # splitting the nonce space so worker i tries i, i + n, i + 2n, ...
+        ctx = multiprocessing.get_context()
+        self._stop_event = ctx.Event()
+        if self._aborted:
+            self._stop_event.set()
+        result_queue = ctx.Queue()
+        start_time = time.time()
+
+        processes = []
+        for worker_id in range(self.workers):
+            process = ctx.Process(
+                target=_search_nonces,
+                args=(self.block.header_prefix(), self.target, worker_id, self.workers,
+                      self._stop_event, result_queue, worker_id)
+            )
+            process.daemon = True
+            process.start()
+            processes.append(process)
+
+        # collecting a report from every worker, the winner sets the stop flag
+        results = []
+        while len(results) < len(processes):
+            try:
+                results.append(result_queue.get(timeout=1.0))
+            except queue.Empty:
+                if not any(p.is_alive() for p in processes):
+                    break
+
+        for process in processes:
+            process.join()
+
+        self.worker_stats = sorted(
+            [{k: v for k, v in r.items() if k != 'solution'} for r in results],
+            key=lambda r: r['worker_id']
+        )
+        solutions = [r['solution'] for r in results if r['solution']]
+        self._record_metrics(time.time() - start_time, bool(solutions))
+        if not solutions:
+            return None
+
+        nonce, current_hash = min(solutions)
+        print(f"Block mined! Nonce: {nonce}, Hash: {current_hash}")
+        print(f"Mining took: {time.time() - start_time:.2f} seconds")
+        self.block.nonce = nonce
+        self.block.hash = current_hash
+        return self.block
+
+    def _record_metrics(self, elapsed, solved):
+        hashes_tried.inc(sum(stats['hashes'] for stats in self.worker_stats))
+        hash_rate_gauge.set(self.hash_rate)
+        mining_seconds.labels('solved' if solved else 'aborted').observe(elapsed)
+
+    def abort(self):
+        # stopping every worker, e.g. when a competing block arrives
+        self._aborted = True
+        if self._stop_event is not None:
+            self._stop_event.set()
+
+    @property
+    def hash_rate(self):
+        return sum(stats['hash_rate'] for stats in self.worker_stats)
+
+    @staticmethod
+    def meets_target(block_hash, target):
+        return meets_target(block_hash, target)
+
     def validate(self):
-        return self.block.hash.startswith(self.target)
+        return meets_target(self.block.hash, self.block.target)
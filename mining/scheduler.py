@@ -0,0 +1,112 @@
+import threading
+import time
+
+
+class MiningScheduler:
+    # Background miner that builds a block once enough votes are pending or they have waited long enough
+
+    def __init__(self, blockchain, miner_address="SYSTEM", min_transactions=10, max_wait=30.0,
+                 poll_interval=0.5):
+        self.blockchain = blockchain
+        self.miner_address = miner_address
+        # mine as soon as this many transactions are pending
+        self.min_transactions = min_transactions
+        # or once the oldest pending transaction has waited this many seconds
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.trigger_event = threading.Event()
+        self.running = False
+        self.thread = None
+
+        self.status = 'stopped'
+        self.mining_since = None
+        self.blocks_mined = 0
+        self.attempts_aborted = 0
+        self.last_block = None
+        self.last_hash_rate = 0.0
+        self.last_error = None
+
+    def start(self):
+        with self.lock:
+            if self.running:
+                return False
+            self.running = True
+            self.status = 'idle'
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        print(f"Mining scheduler started (every {self.min_transactions} txs or {self.max_wait:.0f}s)")
+        return True
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+        self.trigger_event.set()
+        self.blockchain.abort_mining()
+        if self.thread:
+            self.thread.join(2.0)
+        self.status = 'stopped'
+
+    def trigger(self):
+        # asking for a block right away, whatever the thresholds say
+        self.trigger_event.set()
+
+    def _should_mine(self):
+        pending = len(self.blockchain.mempool)
+        if pending == 0:
+            return False
+        if pending >= self.min_transactions:
+            return True
+        oldest = self.blockchain.mempool.oldest_added_at()
+        return oldest is not None and time.time() - oldest >= self.max_wait
+
+    def _run(self):
+        while self.running:
+            triggered = self.trigger_event.wait(self.poll_interval)
+            self.trigger_event.clear()
+            if not self.running:
+                break
+            if not triggered and not self._should_mine():
+                continue
+
+            self.status = 'mining'
+            self.mining_since = time.time()
+            try:
+                block = self.blockchain.mine_pending_transactions(self.miner_address)
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Error while mining: {str(e)}")
+                block = None
+            finally:
+                self.status = 'idle'
+                self.mining_since = None
+
+            if block is None:
+                # a peer's block took the tip, the loop starts over on top of it
+                self.attempts_aborted += 1
+                continue
+
+            self.blocks_mined += 1
+            self.last_hash_rate = self.blockchain.last_hash_rate
+            self.last_block = {
+                'index': block.index,
+                'hash': block.hash,
+                'transactions': len(block.transactions),
+                'mined_at': time.time()
+            }
+
+    def state(self):
+        # a snapshot for the web layer
+        return {
+            'status': self.status,
+            'mining_since': self.mining_since,
+            'pending_transactions': len(self.blockchain.mempool),
+            'min_transactions': self.min_transactions,
+            'max_wait': self.max_wait,
+            'blocks_mined': self.blocks_mined,
+            'attempts_aborted': self.attempts_aborted,
+            'last_block': self.last_block,
+            'last_hash_rate': self.last_hash_rate,
+            'last_error': self.last_error
+        }
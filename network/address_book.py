@@ -0,0 +1,104 @@
+import ipaddress
+import random
+import threading
+import time
+
+# most addresses remembered, the lowest scored are forgotten first
+MAX_ADDRESSES = 2000
+# score bounds, a successful connection adds one and a failed dial takes one away
+MAX_SCORE = 10
+MIN_SCORE = -5
+# first retry delay after a failed dial, doubled per consecutive failure up to MAX_BACKOFF
+BASE_BACKOFF = 5.0
+MAX_BACKOFF = 3600.0
+# addresses sharing this prefix count as one network, one operator seldom holds many of them
+IPV4_GROUP_PREFIX = 16
+IPV6_GROUP_PREFIX = 32
+
+
+def netgroup(host):
+    # the network a peer's address belongs to, a host name that is not an address counts as its own
+    try:
+        ip = ipaddress.ip_address(host)
+    except ValueError:
+        return host
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    prefix = IPV4_GROUP_PREFIX if ip.version == 4 else IPV6_GROUP_PREFIX
+    return ipaddress.ip_network((ip, prefix), strict=False)
+
+
+class AddressBook:
+    # Scored set of peer listen addresses learned from seeds, handshakes and PEERS gossip
+
+    def __init__(self, max_addresses=MAX_ADDRESSES):
+        self.max_addresses = max_addresses
+        self.lock = threading.Lock()
+        # (host, port) -> {'score', 'failures', 'next_attempt', 'last_success'}
+        self.entries = {}
+
+    def add(self, address, score=0):
+        # returns True for an address we did not know yet
+        address = (address[0], int(address[1]))
+        with self.lock:
+            if address in self.entries:
+                return False
+            if len(self.entries) >= self.max_addresses:
+                worst = min(self.entries, key=lambda a: self.entries[a]['score'])
+                if self.entries[worst]['score'] >= score:
+                    return False
+                del self.entries[worst]
+            self.entries[address] = {'score': score, 'failures': 0, 'next_attempt': 0.0, 'last_success': None}
+            return True
+
+    def mark_success(self, address):
+        address = (address[0], int(address[1]))
+        self.add(address)
+        with self.lock:
+            entry = self.entries.get(address)
+            if entry is not None:
+                entry['score'] = min(entry['score'] + 1, MAX_SCORE)
+                entry['failures'] = 0
+                entry['next_attempt'] = 0.0
+                entry['last_success'] = time.time()
+
+    def mark_failure(self, address):
+        # backing off exponentially, forgetting addresses that keep failing
+        address = (address[0], int(address[1]))
+        with self.lock:
+            entry = self.entries.get(address)
+            if entry is None:
+                return
+            entry['failures'] += 1
+            entry['score'] -= 1
+            if entry['score'] < MIN_SCORE:
+                del self.entries[address]
+                return
+            delay = min(BASE_BACKOFF * (2 ** (entry['failures'] - 1)), MAX_BACKOFF)
+            entry['next_attempt'] = time.time() + delay
+
+    def remove(self, address):
+        with self.lock:
+            self.entries.pop((address[0], int(address[1])), None)
+
+    def candidates(self, exclude, count):
+        # the best scored addresses that are out of backoff, random among equal scores
+        now = time.time()
+        with self.lock:
+            ready = [a for a, e in self.entries.items() if e['next_attempt'] <= now and a not in exclude]
+            random.shuffle(ready)
+            ready.sort(key=lambda a: self.entries[a]['score'], reverse=True)
+        return ready[:count]
+
+    def sample(self, count):
+        # addresses worth sharing with other peers, never those that only ever failed
+        with self.lock:
+            shareable = [a for a, e in self.entries.items() if e['score'] >= 0]
+        random.shuffle(shareable)
+        return shareable[:count]
+
+    def __contains__(self, address):
+        return (address[0], int(address[1])) in self.entries
+
+    def __len__(self):
+        return len(self.entries)
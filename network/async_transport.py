@@ -0,0 +1,237 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from network.framing import (
+    FRAME_HEADER, PROTOCOL_VERSION, MAX_FRAME_SIZE, WIRE_BINARY, WIRE_JSON,
+    FrameError, encode_message, decode_payload
+)
+from network.peer import PeerTraffic
+from network.send_queue import SendQueue, OVERFLOW, QUEUED
+
+# seconds allowed for a TCP connect to complete
+CONNECT_TIMEOUT = 5.0
+# seconds allowed to receive the rest of a message once it has started
+READ_TIMEOUT = 30.0
+# seconds a peer may stay completely silent before it is dropped
+IDLE_TIMEOUT = 600.0
+# seconds a peer may take to accept what has been written to it
+WRITE_TIMEOUT = 30.0
+# threads running Node.handle_* so slow handlers never block the event loop
+HANDLER_THREADS = 8
+
+
+class AsyncPeer:
+    # Peer connection served by the shared event loop instead of its own thread
+
+    def __init__(self, transport, reader, writer, address, wire_format=WIRE_BINARY, outbound=False):
+        self.transport = transport
+        self.node = transport.node
+        self.reader = reader
+        self.writer = writer
+        self.address = address
+        # whether we dialed this peer, and what its VERSION handshake told us
+        self.outbound = outbound
+        self.node_id = None
+        self.listen_address = None
+        self.wire_format = wire_format
+        self.running = True
+        self.traffic = PeerTraffic(address)
+        # messages wait here until the writer task drains them
+        self.send_queue = SendQueue()
+        self.wakeup = asyncio.Event()
+
+    async def _read_message(self):
+        # waiting as long as the peer is idle, then bounding the rest of the message
+        first = await asyncio.wait_for(self.reader.readexactly(1), IDLE_TIMEOUT)
+        if first == b'{':
+            # an old newline-JSON peer, answering it in the same framing
+            self.wire_format = WIRE_JSON
+            line = await asyncio.wait_for(self.reader.readuntil(b'\n'), READ_TIMEOUT)
+            self.traffic.bytes_in.inc(1 + len(line))
+            return first + line[:-1]
+
+        header = first + await asyncio.wait_for(
+            self.reader.readexactly(FRAME_HEADER.size - 1), READ_TIMEOUT
+        )
+        length, version, _ = FRAME_HEADER.unpack(header)
+        if version != PROTOCOL_VERSION:
+            raise FrameError(f"Unsupported protocol version {version}")
+        if length > MAX_FRAME_SIZE:
+            raise FrameError(f"Frame of {length} bytes exceeds the frame limit")
+        payload = await asyncio.wait_for(self.reader.readexactly(length), READ_TIMEOUT)
+        self.traffic.bytes_in.inc(FRAME_HEADER.size + length)
+        return payload
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        writer_task = loop.create_task(self._write_loop())
+        try:
+            while self.running:
+                payload = await self._read_message()
+                self.traffic.messages_in.inc()
+                try:
+                    message = decode_payload(payload)
+                except Exception as e:
+                    print(f"Error processing message from {self.address}: {str(e)}")
+                    continue
+                # awaiting the handler keeps messages from one peer in order
+                await loop.run_in_executor(
+                    self.transport.handlers, self._handle, message
+                )
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.TimeoutError:
+            print(f"Peer {self.address} timed out")
+        except Exception as e:
+            print(f"Error receiving data from {self.address}: {str(e)}")
+        finally:
+            writer_task.cancel()
+            self.disconnect()
+
+    def _handle(self, message):
+        try:
+            self.node.handle_message(message, self)
+        except Exception as e:
+            print(f"Error processing message from {self.address}: {str(e)}")
+
+    def send(self, message, low_priority=False):
+        # safe to call from any thread, the writer task does the encoding and the write
+        if not self.running:
+            return False
+        result = self.send_queue.put(message, low_priority)
+        if result == OVERFLOW:
+            print(f"Peer {self.address} is too slow, disconnecting")
+            self.disconnect()
+            return False
+        self.transport.call_in_loop(self.wakeup.set)
+        return result == QUEUED
+
+    async def _write_loop(self):
+        # draining the queue in order, waiting for the socket whenever its buffer fills
+        try:
+            while self.running:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                while self.running:
+                    message = self.send_queue.get_nowait()
+                    if message is None:
+                        break
+                    try:
+                        data = encode_message(message, self.wire_format)
+                    except Exception as e:
+                        print(f"Error sending message to {self.address}: {str(e)}")
+                        continue
+                    self.writer.write(data)
+                    self.traffic.bytes_out.inc(len(data))
+                    self.traffic.messages_out.inc()
+                    await asyncio.wait_for(self.writer.drain(), WRITE_TIMEOUT)
+        except asyncio.CancelledError:
+            pass
+        except asyncio.TimeoutError:
+            print(f"Peer {self.address} is too slow, disconnecting")
+            self.disconnect()
+        except Exception as e:
+            print(f"Error sending message to {self.address}: {str(e)}")
+            self.disconnect()
+
+    def disconnect(self):
+        if not self.running:
+            return
+        self.running = False
+        self.traffic.forget()
+        self.send_queue.close()
+        self.transport.call_in_loop(self.wakeup.set)
+        self.transport.call_in_loop(self.writer.close)
+        self.node.remove_peer(self)
+
+
+class AsyncTransport:
+    # Runs the P2P server and every peer connection on a single asyncio event loop
+
+    def __init__(self, node, host='0.0.0.0', port=8333):
+        self.node = node
+        self.host = host
+        self.port = port
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.running = False
+        self.handlers = ThreadPoolExecutor(max_workers=HANDLER_THREADS)
+
+    def start(self):
+        # starting the loop thread and waiting until the server is listening
+        if self.running:
+            return False
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        try:
+            future = asyncio.run_coroutine_threadsafe(self._start_server(), self.loop)
+            future.result()
+        except Exception as e:
+            print(f"Error starting P2P server: {str(e)}")
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            return False
+
+        self.running = True
+        print(f"P2P server started on {self.host}:{self.port} (asyncio)")
+        return True
+
+    async def _start_server(self):
+        self.server = await asyncio.start_server(
+            self._accept, self.host, self.port, limit=MAX_FRAME_SIZE
+        )
+
+    async def _accept(self, reader, writer):
+        address = writer.get_extra_info('peername')[:2]
+        print(f"New connection from {address[0]}:{address[1]}")
+        await self._serve(reader, writer, address)
+
+    async def _serve(self, reader, writer, address, outbound=False):
+        peer = AsyncPeer(self, reader, writer, address, self.node.wire_format, outbound)
+        loop = asyncio.get_running_loop()
+        admitted = await loop.run_in_executor(self.handlers, self.node.add_peer, peer, address)
+        if admitted:
+            await peer.run()
+
+    def connect(self, host, port):
+        # dialing from any thread, bounded by CONNECT_TIMEOUT
+        future = asyncio.run_coroutine_threadsafe(self._connect(host, port), self.loop)
+        return future.result(CONNECT_TIMEOUT + 1.0)
+
+    async def _connect(self, host, port):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, limit=MAX_FRAME_SIZE), CONNECT_TIMEOUT
+        )
+        # the peer runs on the loop after the dial returns
+        asyncio.get_running_loop().create_task(self._serve(reader, writer, (host, port), True))
+        return True
+
+    def call_in_loop(self, callback, *args):
+        if self.loop is None or self.loop.is_closed():
+            return
+        if threading.current_thread() is self.thread:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+
+        async def shutdown():
+            self.server.close()
+            await self.server.wait_closed()
+
+        try:
+            asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result(2.0)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(2.0)
+        self.handlers.shutdown(wait=False)
+        print("P2P server stopped")
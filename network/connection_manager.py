@@ -0,0 +1,173 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from network.address_book import AddressBook
+from network.message import Message, VERSION
+from utils.metrics import registry
+
+# outbound connections the node keeps dialing towards
+TARGET_OUTBOUND = 8
+# hard caps, manual dials may go past the target but not past MAX_OUTBOUND
+MAX_OUTBOUND = 10
+MAX_INBOUND = 32
+# dials allowed in flight at once
+MAX_PENDING_DIALS = 4
+# seconds between checks of the outbound count
+MAINTAIN_INTERVAL = 2.0
+# addresses sent in one PEERS reply, and read from one
+MAX_SHARED_ADDRESSES = 100
+
+rejected_connections = registry.counter('rejected_connections_total', 'Connections refused or closed', ['reason'])
+
+
+class ConnectionManager:
+    # Keeps the node's connection counts within limits, dedups peers by node_id and dials in the background
+
+    def __init__(self, node, target_outbound=TARGET_OUTBOUND, max_outbound=MAX_OUTBOUND, max_inbound=MAX_INBOUND):
+        self.node = node
+        self.target_outbound = target_outbound
+        self.max_outbound = max_outbound
+        self.max_inbound = max_inbound
+        self.address_book = AddressBook()
+        self.lock = threading.Lock()
+        # addresses being dialed right now
+        self.dialing = set()
+        self.dialer = ThreadPoolExecutor(max_workers=MAX_PENDING_DIALS)
+        self.running = False
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._maintain)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(2.0)
+        self.dialer.shutdown(wait=False)
+
+    def add_seeds(self, addresses):
+        for address in addresses:
+            self.address_book.add(address, score=1)
+        self.wakeup.set()
+
+    def _count(self, outbound):
+        return sum(1 for peer in self.node.peers if peer.outbound == outbound)
+
+    def admit(self, peer):
+        # deciding whether a freshly connected peer may stay, and taking its slot in node.peers
+        # under the same lock so simultaneous connects cannot all get past the caps
+        with self.lock:
+            if peer.outbound:
+                if self._count(True) >= self.max_outbound:
+                    rejected_connections.labels('outbound_limit').inc()
+                    return False
+            elif self._count(False) >= self.max_inbound:
+                rejected_connections.labels('inbound_limit').inc()
+                return False
+            self.node.peers.append(peer)
+            return True
+
+    def send_version(self, peer):
+        peer.send(Message(VERSION, {'node_id': self.node.node_id, 'port': self.node.port}, self.node.node_id))
+
+    def handle_version(self, message, peer):
+        # learning who the peer is, then dropping self-connections and duplicates
+        node_id = message.data.get('node_id')
+        port = message.data.get('port')
+        if not isinstance(node_id, int) or not isinstance(port, int) or not 0 < port < 65536:
+            return
+
+        if node_id == self.node.node_id:
+            print(f"Connected to ourselves via {peer.address[0]}:{peer.address[1]}, disconnecting")
+            rejected_connections.labels('self').inc()
+            if peer.outbound:
+                self.address_book.remove(peer.address)
+            peer.disconnect()
+            return
+
+        with self.lock:
+            peer.node_id = node_id
+            peer.listen_address = (peer.address[0], port)
+            duplicate = None
+            for other in self.node.peers:
+                if other is not peer and other.node_id == node_id and other.running:
+                    duplicate = other
+                    break
+
+        if duplicate is not None:
+            # both sides keep the same link: the one dialed by the lower node_id, else the older one
+            loser = peer
+            if peer.outbound != duplicate.outbound:
+                keep_ours = self.node.node_id < node_id
+                if peer.outbound == keep_ours:
+                    loser = duplicate
+            print(f"Duplicate connection to node {node_id}, closing {loser.address[0]}:{loser.address[1]}")
+            rejected_connections.labels('duplicate').inc()
+            loser.disconnect()
+
+        self.address_book.add(peer.listen_address)
+        if peer.outbound:
+            self.address_book.mark_success(peer.address)
+
+    def handle_peers(self, addresses):
+        # only remembering gossiped addresses, the maintenance thread decides whom to dial
+        for peer_info in addresses[:MAX_SHARED_ADDRESSES]:
+            try:
+                host, port = peer_info
+                if isinstance(host, str) and isinstance(port, int) and 0 < port < 65536:
+                    self.address_book.add((host, port))
+            except (TypeError, ValueError):
+                continue
+
+    def shareable_addresses(self):
+        return [list(address) for address in self.address_book.sample(MAX_SHARED_ADDRESSES)]
+
+    def connected_addresses(self):
+        addresses = set()
+        for peer in self.node.peers:
+            addresses.add((peer.address[0], peer.address[1]))
+            if peer.listen_address is not None:
+                addresses.add(peer.listen_address)
+        return addresses
+
+    def dial(self, host, port):
+        # connecting in the background, the result feeds the address book
+        address = (host, port)
+        with self.lock:
+            if address in self.dialing or address in self.connected_addresses():
+                return False
+            self.dialing.add(address)
+        self.dialer.submit(self._dial, address)
+        return True
+
+    def _dial(self, address):
+        try:
+            if self.node.connect_to_peer(address[0], address[1]):
+                self.address_book.mark_success(address)
+            else:
+                self.address_book.mark_failure(address)
+        finally:
+            with self.lock:
+                self.dialing.discard(address)
+
+    def _maintain(self):
+        # topping outbound connections up to the target from the best scored addresses
+        while self.running:
+            self.wakeup.wait(MAINTAIN_INTERVAL)
+            self.wakeup.clear()
+            if not self.running:
+                break
+
+            with self.lock:
+                wanted = self.target_outbound - self._count(True) - len(self.dialing)
+                exclude = self.connected_addresses() | self.dialing
+            if wanted <= 0:
+                continue
+
+            for host, port in self.address_book.candidates(exclude, wanted):
+                if (host, port) != (self.node.host, self.node.port):
+                    self.dial(host, port)
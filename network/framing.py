@@ -0,0 +1,156 @@
+import struct
+from network.message import (
+    Message, GET_HEADERS, HEADERS, GET_BLOCKS, BLOCKS, INV, GETDATA, VERSION,
+    SNAPSHOT, GET_SNAPSHOT_CHUNK, SNAPSHOT_CHUNK
+)
+
+# frame header: payload length, protocol version, message type code
+FRAME_HEADER = struct.Struct('>IBB')
+PROTOCOL_VERSION = 1
+# keeps the first byte of a binary frame far away from '{', which starts a JSON line
+MAX_FRAME_SIZE = 32 * 1024 * 1024
+
+WIRE_BINARY = 'binary'
+WIRE_JSON = 'json'
+
+# 0 is reserved for types without a code, the receiver reads them from the payload
+# 1 and 2 carried the whole-chain GET_CHAIN and CHAIN messages, they stay unused
+MESSAGE_TYPE_CODES = {
+    'NEW_BLOCK': 3,
+    'NEW_TRANSACTION': 4,
+    'GET_PEERS': 5,
+    'PEERS': 6,
+    GET_HEADERS: 7,
+    HEADERS: 8,
+    GET_BLOCKS: 9,
+    BLOCKS: 10,
+    INV: 11,
+    GETDATA: 12,
+    VERSION: 13,
+    SNAPSHOT: 14,
+    GET_SNAPSHOT_CHUNK: 15,
+    SNAPSHOT_CHUNK: 16,
+}
+MESSAGE_TYPES_BY_CODE = dict((code, msg_type) for msg_type, code in MESSAGE_TYPE_CODES.items())
+
+
+class FrameError(Exception):
+    pass
+
+
+def encode_message(message, wire_format=WIRE_BINARY):
+    # serializing a message for the wire in either framing
+    payload = message.to_json().encode('utf-8')
+    if wire_format == WIRE_JSON:
+        return payload + b'\n'
+
+    if len(payload) > MAX_FRAME_SIZE:
+        raise FrameError(f"Message of {len(payload)} bytes exceeds the frame limit")
+    header = FRAME_HEADER.pack(
+        len(payload), PROTOCOL_VERSION, MESSAGE_TYPE_CODES.get(message.msg_type, 0)
+    )
+    return header + payload
+
+
+class FrameReader:
+    # Reusable receive buffer that yields complete messages without re-copying data
+
+    def __init__(self, initial_size=64 * 1024, max_frame_size=MAX_FRAME_SIZE):
+        self.initial_size = initial_size
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray(initial_size)
+        self.start = 0
+        self.end = 0
+        self.scan = 0
+        # detected from the first byte the peer sends
+        self.wire_format = None
+
+    def recv_from(self, sock):
+        # reading straight into the free tail of the buffer
+        if self.end == len(self.buffer):
+            self._make_room(self.end - self.start + 1)
+        with memoryview(self.buffer) as view:
+            received = sock.recv_into(view[self.end:])
+        self.end += received
+        return received
+
+    def feed(self, data):
+        # copying already received bytes in, mostly for tests and benchmarks
+        needed = self.end - self.start + len(data)
+        if self.end + len(data) > len(self.buffer):
+            self._make_room(needed)
+        self.buffer[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def _make_room(self, needed):
+        # moving unread bytes to the front, growing only when one frame needs it
+        pending = self.end - self.start
+        if needed > len(self.buffer):
+            if needed > self.max_frame_size + FRAME_HEADER.size:
+                raise FrameError(f"Frame of {needed} bytes exceeds the frame limit")
+            new_buffer = bytearray(max(needed, len(self.buffer) * 2))
+            new_buffer[:pending] = self.buffer[self.start:self.end]
+            self.buffer = new_buffer
+        elif self.start:
+            self.buffer[:pending] = self.buffer[self.start:self.end]
+        self.scan -= self.start
+        self.start = 0
+        self.end = pending
+
+    def _consumed(self):
+        # shrinking back after a large frame so idle peers hold little memory
+        if self.start == self.end:
+            self.start = self.end = self.scan = 0
+            if len(self.buffer) > self.initial_size:
+                self.buffer = bytearray(self.initial_size)
+
+    def messages(self):
+        # yielding (msg_type, payload) for every complete message in the buffer
+        while self.end > self.start:
+            if self.wire_format is None:
+                self.wire_format = WIRE_JSON if self.buffer[self.start] == ord('{') else WIRE_BINARY
+
+            if self.wire_format == WIRE_JSON:
+                message = self._next_line()
+            else:
+                message = self._next_frame()
+            if message is None:
+                break
+            yield message
+        self._consumed()
+
+    def _next_line(self):
+        # newline-delimited JSON, only scanning bytes not looked at before
+        newline = self.buffer.find(b'\n', max(self.start, self.scan), self.end)
+        if newline < 0:
+            self.scan = self.end
+            if self.end - self.start > self.max_frame_size:
+                raise FrameError("JSON message exceeds the frame limit")
+            return None
+        payload = bytes(self.buffer[self.start:newline])
+        self.start = self.scan = newline + 1
+        return None, payload
+
+    def _next_frame(self):
+        if self.end - self.start < FRAME_HEADER.size:
+            return None
+        length, version, type_code = FRAME_HEADER.unpack_from(self.buffer, self.start)
+        if version != PROTOCOL_VERSION:
+            raise FrameError(f"Unsupported protocol version {version}")
+        if length > self.max_frame_size:
+            raise FrameError(f"Frame of {length} bytes exceeds the frame limit")
+
+        frame_end = self.start + FRAME_HEADER.size + length
+        if frame_end > self.end:
+            # making sure the rest of the frame fits before the next recv
+            if frame_end > len(self.buffer):
+                self._make_room(FRAME_HEADER.size + length)
+            return None
+
+        payload = bytes(self.buffer[self.start + FRAME_HEADER.size:frame_end])
+        self.start = frame_end
+        return MESSAGE_TYPES_BY_CODE.get(type_code), payload
+
+
+def decode_payload(payload):
+    return Message.from_json(payload)
@@ -1,6 +1,35 @@
 import json
 import time
 
+# headers-first chain sync
+GET_HEADERS = 'GET_HEADERS'
+HEADERS = 'HEADERS'
+GET_BLOCKS = 'GET_BLOCKS'
+BLOCKS = 'BLOCKS'
+
+# inventory-based gossip, hashes first and bodies on request
+INV = 'INV'
+GETDATA = 'GETDATA'
+INV_TX = 'tx'
+INV_BLOCK = 'block'
+
+# handshake, each side announces its node_id and listening port on connect
+VERSION = 'VERSION'
+
+# state snapshots, announced by digest and fetched in chunks
+SNAPSHOT = 'SNAPSHOT'
+GET_SNAPSHOT_CHUNK = 'GET_SNAPSHOT_CHUNK'
+SNAPSHOT_CHUNK = 'SNAPSHOT_CHUNK'
+
+def _cached_json(data):
+    # JSON for a block/transaction or a list of them, None for plain data
+    if hasattr(data, 'canonical_json'):
+        return data.canonical_json()
+    if isinstance(data, list) and data and all(hasattr(item, 'canonical_json') for item in data):
+        return '[' + ', '.join(item.canonical_json() for item in data) + ']'
+    return None
+
+
 class Message:
     def __init__(self, msg_type, data, sender_id=None):
         self.msg_type = msg_type
@@ -9,12 +38,22 @@ class Message:
         self.timestamp = time.time()
     
     def to_json(self):
-        return json.dumps({
+        data_json = _cached_json(self.data)
+        if data_json is None:
+            return json.dumps({
+                'msg_type': self.msg_type,
+                'data': self.data,
+                'sender_id': self.sender_id,
+                'timestamp': self.timestamp
+            })
+
+        # splicing in the serialization blocks and transactions already hold
+        envelope = json.dumps({
             'msg_type': self.msg_type,
-            'data': self.data,
             'sender_id': self.sender_id,
             'timestamp': self.timestamp
         })
+        return envelope[:-1] + ', "data": ' + data_json + '}'
     
     @classmethod
     def from_json(cls, json_data):
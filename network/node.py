@@ -2,43 +2,100 @@ import socket
 import random
 from network.server import Server
 from network.peer import Peer
-from network.message import Message
+from network.message import (
+    Message, GET_HEADERS, HEADERS, GET_BLOCKS, BLOCKS, INV, GETDATA, INV_TX, INV_BLOCK, VERSION,
+    SNAPSHOT, GET_SNAPSHOT_CHUNK, SNAPSHOT_CHUNK
+)
+from network.seen_cache import SeenCache
+from network.sync import ChainSync
+from network.snapshot_sync import SnapshotSync
+from network.connection_manager import ConnectionManager
+from network.framing import WIRE_BINARY, MESSAGE_TYPE_CODES
+from network.async_transport import AsyncTransport, CONNECT_TIMEOUT
+from blockchain.transaction import Transaction
+from blockchain.block_pipeline import EXTENDED, REORGANIZED, ORPHAN, INVALID
+from utils.metrics import registry
+
+# how long a peer thread waits for room in the verification queue
+VERIFY_SUBMIT_TIMEOUT = 5.0
+
+# seconds to wait for a GETDATA answer before asking another peer for the same hash
+GETDATA_TIMEOUT = 30.0
+# seconds an announced body stays available for GETDATA
+RELAY_TTL = 120.0
+
+# handler timings exported on /metrics, unknown types share one label so peers cannot add series
+handler_seconds = registry.histogram('handler_seconds', 'Time spent handling a peer message', ['msg_type'])
+connected_peers = registry.gauge('connected_peers', 'Peers currently connected')
+
+TRANSPORT_THREADED = 'threaded'
+TRANSPORT_ASYNCIO = 'asyncio'
 
 class Node:
     
-    def __init__(self, blockchain, host='0.0.0.0', port=8333):
+    def __init__(self, blockchain, host='0.0.0.0', port=8333, wire_format=WIRE_BINARY,
+                 transport=TRANSPORT_THREADED):
         self.blockchain = blockchain
         self.host = host
         self.port = port
-        self.server = Server(self, host, port)
+        # 'threaded' runs a thread per peer, 'asyncio' serves every peer from one event loop
+        self.transport = transport
+        if transport == TRANSPORT_ASYNCIO:
+            self.server = AsyncTransport(self, host, port)
+        else:
+            self.server = Server(self, host, port)
         self.peers = []
+        connected_peers.set_function(lambda: len(self.peers))
         self.node_id = random.randint(1000000, 9999999)
-        self.known_peers = set()
+        # connection limits, handshake dedup and the address book of dialable peers
+        self.connections = ConnectionManager(self)
+        # 'binary' length-prefixed frames, or 'json' lines for older nodes
+        self.wire_format = wire_format
+        self.sync = ChainSync(self)
+        # serving our state snapshots, and on a fresh node starting from one
+        self.snapshot_sync = SnapshotSync(self)
+        # hashes of transactions and blocks already handled, duplicates stop here
+        self.seen = SeenCache()
+        # hashes asked for with GETDATA and not yet answered
+        self.requested = SeenCache(ttl=GETDATA_TIMEOUT)
+        # bodies we announced, kept around so peers can fetch them
+        self.relay_cache = SeenCache(maxsize=20000, ttl=RELAY_TTL)
     
     def start(self):
         #starting node and P2P server
-        return self.server.start()
+        started = self.server.start()
+        if started:
+            self.connections.start()
+            self.snapshot_sync.start()
+        return started
     
     def stop(self):
-        self.server.stop()
-        
+        self.connections.stop()
+        self.snapshot_sync.stop()
         for peer in list(self.peers):
             peer.disconnect()
             
         self.peers = []
+
+        self.server.stop()
     
     def connect_to_peer(self, host, port):
+        # blocking dial, the connection manager calls this from its dialer threads
         peer_addr = (host, port)
-        if peer_addr in [(p.address[0], p.address[1]) for p in self.peers]:
+        if peer_addr in self.connections.connected_addresses():
             print(f"Already connected to {host}:{port}")
             return False
             
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((host, port))
-            
-            self.add_incoming_peer(sock, (host, port))
-            self.known_peers.add((host, port))
+            if self.transport == TRANSPORT_ASYNCIO:
+                self.server.connect(host, port)
+            else:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.settimeout(CONNECT_TIMEOUT)
+                sock.connect((host, port))
+                sock.settimeout(None)
+
+                self.add_incoming_peer(sock, (host, port), outbound=True)
             
             print(f"Connected to peer {host}:{port}")
             return True
@@ -46,17 +103,29 @@ class Node:
             print(f"Error connecting to peer {host}:{port}: {str(e)}")
             return False
     
-    def add_incoming_peer(self, sock, address):
-        #adding a new peer
-        peer = Peer(sock, address, self)
-        self.peers.append(peer)
+    def add_incoming_peer(self, sock, address, outbound=False):
+        #adding a new peer on its own thread
+        peer = Peer(sock, address, self, self.wire_format, outbound)
+        self.add_peer(peer, address)
+
+    def add_peer(self, peer, address):
+        #registering a connected peer from either transport, unless we are at the connection limit
+        if not self.connections.admit(peer):
+            print(f"Connection limit reached, dropping {address[0]}:{address[1]}")
+            peer.disconnect()
+            return False
+        
+        #Telling the peer who we are so duplicate links can be closed
+        self.connections.send_version(peer)
         
-        self.known_peers.add((address[0], address[1]))
+        #Offering our latest snapshot before any headers, a fresh peer may start from it
+        self.snapshot_sync.on_connect(peer)
         
-        #Requesting blockchain from new peer
-        self.request_blockchain(peer)
+        #Syncing headers first, bodies are only fetched for blocks we are missing
+        self.sync.request_headers(peer)
         
         self.request_peers(peer)
+        return True
     
     def remove_peer(self, peer):
         #removing peer from list
@@ -70,23 +139,25 @@ class Node:
         for peer in list(self.peers):
             peer.send(message)
     
-    def broadcast_transaction(self, transaction):
-        tx_data = transaction.to_dict()
-        message = Message('NEW_TRANSACTION', tx_data, self.node_id)
-        self.broadcast(message)
+    def broadcast_transaction(self, transaction, exclude=None):
+        txid = transaction.calculate_txid()
+        self.seen.add((INV_TX, txid))
+        self.relay_cache.add((INV_TX, txid), transaction)
+        self.announce(INV_TX, [txid], exclude)
     
-    def broadcast_block(self, block):
-        block_data = block.to_dict()
-        message = Message('NEW_BLOCK', block_data, self.node_id)
-        self.broadcast(message)
-    
-    def request_blockchain(self, peer=None):
-        message = Message('GET_CHAIN', {}, self.node_id)
-        
-        if peer:
-            peer.send(message)
-        else:
-            self.broadcast(message)
+    def broadcast_block(self, block, exclude=None):
+        self.seen.add((INV_BLOCK, block.hash))
+        self.relay_cache.add((INV_BLOCK, block.hash), block)
+        self.announce(INV_BLOCK, [block.hash], exclude)
+
+    def announce(self, inv_type, hashes, exclude=None):
+        # sending only the hashes, peers ask for the bodies they have not seen
+        # transaction announcements may be merged or dropped for peers that fall behind
+        message = Message(INV, {'type': inv_type, 'hashes': hashes}, self.node_id)
+        low_priority = inv_type == INV_TX
+        for peer in list(self.peers):
+            if peer is not exclude:
+                peer.send(message, low_priority)
     
     def request_peers(self, peer=None):
         message = Message('GET_PEERS', {}, self.node_id)
@@ -98,12 +169,14 @@ class Node:
     
     def handle_message(self, message, peer):
         msg_type = message.msg_type
+        label = msg_type if msg_type in MESSAGE_TYPE_CODES else 'other'
+        with handler_seconds.labels(label).time():
+            self._dispatch(message, peer)
+
+    def _dispatch(self, message, peer):
+        msg_type = message.msg_type
         
-        if msg_type == 'GET_CHAIN':
-            self.handle_get_chain(message, peer)
-        elif msg_type == 'CHAIN':
-            self.handle_chain(message, peer)
-        elif msg_type == 'NEW_BLOCK':
+        if msg_type == 'NEW_BLOCK':
             self.handle_new_block(message, peer)
         elif msg_type == 'NEW_TRANSACTION':
             self.handle_new_transaction(message, peer)
@@ -111,76 +184,115 @@ class Node:
             self.handle_get_peers(message, peer)
         elif msg_type == 'PEERS':
             self.handle_peers(message, peer)
-    
-    def handle_get_chain(self, message, peer):
-        chain_data = []
-        for block in self.blockchain.chain:
-            chain_data.append(block.to_dict())
-        
-        response = Message('CHAIN', chain_data, self.node_id)
-        peer.send(response)
-    
-    def handle_chain(self, message, peer):
-        chain_data = message.data
-        
-        if len(chain_data) <= len(self.blockchain.chain):
+        elif msg_type == GET_HEADERS:
+            self.sync.handle_get_headers(message, peer)
+        elif msg_type == HEADERS:
+            self.sync.handle_headers(message, peer)
+        elif msg_type == GET_BLOCKS:
+            self.sync.handle_get_blocks(message, peer)
+        elif msg_type == BLOCKS:
+            self.sync.handle_blocks(message, peer)
+            self.snapshot_sync.handle_blocks(message, peer)
+        elif msg_type == VERSION:
+            self.connections.handle_version(message, peer)
+        elif msg_type == INV:
+            self.handle_inv(message, peer)
+        elif msg_type == GETDATA:
+            self.handle_getdata(message, peer)
+        elif msg_type == SNAPSHOT:
+            self.snapshot_sync.handle_snapshot(message, peer)
+        elif msg_type == GET_SNAPSHOT_CHUNK:
+            self.snapshot_sync.handle_get_chunk(message, peer)
+        elif msg_type == SNAPSHOT_CHUNK:
+            self.snapshot_sync.handle_chunk(message, peer)
+
+    def handle_inv(self, message, peer):
+        # requesting only what we have neither seen nor already asked someone for
+        inv_type = message.data.get('type')
+        if inv_type not in (INV_TX, INV_BLOCK):
             return
-            
-        try:
-            for block_data in chain_data:
-                if not all(k in block_data for k in ['index', 'timestamp', 'previous_hash', 'hash', 'transactions']):
-                    print("Invalid block structure in received chain")
-                    return
-            
-            print(f"Received longer blockchain ({len(chain_data)} blocks)")
-            # TODO: Replace blockchain with received chain
-        except Exception as e:
-            print(f"Error processing received blockchain: {str(e)}")
+
+        wanted = []
+        for item_hash in message.data.get('hashes', []):
+            key = (inv_type, item_hash)
+            if key in self.seen or not self.requested.add(key):
+                continue
+            wanted.append(item_hash)
+
+        if wanted:
+            peer.send(Message(GETDATA, {'type': inv_type, 'hashes': wanted}, self.node_id))
+
+    def handle_getdata(self, message, peer):
+        inv_type = message.data.get('type')
+        msg_type = 'NEW_TRANSACTION' if inv_type == INV_TX else 'NEW_BLOCK'
+
+        for item_hash in message.data.get('hashes', []):
+            body = self.relay_cache.get((inv_type, item_hash))
+            if body is None and inv_type == INV_BLOCK:
+                height = self.blockchain.height_of(item_hash)
+                if height is not None and self.blockchain.chain[height].has_body():
+                    body = self.blockchain.chain[height]
+            if body is not None:
+                peer.send(Message(msg_type, body, self.node_id))
     
     def handle_new_block(self, message, peer):
         block_data = message.data
-        print(f"Received new block #{block_data['index']} from peer")
-        # TODO: Validate and add block to chain
+        if not isinstance(block_data, dict) or not self.seen.add((INV_BLOCK, block_data.get('hash'))):
+            return
+        print(f"Received new block #{block_data.get('index')} from peer")
+
+        def on_placed(block, status):
+            if status in (EXTENDED, REORGANIZED):
+                # relaying only blocks that made it onto our chain
+                self.broadcast_block(block, exclude=peer)
+            elif status == ORPHAN:
+                # asking the sender for the headers between our chain and the block
+                self.sync.request_headers(peer)
+            elif status == INVALID:
+                print(f"Rejected invalid block from {peer.address[0]}:{peer.address[1]}")
+                # the hash was only the sender's claim, a tampered body must not shadow the real block
+                self.seen.discard((INV_BLOCK, block_data.get('hash')))
+                self.requested.discard((INV_BLOCK, block_data.get('hash')))
+
+        # checks run off this thread, blocking here when the queue is full slows this peer down
+        if not self.blockchain.submit_block(block_data, on_placed, timeout=VERIFY_SUBMIT_TIMEOUT):
+            print("Block queue full, dropping block from peer")
+            self.seen.discard((INV_BLOCK, block_data.get('hash')))
     
     def handle_new_transaction(self, message, peer):
         tx_data = message.data
         
-        from blockchain.transaction import Transaction
-        
         try:
-            transaction = Transaction(
-                sender=tx_data['sender'],
-                recipient=tx_data['recipient'],
-                data=tx_data['data'],
-                signature=tx_data['signature']
-            )
+            # from_dict keeps the signature scheme, without it the txid and verification would differ
+            transaction = Transaction.from_dict(tx_data)
+
+            # duplicates are dropped here, before any signature verification
+            if not self.seen.add((INV_TX, transaction.calculate_txid())):
+                return
             
-            if transaction.verify_signature():
-                if self.blockchain.add_transaction(transaction):
+            def relay(tx, accepted):
+                # announcing to everyone except the sender once the tx is accepted
+                if accepted:
                     print(f"Added new transaction from peer")
-                    
-                    for other_peer in self.peers:
-                        if other_peer != peer:
-                            other_peer.send(message)
+                    self.broadcast_transaction(tx, exclude=peer)
+
+            # queueing for batched verification, blocking here when the queue is full
+            # slows down reading from this peer instead of growing memory
+            if not self.blockchain.submit_transaction(
+                transaction, relay, broadcast=False, timeout=VERIFY_SUBMIT_TIMEOUT
+            ):
+                print("Verification queue full, dropping transaction from peer")
+                self.seen.discard((INV_TX, transaction.calculate_txid()))
             
         except Exception as e:
             print(f"Error processing transaction: {str(e)}")
     
     def handle_get_peers(self, message, peer):
-        peer_list = list(self.known_peers)
+        peer_list = self.connections.shareable_addresses()
         response = Message('PEERS', peer_list, self.node_id)
         peer.send(response)
     
     def handle_peers(self, message, peer):
-        peer_list = message.data
-        
-        for peer_info in peer_list:
-            try:
-                host, port = peer_info
-                self.known_peers.add((host, port))
-                
-                if random.random() < 0.3:  # 30% chance to connect
-                    self.connect_to_peer(host, port)
-                    
-            except Exception as e:
-                print(f"Error processing peer info: {str(e)}")
+        # remembering the addresses, dialing is left to the connection manager
+        if isinstance(message.data, list):
+            self.connections.handle_peers(message.data)
@@ -1,35 +1,72 @@
 import socket
 import threading
 import time
-from network.message import Message
+from network.framing import FrameReader, FrameError, encode_message, decode_payload, WIRE_BINARY
+from network.send_queue import SendQueue, OVERFLOW, QUEUED
+from utils.metrics import registry
+
+# per-peer traffic exported on /metrics, shared by both transports
+peer_bytes = registry.counter('peer_bytes_total', 'Bytes exchanged with a peer', ['peer', 'direction'])
+peer_messages = registry.counter('peer_messages_total', 'Messages exchanged with a peer', ['peer', 'direction'])
+
+
+class PeerTraffic:
+    # the four counters of one connection, looked up once instead of per message
+
+    def __init__(self, address):
+        self.label = f"{address[0]}:{address[1]}"
+        self.bytes_in = peer_bytes.labels(self.label, 'in')
+        self.bytes_out = peer_bytes.labels(self.label, 'out')
+        self.messages_in = peer_messages.labels(self.label, 'in')
+        self.messages_out = peer_messages.labels(self.label, 'out')
+
+    def forget(self):
+        # dropping the series once the connection is gone so they do not pile up
+        for direction in ('in', 'out'):
+            peer_bytes.remove(self.label, direction)
+            peer_messages.remove(self.label, direction)
+
 
 class Peer:
     # Represents a connection to the peer
     
-    def __init__(self, sock, address, node):
+    def __init__(self, sock, address, node, wire_format=WIRE_BINARY, outbound=False):
         self.sock = sock
         self.address = address
         self.node = node
+        # whether we dialed this peer, and what its VERSION handshake told us
+        self.outbound = outbound
+        self.node_id = None
+        self.listen_address = None
         self.running = True
-        self.buffer = b''
+        self.wire_format = wire_format
+        self.reader = FrameReader()
+        self.traffic = PeerTraffic(address)
+        # messages wait here for the writer thread, so senders never block on the socket
+        self.send_queue = SendQueue()
         
         # Start the listening thread
         self.thread = threading.Thread(target=self._listen)
         self.thread.daemon = True
         self.thread.start()
+
+        # Start the writer thread
+        self.writer_thread = threading.Thread(target=self._write_loop)
+        self.writer_thread.daemon = True
+        self.writer_thread.start()
     
     def _listen(self):
         # Listen for incoming messages from peer
         while self.running:
             try:
                 self.sock.settimeout(1.0)
-                data = self.sock.recv(4096)
+                received = self.reader.recv_from(self.sock)
                 
-                if not data:
+                if not received:
                     self.disconnect()
                     break
+                self.traffic.bytes_in.inc(received)
                 
-                self.buffer += data
                 self._process_buffer()
                 
             except socket.timeout:
@@ -37,35 +74,52 @@ class Peer:
             except ConnectionError:
                 self.disconnect()
                 break
+            except FrameError as e:
+                print(f"Protocol error from {self.address}: {str(e)}")
+                self.disconnect()
+                break
             except Exception as e:
-                print(f"Error receiving data from {self.address}: {str(e)}")
+                # the writer may have closed the socket under us
+                if self.running:
+                    print(f"Error receiving data from {self.address}: {str(e)}")
                 self.disconnect()
                 break
     
     def _process_buffer(self):
-        # Process the data in buffer
-        try:
-            messages = self.buffer.split(b'\n')
-            
-            for i in range(len(messages) - 1):
-                msg_data = messages[i].decode('utf-8')
-                message = Message.from_json(msg_data)
+        # Process every complete message in the buffer
+        for _, payload in self.reader.messages():
+            # Answering an old newline-JSON peer in its own framing
+            self.wire_format = self.reader.wire_format
+            self.traffic.messages_in.inc()
+            try:
+                message = decode_payload(payload)
                 self.node.handle_message(message, self)
-            
-            self.buffer = messages[-1]
-        except Exception as e:
-            print(f"Error processing message from {self.address}: {str(e)}")
+            except Exception as e:
+                print(f"Error processing message from {self.address}: {str(e)}")
     
-    def send(self, message):
-        # Send message to peer
-        try:
-            data = message.to_json() + '\n'
-            self.sock.sendall(data.encode('utf-8'))
-            return True
-        except Exception as e:
-            print(f"Error sending message to {self.address}: {str(e)}")
+    def send(self, message, low_priority=False):
+        # Queue a message for the writer thread, low-priority traffic is dropped when the peer falls behind
+        result = self.send_queue.put(message, low_priority)
+        if result == OVERFLOW:
+            print(f"Peer {self.address} is too slow, disconnecting")
             self.disconnect()
-            return False
+        return result == QUEUED
+
+    def _write_loop(self):
+        # Encode and write queued messages in order
+        while self.running:
+            message = self.send_queue.get(timeout=1.0)
+            if message is None:
+                continue
+            try:
+                data = encode_message(message, self.wire_format)
+                self.sock.sendall(data)
+                self.traffic.bytes_out.inc(len(data))
+                self.traffic.messages_out.inc()
+            except Exception as e:
+                print(f"Error sending message to {self.address}: {str(e)}")
+                self.disconnect()
+                break
     
     def disconnect(self):
         # Disconnect from the peer
@@ -73,6 +127,8 @@ class Peer:
             return
             
         self.running = False
+        self.traffic.forget()
+        self.send_queue.close()
         try:
             self.sock.close()
         except:
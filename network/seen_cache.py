@@ -0,0 +1,57 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class SeenCache:
+    # Bounded set of recently seen keys that forgets entries after ttl seconds
+    # an optional value per key lets it double as a short-lived payload store
+
+    def __init__(self, maxsize=100000, ttl=600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def _expire(self, now):
+        # entries are kept in insertion order, so expired ones sit at the front
+        while self.entries:
+            key, (expires, _) = next(iter(self.entries.items()))
+            if expires > now:
+                break
+            del self.entries[key]
+
+    def add(self, key, value=None):
+        # returns True when the key was not seen before
+        now = time.time()
+        with self.lock:
+            self._expire(now)
+            if key in self.entries:
+                return False
+            self.entries[key] = (now + self.ttl, value)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+            return True
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= now:
+                return None
+            return entry[1]
+
+    def __contains__(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and entry[0] > now
+
+    def __len__(self):
+        with self.lock:
+            self._expire(time.time())
+            return len(self.entries)
@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import deque
+from network.message import Message, INV
+from utils.metrics import registry
+
+# messages a peer may have waiting before low-priority traffic is dropped
+OUTBOUND_QUEUE_SIZE = 1000
+# seconds a peer's queue may stay full before the peer is considered too slow
+SLOW_PEER_TIMEOUT = 30.0
+# most hashes folded into one pending INV
+MAX_COALESCED_HASHES = 1000
+
+# what put() did with a message
+QUEUED = 'queued'
+DROPPED = 'dropped'
+OVERFLOW = 'overflow'
+
+dropped_messages = registry.counter('peer_dropped_messages_total', 'Low-priority messages dropped for slow peers')
+coalesced_messages = registry.counter('peer_coalesced_messages_total', 'Announcements folded into a pending INV')
+
+
+class SendQueue:
+    # Bounded outbound queue of one peer, drained by that peer's writer
+
+    def __init__(self, max_messages=OUTBOUND_QUEUE_SIZE):
+        self.max_messages = max_messages
+        self.condition = threading.Condition()
+        self.messages = deque()
+        # the queued low-priority INV still open for more hashes, per inventory type
+        self.open_inv = {}
+        self.full_since = None
+        self.closed = False
+
+    def put(self, message, low_priority=False):
+        # QUEUED, DROPPED for low-priority traffic on a full queue, or OVERFLOW when the peer is too slow
+        with self.condition:
+            if self.closed:
+                return DROPPED
+
+            if low_priority and message.msg_type == INV:
+                if self._coalesce(message):
+                    return QUEUED
+
+            if len(self.messages) >= self.max_messages:
+                now = time.time()
+                if self.full_since is None:
+                    self.full_since = now
+                if not low_priority or now - self.full_since > SLOW_PEER_TIMEOUT:
+                    return OVERFLOW
+                dropped_messages.inc()
+                return DROPPED
+
+            if low_priority and message.msg_type == INV:
+                # queueing a private copy, the broadcast message is shared by every peer
+                message = Message(INV, {'type': message.data['type'], 'hashes': list(message.data['hashes'])},
+                                  message.sender_id)
+                self.open_inv[message.data['type']] = message
+            self.messages.append(message)
+            self.condition.notify()
+            return QUEUED
+
+    def _coalesce(self, message):
+        pending = self.open_inv.get(message.data['type'])
+        if pending is None or len(pending.data['hashes']) >= MAX_COALESCED_HASHES:
+            return False
+        pending.data['hashes'].extend(message.data['hashes'])
+        coalesced_messages.inc()
+        return True
+
+    def _pop(self):
+        message = self.messages.popleft()
+        if message.msg_type == INV and self.open_inv.get(message.data['type']) is message:
+            del self.open_inv[message.data['type']]
+        if len(self.messages) < self.max_messages // 2:
+            self.full_since = None
+        return message
+
+    def get(self, timeout=None):
+        # blocking until a message is ready, None on timeout or once closed
+        with self.condition:
+            if not self.messages and not self.closed:
+                self.condition.wait(timeout)
+            if not self.messages:
+                return None
+            return self._pop()
+
+    def get_nowait(self):
+        with self.condition:
+            if not self.messages:
+                return None
+            return self._pop()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.messages.clear()
+            self.open_inv = {}
+            self.condition.notify_all()
+
+    def __len__(self):
+        return len(self.messages)
@@ -0,0 +1,391 @@
+import base64
+import os
+import threading
+import random
+import time
+from blockchain.block import Block
+from blockchain.snapshot import Snapshot, SnapshotReplay
+from blockchain.validation import check_block
+from network.message import Message, SNAPSHOT, GET_SNAPSHOT_CHUNK, SNAPSHOT_CHUNK, GET_BLOCKS
+from network.address_book import netgroup
+from network.sync import BLOCK_BATCH_SIZE, REQUEST_TIMEOUT
+from utils.metrics import registry
+
+# bytes per SNAPSHOT_CHUNK, base64 keeps a chunk well under the frame limit
+CHUNK_SIZE = 1024 * 1024
+# seconds a fresh node listens for snapshot announcements after its first connection
+BOOTSTRAP_WAIT = 5.0
+# seconds without a chunk before the download moves on to another peer
+CHUNK_TIMEOUT = 30.0
+# seconds after the first connection before an unfinished bootstrap falls back to replaying every block
+BOOTSTRAP_TIMEOUT = 600.0
+# distinct networks that must offer the same snapshot before a fresh node starts from it
+MIN_SNAPSHOT_PEERS = 2
+
+# bootstrap progress of a fresh node
+DECIDING = 'deciding'
+DOWNLOADING = 'downloading'
+READY = 'ready'
+# bootstrapped, the blocks below the base are fetched and recounted to check the snapshot
+VERIFYING = 'verifying'
+# not bootstrapping: finished, given up, or the node already had a chain
+OFF = 'off'
+
+bad_responses = registry.counter('snapshot_sync_bad_responses_total', 'Bad chunks or blocks peers sent during snapshot sync',
+                                 ['kind'])
+
+
+def _is_hex_hash(value):
+    if not isinstance(value, str) or len(value) != 64:
+        return False
+    try:
+        int(value, 16)
+        return True
+    except ValueError:
+        return False
+
+
+def _distinct_networks(peers):
+    # counted by where the connections come from, not by the node_id peers claim,
+    # so one host or one subnet with many connections counts once
+    return len(set(netgroup(p.address[0]) for p in peers))
+
+
+class SnapshotSync:
+    # Announces our state snapshots to peers and lets a fresh node start from the best one offered
+
+    def __init__(self, node):
+        self.node = node
+        self.blockchain = node.blockchain
+        self.lock = threading.Lock()
+        # a node with only the genesis block and somewhere to keep snapshots looks for one first,
+        # one restarted before its base snapshot was checked carries on checking it
+        snapshots = self.blockchain.snapshots
+        base = snapshots.base() if snapshots is not None else None
+        self.replay = None
+        self.replay_peer = None
+        self.replay_wanted = set()
+        self.replay_requested_at = 0.0
+        if snapshots is not None and len(self.blockchain.chain) == 1:
+            self.state = DECIDING
+        elif self.blockchain.base_height and base is not None and not base['verified']:
+            self.state = VERIFYING
+            self.replay = SnapshotReplay(self.blockchain.base_height)
+        else:
+            self.state = OFF
+        # digest -> (announced info, peers offering it)
+        self.offers = {}
+        self.chosen = None
+        self.peer = None
+        self.download = None
+        self.offset = 0
+        self.last_chunk_at = 0.0
+        self.ready_info = None
+        self.first_peer_at = None
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if self.state == OFF:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._monitor)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(2.0)
+        with self.lock:
+            self._close_download()
+
+    def announce(self, info, peer=None):
+        # telling peers which snapshot we can serve, by digest so they can check what they fetch
+        message = Message(SNAPSHOT, {
+            'height': info['height'],
+            'hash': info['hash'],
+            'digest': info['digest'],
+            'size': info['size']
+        }, self.node.node_id)
+        if peer:
+            peer.send(message)
+        else:
+            self.node.broadcast(message)
+
+    def on_connect(self, peer):
+        latest = self.blockchain.snapshots.latest() if self.blockchain.snapshots is not None else None
+        if latest is not None:
+            self.announce(latest, peer)
+        with self.lock:
+            if self.state == DECIDING and self.first_peer_at is None:
+                self.first_peer_at = time.time()
+
+    def skip_height(self):
+        # blocks up to this height come from a snapshot and need no bodies,
+        # None while a fresh node is still waiting to hear about snapshots
+        with self.lock:
+            if self.state == DECIDING:
+                return None
+            if self.state in (OFF, VERIFYING):
+                return 0
+            return self.chosen['height']
+
+    def ready_snapshot(self):
+        with self.lock:
+            return self.ready_info if self.state == READY else None
+
+    def finish(self):
+        # bootstrapped, the snapshot is trusted for now and checked against the blocks in the background
+        with self.lock:
+            self.state = VERIFYING
+            self.replay = SnapshotReplay(self.blockchain.base_height)
+            self.replay_peer = None
+
+    def reject(self):
+        # the snapshot did not fit the header chain, every block gets replayed instead
+        with self.lock:
+            self._give_up("snapshot does not match the header chain")
+
+    def handle_snapshot(self, message, peer):
+        data = message.data
+        if not isinstance(data, dict):
+            return
+        height, size = data.get('height'), data.get('size')
+        if not isinstance(height, int) or height < 1 or not isinstance(size, int) or size < 1:
+            return
+        if not _is_hex_hash(data.get('hash')) or not _is_hex_hash(data.get('digest')):
+            return
+
+        info = {'height': height, 'hash': data['hash'], 'digest': data['digest'], 'size': size}
+        with self.lock:
+            if self.state not in (DECIDING, DOWNLOADING):
+                return
+            offered_by = self.offers.setdefault(info['digest'], (info, []))[1]
+            if peer not in offered_by:
+                offered_by.append(peer)
+
+    def handle_get_chunk(self, message, peer):
+        if self.blockchain.snapshots is None or not isinstance(message.data, dict):
+            return
+        digest, offset = message.data.get('digest'), message.data.get('offset')
+        if not isinstance(digest, str) or not isinstance(offset, int):
+            return
+        chunk = self.blockchain.snapshots.read_chunk(digest, offset, CHUNK_SIZE)
+        if chunk is None:
+            return
+        peer.send(Message(SNAPSHOT_CHUNK, {
+            'digest': digest,
+            'offset': offset,
+            'data': base64.b64encode(chunk).decode('ascii')
+        }, self.node.node_id))
+
+    def handle_chunk(self, message, peer):
+        with self.lock:
+            resume = self._take_chunk(message.data, peer)
+        self._resume(resume)
+
+    def _take_chunk(self, data, peer):
+        if self.state != DOWNLOADING or peer is not self.peer or not isinstance(data, dict):
+            return False
+        if data.get('digest') != self.chosen['digest'] or data.get('offset') != self.offset:
+            return False
+        try:
+            chunk = base64.b64decode(data.get('data', ''), validate=True)
+        except (TypeError, ValueError):
+            chunk = b''
+        if not chunk or self.offset + len(chunk) > self.chosen['size']:
+            bad_responses.labels('chunk').inc()
+            return self._switch_peer()
+
+        self.download.write(chunk)
+        self.offset += len(chunk)
+        self.last_chunk_at = time.time()
+        if self.offset < self.chosen['size']:
+            self._request_chunk()
+            return False
+        return self._complete_download()
+
+    def _resume(self, resume):
+        # chain sync is told outside our lock, it calls back into skip_height under its own
+        if resume:
+            self.node.sync.resume()
+
+    def _request_chunk(self):
+        self.peer.send(Message(GET_SNAPSHOT_CHUNK, {
+            'digest': self.chosen['digest'],
+            'offset': self.offset
+        }, self.node.node_id))
+
+    def _complete_download(self):
+        # checking the file against the announced digest before trusting anything in it
+        path = self.download.name
+        self._close_download(remove=False)
+        try:
+            info = self.blockchain.snapshots.add_file(path, self.chosen['digest'])
+            if info['height'] != self.chosen['height'] or info['hash'] != self.chosen['hash']:
+                raise ValueError("Snapshot contents do not match its announcement")
+        except ValueError as e:
+            print(f"Discarding downloaded snapshot: {str(e)}")
+            if os.path.exists(path):
+                os.remove(path)
+            self.offers.pop(self.chosen['digest'], None)
+            return self._choose()
+
+        print(f"Downloaded state snapshot at height {info['height']}")
+        self.ready_info = info
+        self.state = READY
+        return True
+
+    def _close_download(self, remove=True):
+        if self.download is not None:
+            path = self.download.name
+            self.download.close()
+            self.download = None
+            if remove and os.path.exists(path):
+                os.remove(path)
+
+    def _choose(self):
+        # the highest snapshot that enough distinct nodes offered, the most widely offered among equals
+        # returns True when chain sync can go on without waiting for us
+        while self.offers:
+            for offer_digest, (_, offered_by) in list(self.offers.items()):
+                offered_by[:] = [p for p in offered_by if p.running]
+                if _distinct_networks(offered_by) < MIN_SNAPSHOT_PEERS:
+                    del self.offers[offer_digest]
+            if not self.offers:
+                break
+            digest, (info, peers) = max(
+                self.offers.items(), key=lambda item: (item[1][0]['height'], _distinct_networks(item[1][1]))
+            )
+
+            self.chosen = info
+            self.peer = peers[0]
+            self.offset = 0
+            self.download = open(self.blockchain.snapshots.incoming_path(digest), 'wb')
+            self.last_chunk_at = time.time()
+            self.state = DOWNLOADING
+            print(f"Bootstrapping from the snapshot at height {info['height']}")
+            self._request_chunk()
+            return True
+
+        self._give_up("no snapshot offered from %d networks" % MIN_SNAPSHOT_PEERS)
+        return True
+
+    def _switch_peer(self):
+        # carrying on from the same offset with another peer that offered the snapshot
+        peers = self.offers.get(self.chosen['digest'], (None, []))[1]
+        if self.peer in peers:
+            peers.remove(self.peer)
+        peers[:] = [p for p in peers if p.running]
+        if peers:
+            self.peer = peers[0]
+            self.last_chunk_at = time.time()
+            self._request_chunk()
+            return False
+        self._close_download()
+        self.offers.pop(self.chosen['digest'], None)
+        return self._choose()
+
+    def _give_up(self, reason):
+        if self.state != OFF:
+            print(f"Not bootstrapping from a snapshot ({reason}), replaying the chain instead")
+        self._close_download()
+        self.state = OFF
+
+    def handle_blocks(self, message, peer):
+        with self.lock:
+            replay = self._take_blocks(message.data, peer)
+        if replay is not None:
+            self._check_replay(replay)
+
+    def _take_blocks(self, data, peer):
+        # replaying the bodies we asked this peer for, returns the replay once it is complete
+        if self.state != VERIFYING or peer is not self.replay_peer or not isinstance(data, list):
+            return None
+        by_hash = dict(
+            (block_data['hash'], block_data) for block_data in data
+            if isinstance(block_data, dict) and block_data.get('hash') in self.replay_wanted
+        )
+        if not by_hash:
+            # an answer to chain sync, or a peer without these bodies that the timeout moves past
+            return None
+
+        while not self.replay.done():
+            block_hash = self.blockchain.get_header(self.replay.next_height)['hash']
+            block_data = by_hash.get(block_hash)
+            if block_data is None:
+                break
+            try:
+                block = Block.from_dict(block_data)
+            except Exception:
+                block = None
+            if block is None or block.hash != block_hash or not check_block(block):
+                bad_responses.labels('block').inc()
+                self._request_replay(switch=True)
+                return None
+            if not self.replay.add(block):
+                print(f"Cannot check the base snapshot: {self.replay.error}")
+                self.state = OFF
+                return None
+
+        if self.replay.done():
+            self.state = OFF
+            return self.replay
+        # a peer missing some of the bodies leaves the rest to another one
+        self._request_replay(switch=len(by_hash) < len(self.replay_wanted))
+        return None
+
+    def _request_replay(self, switch=False):
+        # asking for the next batch of bodies below the base, from another peer when switching
+        peers = [p for p in self.node.peers if p.running]
+        if switch and len(peers) > 1 and self.replay_peer in peers:
+            peers.remove(self.replay_peer)
+        if not peers:
+            self.replay_peer = None
+            return
+        if switch or self.replay_peer not in peers:
+            self.replay_peer = random.choice(peers)
+
+        last = min(self.replay.height, self.replay.next_height + BLOCK_BATCH_SIZE - 1)
+        hashes = [self.blockchain.get_header(height)['hash'] for height in range(self.replay.next_height, last + 1)]
+        self.replay_wanted = set(hashes)
+        self.replay_requested_at = time.time()
+        self.replay_peer.send(Message(GET_BLOCKS, {'hashes': hashes}, self.node.node_id))
+
+    def _check_replay(self, replay):
+        # comparing the recount with the base snapshot, a mismatch replaces the snapshot's state
+        base = self.blockchain.snapshots.base()
+        if replay.matches(Snapshot(base['path'])):
+            self.blockchain.snapshots.mark_base_verified()
+            print(f"Checked the base snapshot against blocks 1 to {replay.height}")
+        else:
+            print("The base snapshot does not match the blocks it stands in for")
+            self.blockchain.replace_base(replay)
+
+    def _monitor(self):
+        while self.running and self.state != OFF:
+            time.sleep(1.0)
+            resume = False
+            with self.lock:
+                now = time.time()
+                if self.state == VERIFYING:
+                    if self.replay_peer is None or not self.replay_peer.running or \
+                            now - self.replay_requested_at > REQUEST_TIMEOUT:
+                        self._request_replay(switch=True)
+                    continue
+                if self.state != OFF and len(self.blockchain.chain) > 1 and self.blockchain.base_height == 0:
+                    # blocks arrived some other way, there is nothing left to bootstrap
+                    self._give_up("the chain already grew")
+                    resume = True
+                elif self.first_peer_at is None:
+                    continue
+                elif now - self.first_peer_at > BOOTSTRAP_TIMEOUT:
+                    self._give_up("timed out")
+                    resume = True
+                elif self.state == DECIDING and now - self.first_peer_at >= BOOTSTRAP_WAIT:
+                    resume = self._choose()
+                elif self.state == DOWNLOADING and (now - self.last_chunk_at > CHUNK_TIMEOUT or
+                                                    not self.peer.running):
+                    resume = self._switch_peer()
+            self._resume(resume)
@@ -0,0 +1,285 @@
+import threading
+import time
+from blockchain.block import Block
+from mining.difficulty import meets_target, target_from_hex, work_of, RETARGET_WINDOW
+from network.message import Message, GET_HEADERS, HEADERS, GET_BLOCKS, BLOCKS
+from utils.metrics import registry
+
+# how many headers a single HEADERS reply carries at most
+MAX_HEADERS = 500
+# how many block bodies go into one GET_BLOCKS request
+BLOCK_BATCH_SIZE = 16
+# how many GET_BLOCKS requests may be outstanding per peer
+MAX_IN_FLIGHT_PER_PEER = 2
+# seconds before an unanswered GET_BLOCKS gets handed to another peer
+REQUEST_TIMEOUT = 15.0
+
+headers_received = registry.counter('sync_headers_total', 'Headers received from peers', ['result'])
+sync_blocks_pending = registry.gauge('sync_blocks_pending', 'Headers of the synced branch whose blocks are not applied yet')
+branch_switches = registry.counter('sync_branch_switches_total', 'Switches to a heavier branch fetched by sync')
+
+
+class ChainSync:
+    # Headers-first sync: fetch headers, find the fork point, then pull bodies in batches
+
+    def __init__(self, node):
+        self.node = node
+        self.blockchain = node.blockchain
+        self.lock = threading.Lock()
+        self._reset()
+        sync_blocks_pending.set_function(lambda: len(self.headers))
+
+    def _reset(self):
+        self.fork_height = None
+        self.headers = []
+        self.header_peer = None
+        self.bodies = {}
+        # batches are keyed by the height of their first block, counted in BLOCK_BATCH_SIZE steps
+        # from batch_origin, so applying blocks off the front never moves them
+        self.batch_origin = None
+        self.in_flight = {}
+        self.next_batch = None
+
+    def request_headers(self, peer, locator=None):
+        # asking a peer for the headers after the newest block we share
+        data = {'locator': locator or self.blockchain.get_block_locator(), 'max': MAX_HEADERS}
+        peer.send(Message(GET_HEADERS, data, self.node.node_id))
+
+    def handle_get_headers(self, message, peer):
+        fork_height = self.blockchain.find_fork_point(message.data.get('locator', []))
+        if fork_height is None:
+            fork_height = 0
+        count = min(int(message.data.get('max', MAX_HEADERS)), MAX_HEADERS)
+        headers = self.blockchain.get_headers(fork_height + 1, count)
+        response = Message(HEADERS, {
+            'fork_height': fork_height,
+            'headers': headers,
+            'tip_height': len(self.blockchain.chain) - 1
+        }, self.node.node_id)
+        peer.send(response)
+
+    def _valid_headers(self, headers, previous_hash, previous_index, history):
+        # checking linkage, heights, header hashes, proof of work and targets without any bodies
+        for header in headers:
+            if header['previous_hash'] != previous_hash or header['index'] != previous_index + 1:
+                return False
+            if Block.hash_header(header) != header['hash']:
+                return False
+            if not meets_target(header['hash'], target_from_hex(header['target'])):
+                return False
+            previous_hash = header['hash']
+            previous_index = header['index']
+        return not headers or self.blockchain.check_header_targets(headers, history)
+
+    def handle_headers(self, message, peer):
+        headers = message.data.get('headers', [])
+        fork_height = message.data.get('fork_height', 0)
+
+        with self.lock:
+            continuing = self.header_peer is peer and self.headers and \
+                self.headers[-1]['index'] == fork_height
+            if continuing:
+                previous_hash = self.headers[-1]['hash']
+                history = self.blockchain.retarget_history(self.fork_height + 1) + self.headers
+            else:
+                if not headers:
+                    return
+                previous_header = self.blockchain.get_headers(fork_height, 1)
+                if not previous_header:
+                    return
+                previous_hash = previous_header[0]['hash']
+                history = self.blockchain.retarget_history(fork_height + 1)
+
+            if not self._valid_headers(headers, previous_hash, fork_height, history[-(RETARGET_WINDOW + 1):]):
+                headers_received.labels('invalid').inc(len(headers))
+                return
+            headers_received.labels('valid').inc(len(headers))
+
+            if continuing:
+                self.headers.extend(headers)
+            else:
+                # only worth following if it carries more work than our chain and than what we follow now
+                work = self._branch_work(fork_height, headers)
+                if work is None or work <= self._tip_work():
+                    return
+                if self.headers and work <= self._branch_work(self.fork_height, self.headers):
+                    return
+                self._reset()
+                self.fork_height = fork_height
+                self.headers = list(headers)
+                self.header_peer = peer
+                self.batch_origin = self.next_batch = fork_height + 1
+
+            more_headers = len(headers) == MAX_HEADERS
+            self._schedule()
+
+        if more_headers:
+            self.request_headers(peer, [self.headers[-1]['hash']])
+
+    def _branch_work(self, fork_height, headers):
+        # cumulative work of our chain up to fork_height followed by headers
+        if fork_height >= len(self.blockchain.chain):
+            return None
+        return self.blockchain.chain_work_at(fork_height) + \
+            sum(work_of(target_from_hex(header['target'])) for header in headers)
+
+    def _tip_work(self):
+        return self.blockchain.chain_work_at(len(self.blockchain.chain) - 1)
+
+    def _schedule(self):
+        # handing out batches of missing bodies round-robin, a few per peer at a time
+        now = time.time()
+        for batch_start, (peer, sent_at) in list(self.in_flight.items()):
+            if now - sent_at > REQUEST_TIMEOUT or peer not in self.node.peers:
+                del self.in_flight[batch_start]
+                self.next_batch = min(self.next_batch, batch_start)
+
+        peers = [p for p in self.node.peers if p.running]
+        if not peers:
+            return
+        # a fresh node first hears whether a snapshot will stand in for the early blocks
+        skip_height = self.node.snapshot_sync.skip_height()
+        if skip_height is None:
+            return
+
+        load = dict((p, 0) for p in peers)
+        for peer, _ in self.in_flight.values():
+            if peer in load:
+                load[peer] += 1
+
+        batch_start = self.next_batch
+        while batch_start <= self.headers[-1]['index']:
+            batch = self._batch(batch_start)
+            missing = [h['hash'] for h in batch if h['hash'] not in self.bodies and h['index'] > skip_height]
+            if missing and batch_start not in self.in_flight:
+                peer = min(peers, key=lambda p: load[p])
+                if load[peer] >= MAX_IN_FLIGHT_PER_PEER:
+                    break
+                load[peer] += 1
+                self.in_flight[batch_start] = (peer, now)
+                peer.send(Message(GET_BLOCKS, {'hashes': missing}, self.node.node_id))
+            batch_start += BLOCK_BATCH_SIZE
+        self.next_batch = batch_start
+
+    def _batch(self, batch_start):
+        # the headers of a batch not applied yet, a batch may have been applied partly
+        offset = batch_start - self.headers[0]['index']
+        return self.headers[max(0, offset):max(0, offset + BLOCK_BATCH_SIZE)]
+
+    def handle_get_blocks(self, message, peer):
+        blocks = []
+        for block_hash in message.data.get('hashes', [])[:BLOCK_BATCH_SIZE * 4]:
+            height = self.blockchain.height_of(block_hash)
+            if height is not None:
+                block = self.blockchain.chain[height]
+                # blocks below our base snapshot are headers only and cannot be served
+                if block.has_body():
+                    blocks.append(block)
+        peer.send(Message(BLOCKS, blocks, self.node.node_id))
+
+    def handle_blocks(self, message, peer):
+        with self.lock:
+            if not self.headers:
+                return
+            wanted = dict((h['hash'], i) for i, h in enumerate(self.headers))
+
+            for block_data in message.data:
+                position = wanted.get(block_data.get('hash'))
+                if position is None:
+                    continue
+                block = Block.from_dict(block_data)
+                # the body must match the header we already checked
+                if block.calculate_block_hash() != self.headers[position]['hash']:
+                    continue
+                self.bodies[block.hash] = block
+
+            # answered batches are free again, unfilled ones go to the next peer
+            for batch_start, (in_flight_peer, _) in list(self.in_flight.items()):
+                if in_flight_peer is peer:
+                    del self.in_flight[batch_start]
+                    batch = self._batch(batch_start)
+                    if any(h['hash'] not in self.bodies for h in batch):
+                        self.next_batch = min(self.next_batch, batch_start)
+
+            self._apply()
+            if self.headers:
+                self._schedule()
+
+    def _apply(self):
+        tip_height = len(self.blockchain.chain) - 1
+
+        if self.fork_height == tip_height:
+            if not self._bootstrap():
+                return
+            # extending our own tip, blocks can go in as soon as they arrive in order
+            applied = 0
+            for header in self.headers:
+                block = self.bodies.get(header['hash'])
+                if block is None or not self.blockchain.add_block(block):
+                    break
+                applied += 1
+            if applied:
+                self._drop_applied(applied)
+            return
+
+        # on a fork we only switch once every body of the heavier branch is here
+        if any(h['hash'] not in self.bodies for h in self.headers):
+            return
+        work = self._branch_work(self.fork_height, self.headers)
+        if work is None or work <= self._tip_work():
+            self._reset()
+            return
+
+        branch = [self.bodies[h['hash']] for h in self.headers]
+        if self.blockchain.try_switch_branch(self.fork_height, branch):
+            branch_switches.inc()
+        self._reset()
+
+    def _bootstrap(self):
+        # the headers up to a snapshot's height go in without bodies once the snapshot is here,
+        # returns False while waiting for the snapshot or its headers
+        skip_height = self.node.snapshot_sync.skip_height()
+        if skip_height is None:
+            return False
+        if not skip_height or self.headers[0]['index'] > skip_height:
+            return True
+        snapshot = self.node.snapshot_sync.ready_snapshot()
+        if snapshot is None:
+            return False
+        position = skip_height - self.headers[0]['index']
+        if position >= len(self.headers):
+            return False
+
+        # the snapshot has to be of a block on the header chain we checked
+        if self.headers[position]['hash'] == snapshot['hash'] and \
+                self.blockchain.bootstrap(snapshot, self.headers[:position + 1]):
+            self.node.snapshot_sync.finish()
+            self._drop_applied(position + 1)
+            return bool(self.headers)
+
+        self.node.snapshot_sync.reject()
+        self.next_batch = self.batch_origin
+        return False
+
+    def resume(self):
+        # called once the snapshot is decided on or downloaded, which may unblock bodies and the bootstrap
+        with self.lock:
+            if self.headers:
+                self._apply()
+            if self.headers:
+                # batches passed over for a snapshot that fell through are needed after all
+                self.next_batch = self.batch_origin
+                self._schedule()
+
+    def _drop_applied(self, applied):
+        for header in self.headers[:applied]:
+            self.bodies.pop(header['hash'], None)
+        self.headers = self.headers[applied:]
+        self.fork_height += applied
+        # a partly applied batch stays in flight until its reply comes in
+        self.in_flight = dict(
+            (start, request) for start, request in self.in_flight.items()
+            if start + BLOCK_BATCH_SIZE - 1 > self.fork_height
+        )
+        if not self.headers:
+            self._reset()
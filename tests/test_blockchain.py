@@ -0,0 +1,168 @@
+import contextlib
+import io
+import shutil
+import tempfile
+import threading
+import unittest
+
+from blockchain.block import Block
+from blockchain.block_store import BlockStore
+from blockchain.blockchain import Blockchain
+from blockchain.snapshot import SnapshotStore
+from blockchain.transaction import Transaction
+from blockchain.validation import check_block
+from blockchain.wallet import Wallet
+from mining.difficulty import target_for_leading_zeros
+from mining.proof_of_work import ProofOfWork
+
+
+def easy_chain():
+    blockchain = Blockchain()
+    blockchain.initial_target = target_for_leading_zeros(1)
+    return blockchain
+
+
+def signed_vote(wallet, data):
+    transaction = Transaction(wallet.public_key, "ELECTION", data)
+    transaction.sign_transaction(wallet)
+    return transaction
+
+
+def mine(blockchain):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return blockchain.mine_pending_transactions("miner")
+
+
+def mined_block(blockchain, transactions):
+    # a block on our tip carrying exactly these transactions
+    block = Block(len(blockchain.chain), blockchain.get_latest_block().hash, transactions,
+                  target=blockchain.next_target())
+    with contextlib.redirect_stdout(io.StringIO()):
+        return ProofOfWork(block).mine()
+
+
+class StalledVerifier:
+    # holds on to submissions so a test decides when the verdict arrives
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, transaction, callback, block=True, timeout=None):
+        self.submitted.append((transaction, callback))
+        return True
+
+
+class VoteTest(unittest.TestCase):
+    def setUp(self):
+        self.blockchain = easy_chain()
+        self.wallets = [Wallet() for _ in range(3)]
+        for wallet in self.wallets:
+            self.blockchain.register_voter(wallet.public_key)
+
+    def test_votes_are_counted_across_blocks(self):
+        self.assertTrue(self.blockchain.add_transaction(signed_vote(self.wallets[0], {"vote": "alice"})))
+        mine(self.blockchain)
+        self.assertTrue(self.blockchain.add_transaction(signed_vote(self.wallets[1], {"vote": "bob"})))
+        mine(self.blockchain)
+        self.assertEqual(self.blockchain.get_vote_counts(), {"alice": 1, "bob": 1})
+
+    def test_second_vote_is_rejected(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(self.blockchain.add_transaction(signed_vote(self.wallets[0], {"vote": "alice"})))
+            self.assertFalse(self.blockchain.add_transaction(signed_vote(self.wallets[0], {"vote": "bob"})))
+
+    def test_unregistered_voter_is_rejected(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertFalse(self.blockchain.add_transaction(signed_vote(Wallet(), {"vote": "alice"})))
+
+    def test_malformed_votes_are_rejected(self):
+        malformed = [{"vote": ["alice"]}, {"vote": ""}, {"vote": "alice", "extra": 1}, {"candidate": "alice"}]
+        with contextlib.redirect_stdout(io.StringIO()):
+            for data in malformed:
+                self.assertFalse(self.blockchain.add_transaction(signed_vote(self.wallets[0], data)))
+        self.assertEqual(len(self.blockchain.mempool), 0)
+
+    def test_block_with_malformed_vote_is_invalid(self):
+        block = mined_block(self.blockchain, [signed_vote(self.wallets[0], {"vote": ["alice"]})])
+        self.assertFalse(check_block(block))
+        self.assertFalse(self.blockchain.add_block(block))
+        self.assertEqual(len(self.blockchain.chain), 1)
+        self.assertEqual(self.blockchain.get_vote_counts(), {})
+
+    def test_reward_addressed_to_the_election_is_invalid(self):
+        reward = Transaction("BLOCKCHAIN_REWARD", "ELECTION", {"vote": "alice"})
+        self.assertFalse(check_block(mined_block(self.blockchain, [reward])))
+
+    def test_valid_block_from_a_peer_is_added(self):
+        block = mined_block(self.blockchain, [signed_vote(self.wallets[2], {"vote": "carol"})])
+        self.assertTrue(check_block(block))
+        self.assertTrue(self.blockchain.add_block(block))
+        self.assertEqual(self.blockchain.get_vote_counts(), {"carol": 1})
+        self.assertIn(self.wallets[2].public_key, self.blockchain.votes_cast)
+
+    def test_vote_reported_as_timed_out_is_not_admitted_later(self):
+        self.blockchain.verifier = StalledVerifier()
+        transaction = signed_vote(self.wallets[0], {"vote": "alice"})
+        self.assertFalse(self.blockchain.add_transaction(transaction, timeout=0.01))
+
+        # the verdict arrives after the caller gave up
+        with contextlib.redirect_stdout(io.StringIO()):
+            for submitted, callback in self.blockchain.verifier.submitted:
+                callback(submitted, True)
+        self.assertEqual(len(self.blockchain.mempool), 0)
+        self.assertNotIn(self.wallets[0].public_key, self.blockchain.votes_cast)
+
+
+class MainThreadReads(BlockStore):
+    # remembers which block bodies were read on the calling thread
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.heights_read = []
+
+    def read_block(self, height):
+        if threading.current_thread() is threading.main_thread():
+            self.heights_read.append(height)
+        return super().read_block(height)
+
+
+class RestartTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def open_chain(self, store_class=BlockStore):
+        blockchain = Blockchain(store=store_class(self.directory),
+                                snapshots=SnapshotStore(self.directory + '/snapshots'))
+        blockchain.initial_target = target_for_leading_zeros(1)
+        self.addCleanup(blockchain.store.close)
+        return blockchain
+
+    def test_restart_resumes_from_our_own_snapshot(self):
+        blockchain = self.open_chain()
+        wallets = [Wallet() for _ in range(4)]
+        txids = []
+        for wallet in wallets:
+            blockchain.register_voter(wallet.public_key)
+            transaction = signed_vote(wallet, {"vote": "alice"})
+            self.assertTrue(blockchain.add_transaction(transaction))
+            txids.append(transaction.calculate_txid())
+            mine(blockchain)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertIsNotNone(blockchain.take_snapshot(3))
+        blockchain.store.close()
+
+        restarted = self.open_chain(MainThreadReads)
+        restarted.voter_registry = blockchain.voter_registry
+        self.assertEqual(restarted.get_vote_counts(), {"alice": 4})
+        for wallet in wallets:
+            self.assertIn(wallet.public_key, restarted.votes_cast)
+        # only the block above the snapshot was replayed
+        self.assertEqual(restarted.store.heights_read, [4])
+
+        # the transactions under the snapshot are indexed in the background
+        restarted.history_indexer.join()
+        for height, txid in enumerate(txids, 1):
+            self.assertEqual(restarted.get_transaction_location(txid)[0], height)
+
+
+if __name__ == '__main__':
+    unittest.main()
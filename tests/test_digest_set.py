@@ -0,0 +1,69 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from blockchain.digest_set import DigestSet
+
+
+def digest(i):
+    return hashlib.sha256(str(i).encode()).digest()
+
+
+class DigestSetTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'set.bin')
+
+    def open_set(self, **kwargs):
+        digest_set = DigestSet(self.path, **kwargs)
+        self.addCleanup(digest_set.close)
+        return digest_set
+
+    def test_add_discard_and_membership(self):
+        for digest_set in (DigestSet(merge_threshold=2), self.open_set(merge_threshold=2)):
+            self.assertTrue(digest_set.add(digest(1)))
+            self.assertFalse(digest_set.add(digest(1)))
+            for i in range(2, 6):
+                digest_set.add(digest(i))
+            digest_set.discard(digest(3))
+            digest_set.discard(digest(99))
+            self.assertEqual(len(digest_set), 4)
+            self.assertNotIn(digest(3), digest_set)
+            self.assertEqual(list(digest_set.digests()), sorted(digest(i) for i in (1, 2, 4, 5)))
+
+    def test_key_turns_values_into_digests(self):
+        digest_set = DigestSet(key=lambda value: hashlib.sha256(value.encode()).digest())
+        digest_set.add("voter")
+        self.assertIn("voter", digest_set)
+        self.assertIn(hashlib.sha256(b"voter").digest(), digest_set)
+
+    def test_update_merges_runs_and_counts_new_digests(self):
+        digest_set = DigestSet()
+        digest_set.add(digest(0))
+        added = digest_set.update((digest(i) for i in range(10)), chunk_size=3)
+        self.assertEqual(added, 9)
+        self.assertEqual(list(digest_set.digests()), sorted(digest(i) for i in range(10)))
+
+    def test_update_brings_back_a_discarded_digest(self):
+        digest_set = DigestSet()
+        digest_set.update([digest(1), digest(2)])
+        digest_set.discard(digest(1))
+        self.assertEqual(digest_set.update([digest(1)]), 1)
+        self.assertIn(digest(1), digest_set)
+
+    def test_reopening_replays_the_log(self):
+        digest_set = self.open_set()
+        digest_set.update(digest(i) for i in range(5))
+        digest_set.add(digest(10))
+        digest_set.discard(digest(2))
+        digest_set.close()
+
+        reopened = self.open_set()
+        self.assertEqual(list(reopened.digests()), sorted(digest(i) for i in (0, 1, 3, 4, 10)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import contextlib
+import io
+import threading
+import unittest
+
+from blockchain.block import Block
+from blockchain.block_pipeline import EXTENDED, REORGANIZED, SIDE, ORPHAN, DUPLICATE, INVALID
+from blockchain.wallet import Wallet
+from mining.difficulty import EASIEST_TARGET, next_target
+from mining.proof_of_work import ProofOfWork
+from tests.test_blockchain import easy_chain, signed_vote
+
+
+def branch_block(blockchain, branch, transactions=(), target=None):
+    # mining a block on top of branch, the headers from genesis up to its parent
+    parent = branch[-1]
+    if target is None:
+        target = next_target(branch[1:], blockchain.block_interval, blockchain.initial_target)
+    block = Block(parent['index'] + 1, parent['hash'], list(transactions), target=target)
+    with contextlib.redirect_stdout(io.StringIO()):
+        block = ProofOfWork(block).mine()
+    branch.append(block.header())
+    return block
+
+
+class RecordingMiner:
+    def __init__(self):
+        self.aborted = False
+
+    def abort(self):
+        self.aborted = True
+
+
+class ForkChoiceTest(unittest.TestCase):
+    def setUp(self):
+        self.blockchain = easy_chain()
+        self.genesis = self.blockchain.get_header(0)
+        self.wallets = [Wallet() for _ in range(2)]
+        for wallet in self.wallets:
+            self.blockchain.register_voter(wallet.public_key)
+
+    def test_block_on_the_tip_extends_the_chain_once(self):
+        block = branch_block(self.blockchain, [self.genesis])
+        self.assertEqual(self.blockchain.connect_block(block), EXTENDED)
+        self.assertEqual(self.blockchain.connect_block(block), DUPLICATE)
+        self.assertEqual(len(self.blockchain.chain), 2)
+
+    def test_block_without_a_known_parent_is_an_orphan(self):
+        branch = [self.genesis]
+        branch_block(self.blockchain, branch)
+        child = branch_block(self.blockchain, branch)
+        self.assertEqual(self.blockchain.connect_block(child), ORPHAN)
+        self.assertEqual(len(self.blockchain.chain), 1)
+
+    def test_block_with_the_wrong_target_is_invalid(self):
+        block = branch_block(self.blockchain, [self.genesis], target=EASIEST_TARGET)
+        self.assertEqual(self.blockchain.connect_block(block), INVALID)
+
+    def test_heavier_branch_takes_over_and_moves_the_votes(self):
+        ours = [self.genesis]
+        for transactions in ([signed_vote(self.wallets[0], {"vote": "alice"})], []):
+            self.assertEqual(self.blockchain.connect_block(branch_block(self.blockchain, ours, transactions)), EXTENDED)
+
+        theirs = [self.genesis]
+        first = branch_block(self.blockchain, theirs, [signed_vote(self.wallets[1], {"vote": "bob"})])
+        self.assertEqual(self.blockchain.connect_block(first), SIDE)
+        # equal work keeps the branch seen first
+        self.assertEqual(self.blockchain.connect_block(branch_block(self.blockchain, theirs)), SIDE)
+        self.assertEqual(self.blockchain.get_latest_block().hash, ours[-1]['hash'])
+
+        self.blockchain.current_miner = RecordingMiner()
+        self.assertEqual(self.blockchain.connect_block(branch_block(self.blockchain, theirs)), REORGANIZED)
+        self.assertTrue(self.blockchain.current_miner.aborted)
+        self.assertEqual([block.hash for block in self.blockchain.chain], [h['hash'] for h in theirs])
+
+        # the vote that left the chain is pending again, the one that joined it is counted
+        self.assertEqual(self.blockchain.get_vote_counts(), {"bob": 1})
+        self.assertEqual([tx.sender for tx in self.blockchain.pending_transactions], [self.wallets[0].public_key])
+        self.assertIsNone(self.blockchain.get_transaction_location(
+            signed_vote(self.wallets[0], {"vote": "alice"}).calculate_txid()))
+        for wallet in self.wallets:
+            self.assertIn(wallet.public_key, self.blockchain.votes_cast)
+
+
+class PipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.blockchain = easy_chain()
+        self.addCleanup(self.blockchain.block_pipeline.stop)
+        self.blockchain.current_miner = RecordingMiner()
+
+    def submit(self, block):
+        placed = threading.Event()
+        statuses = []
+
+        def on_placed(_, status):
+            statuses.append(status)
+            placed.set()
+
+        self.assertTrue(self.blockchain.submit_block(block.to_dict(), on_placed))
+        self.assertTrue(placed.wait(10))
+        return statuses[0]
+
+    def test_block_with_an_easy_self_declared_target_does_not_stop_mining(self):
+        block = branch_block(self.blockchain, [self.blockchain.get_header(0)], target=EASIEST_TARGET)
+        self.assertEqual(self.submit(block), INVALID)
+        self.assertFalse(self.blockchain.current_miner.aborted)
+
+    def test_new_tip_stops_mining(self):
+        block = branch_block(self.blockchain, [self.blockchain.get_header(0)])
+        self.assertEqual(self.submit(block), EXTENDED)
+        self.assertTrue(self.blockchain.current_miner.aborted)
+
+
+if __name__ == '__main__':
+    unittest.main()
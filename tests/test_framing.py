@@ -0,0 +1,72 @@
+import unittest
+
+from network.framing import (
+    FrameReader, FrameError, FRAME_HEADER, PROTOCOL_VERSION, WIRE_BINARY, WIRE_JSON,
+    decode_payload, encode_message
+)
+from network.message import Message, HEADERS
+
+
+def read_all(reader, data, step):
+    # feeding data a few bytes at a time, the way a socket may hand it over
+    messages = []
+    for offset in range(0, len(data), step):
+        reader.feed(data[offset:offset + step])
+        messages.extend(reader.messages())
+    return messages
+
+
+class FrameReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.messages = [
+            Message('NEW_TRANSACTION', {'sender': 'a', 'data': {'vote': 'alice'}}, 'node'),
+            Message(HEADERS, {'headers': [], 'fork_height': 3}, 'node'),
+            Message('UNKNOWN_TYPE', {'x': 1}, 'node'),
+        ]
+
+    def test_binary_frames_split_at_every_size(self):
+        data = b''.join(encode_message(message) for message in self.messages)
+        for step in (1, 3, 7, len(data)):
+            reader = FrameReader(initial_size=16)
+            received = read_all(reader, data, step)
+            self.assertEqual(reader.wire_format, WIRE_BINARY)
+            self.assertEqual([msg_type for msg_type, _ in received], ['NEW_TRANSACTION', HEADERS, None])
+            for message, (_, payload) in zip(self.messages, received):
+                decoded = decode_payload(payload)
+                self.assertEqual((decoded.msg_type, decoded.data), (message.msg_type, message.data))
+
+    def test_json_lines_are_detected_and_split(self):
+        data = b''.join(encode_message(message, WIRE_JSON) for message in self.messages)
+        for step in (1, 5, len(data)):
+            reader = FrameReader(initial_size=16)
+            received = read_all(reader, data, step)
+            self.assertEqual(reader.wire_format, WIRE_JSON)
+            self.assertEqual([decode_payload(payload).msg_type for _, payload in received],
+                             [message.msg_type for message in self.messages])
+
+    def test_buffer_shrinks_after_a_large_frame(self):
+        reader = FrameReader(initial_size=64)
+        big = Message('NEW_BLOCK', {'padding': 'x' * 10000}, 'node')
+        self.assertEqual(len(read_all(reader, encode_message(big), 4096)), 1)
+        self.assertEqual(len(reader.buffer), 64)
+
+    def test_oversized_frame_is_refused(self):
+        reader = FrameReader(max_frame_size=1024)
+        reader.feed(FRAME_HEADER.pack(2048, PROTOCOL_VERSION, 3))
+        with self.assertRaises(FrameError):
+            list(reader.messages())
+
+    def test_oversized_json_line_is_refused(self):
+        reader = FrameReader(initial_size=16, max_frame_size=64)
+        with self.assertRaises(FrameError):
+            read_all(reader, b'{' + b'x' * 100, 10)
+
+    def test_unknown_protocol_version_is_refused(self):
+        reader = FrameReader()
+        reader.feed(FRAME_HEADER.pack(2, PROTOCOL_VERSION + 1, 3) + b'{}')
+        with self.assertRaises(FrameError):
+            list(reader.messages())
+
+
+if __name__ == '__main__':
+    unittest.main()
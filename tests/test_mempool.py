@@ -0,0 +1,69 @@
+import unittest
+
+from blockchain.block import Block
+from blockchain.mempool import Mempool
+from blockchain.transaction import Transaction
+
+
+def vote(sender, candidate="alice"):
+    return Transaction(sender, "ELECTION", {"vote": candidate})
+
+
+class MempoolTest(unittest.TestCase):
+    def test_duplicates_are_refused(self):
+        mempool = Mempool()
+        transaction = vote("a")
+        self.assertTrue(mempool.add(transaction))
+        self.assertFalse(mempool.add(transaction))
+        self.assertEqual(len(mempool), 1)
+        self.assertIn(transaction.calculate_txid(), mempool)
+
+    def test_count_and_byte_limits(self):
+        mempool = Mempool(max_count=2)
+        self.assertTrue(mempool.add(vote("a")))
+        self.assertTrue(mempool.add(vote("b")))
+        self.assertFalse(mempool.add(vote("c")))
+
+        size = Mempool.transaction_size(vote("a"))
+        mempool = Mempool(max_bytes=size + 1)
+        self.assertTrue(mempool.add(vote("a")))
+        self.assertFalse(mempool.add(vote("b")))
+        self.assertEqual(mempool.total_bytes, size)
+
+    def test_expired_entries_are_handed_to_on_evict(self):
+        evicted = []
+        mempool = Mempool(max_age=0, on_evict=evicted.append)
+        transaction = vote("a")
+        mempool.add(transaction)
+        self.assertEqual(mempool.expire(), [transaction])
+        self.assertEqual(evicted, [transaction])
+        self.assertEqual(len(mempool), 0)
+        self.assertEqual(mempool.total_bytes, 0)
+        self.assertFalse(mempool.has_sender("a"))
+
+    def test_block_removes_its_transactions_and_their_senders(self):
+        mempool = Mempool()
+        included, other_from_same_voter, unrelated = vote("a"), vote("a", "bob"), vote("b")
+        for transaction in (included, other_from_same_voter, unrelated):
+            mempool.add(transaction)
+        mempool.remove_block(Block(1, "0" * 64, [included]))
+        self.assertEqual(mempool.transactions(), [unrelated])
+        self.assertEqual(mempool.senders(), {"b"})
+
+    def test_selection_is_oldest_first_within_the_limits(self):
+        mempool = Mempool()
+        transactions = [vote(sender) for sender in "abcd"]
+        for transaction in transactions:
+            mempool.add(transaction)
+        self.assertEqual(mempool.select_for_block(2, 1024 * 1024), transactions[:2])
+
+        # an entry that does not fit is skipped, smaller ones after it still go in
+        mempool.add(Transaction("e", "ELECTION", {"vote": "x" * 500}))
+        mempool.add(vote("f"))
+        size = Mempool.transaction_size(vote("a"))
+        selected = mempool.select_for_block(10, 5 * size)
+        self.assertEqual([transaction.sender for transaction in selected], list("abcdf"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import contextlib
+import hashlib
+import io
+import unittest
+
+from blockchain.blockchain import Blockchain
+from blockchain.merkle import MerkleTree, EMPTY_ROOT, verify_merkle_proof
+from blockchain.transaction import Transaction
+from blockchain.wallet import Wallet
+from mining.difficulty import target_for_leading_zeros
+
+
+def leaf(i):
+    return hashlib.sha256(str(i).encode()).hexdigest()
+
+
+class MerkleTreeTest(unittest.TestCase):
+    def test_empty_tree_has_empty_root(self):
+        self.assertEqual(MerkleTree([]).root, EMPTY_ROOT)
+
+    def test_single_leaf_is_its_own_root(self):
+        self.assertEqual(MerkleTree([leaf(0)]).root, leaf(0))
+        self.assertEqual(MerkleTree([leaf(0)]).get_proof(0), [])
+
+    def test_every_leaf_proves_against_the_root(self):
+        # odd and even sizes, the odd ones duplicate their last node
+        for size in (2, 3, 5, 8, 13):
+            leaves = [leaf(i) for i in range(size)]
+            tree = MerkleTree(leaves)
+            for i, leaf_hash in enumerate(leaves):
+                self.assertTrue(verify_merkle_proof(leaf_hash, tree.get_proof(i), tree.root))
+
+    def test_proof_fails_for_another_leaf_or_root(self):
+        leaves = [leaf(i) for i in range(6)]
+        tree = MerkleTree(leaves)
+        proof = tree.get_proof(2)
+        self.assertFalse(verify_merkle_proof(leaves[3], proof, tree.root))
+        self.assertFalse(verify_merkle_proof(leaves[2], proof, MerkleTree(leaves[:5]).root))
+
+    def test_proof_fails_when_a_step_is_tampered(self):
+        tree = MerkleTree([leaf(i) for i in range(4)])
+        proof = tree.get_proof(1)
+        proof[0] = dict(proof[0], hash=leaf(99))
+        self.assertFalse(verify_merkle_proof(leaf(1), proof, tree.root))
+
+    def test_index_out_of_range(self):
+        with self.assertRaises(IndexError):
+            MerkleTree([leaf(0)]).get_proof(1)
+
+
+class TransactionProofTest(unittest.TestCase):
+    def test_mined_vote_proves_against_its_block_header(self):
+        blockchain = Blockchain()
+        blockchain.initial_target = target_for_leading_zeros(1)
+        wallets = [Wallet() for _ in range(3)]
+        txids = []
+        for wallet in wallets:
+            blockchain.register_voter(wallet.public_key)
+            transaction = Transaction(wallet.public_key, "ELECTION", {"vote": "Candidate A"})
+            transaction.sign_transaction(wallet)
+            self.assertTrue(blockchain.add_transaction(transaction))
+            txids.append(transaction.calculate_txid())
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertIsNotNone(blockchain.mine_pending_transactions("miner"))
+
+        for txid in txids:
+            proof = blockchain.get_transaction_proof(txid)
+            self.assertEqual(proof['block']['index'], 1)
+            self.assertTrue(verify_merkle_proof(txid, proof['proof'], proof['block']['merkle_root']))
+
+        self.assertIsNone(blockchain.get_transaction_proof('0' * 64))
+
+
+if __name__ == '__main__':
+    unittest.main()
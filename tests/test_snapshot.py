@@ -0,0 +1,149 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from blockchain.block_store import BlockStore
+from blockchain.blockchain import Blockchain
+from blockchain.snapshot import Snapshot, SnapshotReplay, SnapshotStore
+from blockchain.voter_registry import voter_digest
+from blockchain.wallet import Wallet
+from mining.difficulty import target_for_leading_zeros
+from tests.test_blockchain import mine, signed_vote
+
+CANDIDATES = ["alice", "bob", "alice", "bob"]
+
+
+class SnapshotTestCase(unittest.TestCase):
+    # a source chain with one vote per block and a snapshot of it at height 3
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.source = Blockchain(snapshots=SnapshotStore(os.path.join(self.directory, 'source')))
+        self.source.initial_target = target_for_leading_zeros(1)
+        self.wallets = [Wallet() for _ in range(5)]
+        for wallet in self.wallets:
+            self.source.register_voter(wallet.public_key)
+        for wallet, candidate in zip(self.wallets, CANDIDATES):
+            self.assertTrue(self.source.add_transaction(signed_vote(wallet, {"vote": candidate})))
+            mine(self.source)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.info = self.source.take_snapshot(3)
+
+    def open_fresh(self):
+        path = os.path.join(self.directory, 'fresh')
+        blockchain = Blockchain(store=BlockStore(path), snapshots=SnapshotStore(os.path.join(path, 'snapshots')))
+        blockchain.initial_target = target_for_leading_zeros(1)
+        self.addCleanup(blockchain.store.close)
+        return blockchain
+
+    def download(self, blockchain, info):
+        # what snapshot sync does with a finished download
+        incoming = blockchain.snapshots.incoming_path(info['digest'])
+        shutil.copyfile(info['path'], incoming)
+        return blockchain.snapshots.add_file(incoming, info['digest'])
+
+
+class SnapshotFileTest(SnapshotTestCase):
+    def test_snapshot_holds_the_state_at_its_height(self):
+        snapshot = Snapshot(self.info['path'])
+        self.assertEqual((snapshot.height, snapshot.block_hash), (3, self.source.get_header(3)['hash']))
+        self.assertEqual(snapshot.vote_counts, {"alice": 2, "bob": 1})
+        self.assertEqual(list(snapshot.voted_digests()),
+                         sorted(voter_digest(wallet.public_key) for wallet in self.wallets[:3]))
+        self.assertEqual(list(snapshot.registered_digests()), list(self.source.voter_registry.digests()))
+
+    def test_truncated_file_is_refused(self):
+        path = os.path.join(self.directory, 'truncated.snap')
+        with open(self.info['path'], 'rb') as f, open(path, 'wb') as out:
+            out.write(f.read()[:-1])
+        with self.assertRaises(ValueError):
+            Snapshot(path)
+
+    def test_downloads_are_kept_apart_from_our_own(self):
+        fresh = self.open_fresh()
+        with self.assertRaises(ValueError):
+            incoming = fresh.snapshots.incoming_path('0' * 64)
+            shutil.copyfile(self.info['path'], incoming)
+            fresh.snapshots.add_file(incoming, '0' * 64)
+
+        downloaded = self.download(fresh, self.info)
+        self.assertFalse(downloaded['local'])
+        self.assertEqual(fresh.snapshots.local(), [])
+        self.assertEqual([info['digest'] for info in self.source.snapshots.local()], [self.info['digest']])
+
+        reopened = SnapshotStore(os.path.join(self.directory, 'fresh', 'snapshots'))
+        self.assertEqual(reopened.latest()['digest'], self.info['digest'])
+        self.assertEqual(reopened.local(), [])
+
+
+class BootstrapTest(SnapshotTestCase):
+    def bootstrap(self):
+        fresh = self.open_fresh()
+        info = self.download(fresh, self.info)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(fresh.bootstrap(info, self.source.get_headers(1, 3)))
+        return fresh
+
+    def test_fresh_node_starts_from_the_snapshot(self):
+        fresh = self.bootstrap()
+        self.assertEqual((len(fresh.chain), fresh.base_height), (4, 3))
+        self.assertFalse(fresh.chain[2].has_body())
+        self.assertEqual(fresh.get_vote_counts(), {"alice": 2, "bob": 1})
+
+        # voters known only from the snapshot are registered, and those who voted cannot again
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertFalse(fresh.add_transaction(signed_vote(self.wallets[0], {"vote": "bob"})))
+            self.assertTrue(fresh.add_transaction(signed_vote(self.wallets[4], {"vote": "bob"})))
+
+        # the blocks above the snapshot go on top as usual
+        self.assertTrue(fresh.add_block(self.source.chain[4]))
+        self.assertEqual(fresh.get_vote_counts(), {"alice": 2, "bob": 2})
+
+    def test_headers_must_end_at_the_snapshot(self):
+        fresh = self.open_fresh()
+        info = self.download(fresh, self.info)
+        self.assertFalse(fresh.bootstrap(info, self.source.get_headers(1, 2)))
+        self.assertFalse(fresh.bootstrap(info, self.source.get_headers(2, 2)))
+        self.assertEqual((len(fresh.chain), fresh.base_height), (1, 0))
+
+    def test_restart_keeps_the_base(self):
+        fresh = self.bootstrap()
+        fresh.store.close()
+
+        restarted = self.open_fresh()
+        self.assertEqual(restarted.base_height, 3)
+        self.assertEqual(restarted.get_vote_counts(), {"alice": 2, "bob": 1})
+        self.assertTrue(restarted.voter_registry.is_registered(self.wallets[4].public_key))
+        self.assertIn(self.wallets[0].public_key, restarted.votes_cast)
+
+
+class ReplayTest(SnapshotTestCase):
+    def replay(self, blocks):
+        replay = SnapshotReplay(3)
+        for block in blocks:
+            if not replay.add(block):
+                break
+        return replay
+
+    def test_recount_matches_an_honest_snapshot(self):
+        replay = self.replay(self.source.chain[1:4])
+        self.assertTrue(replay.done())
+        self.assertTrue(replay.matches(Snapshot(self.info['path'])))
+
+    def test_recount_exposes_a_forged_snapshot(self):
+        snapshot = Snapshot(self.info['path'])
+        forged = self.source.snapshots.write(3, snapshot.block_hash, {"alice": 3},
+                                             list(snapshot.voted_digests()), list(snapshot.registered_digests()))
+        self.assertFalse(self.replay(self.source.chain[1:4]).matches(Snapshot(forged['path'])))
+
+    def test_repeated_vote_stops_the_recount(self):
+        replay = self.replay([self.source.chain[1], self.source.chain[1]])
+        self.assertFalse(replay.done())
+        self.assertIn("repeats a vote", replay.error)
+
+
+if __name__ == '__main__':
+    unittest.main()
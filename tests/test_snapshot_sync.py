@@ -0,0 +1,29 @@
+import unittest
+
+from network.address_book import netgroup
+from network.snapshot_sync import _distinct_networks
+
+
+class StubPeer:
+    def __init__(self, host, port=9000, node_id=None):
+        self.address = (host, port)
+        self.node_id = node_id
+
+
+class SnapshotQuorumTest(unittest.TestCase):
+    def test_addresses_group_by_network(self):
+        self.assertEqual(netgroup('10.1.2.3'), netgroup('10.1.200.4'))
+        self.assertNotEqual(netgroup('10.1.2.3'), netgroup('10.2.2.3'))
+        self.assertEqual(netgroup('::ffff:10.1.2.3'), netgroup('10.1.9.9'))
+        self.assertEqual(netgroup('2001:db8:1::1'), netgroup('2001:db8:ffff::2'))
+        self.assertEqual(netgroup('seed.example'), 'seed.example')
+
+    def test_claimed_node_ids_do_not_count(self):
+        # two connections from one host claiming different node_ids are one offer
+        self.assertEqual(_distinct_networks([StubPeer('10.1.2.3', 1, 1), StubPeer('10.1.2.3', 2, 2)]), 1)
+        self.assertEqual(_distinct_networks([StubPeer('10.1.2.3'), StubPeer('10.1.7.7')]), 1)
+        self.assertEqual(_distinct_networks([StubPeer('10.1.2.3'), StubPeer('192.168.0.1')]), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
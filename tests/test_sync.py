@@ -0,0 +1,48 @@
+import contextlib
+import io
+import unittest
+
+from blockchain.block import Block
+from mining.proof_of_work import ProofOfWork
+from network.sync import ChainSync
+from tests.test_blockchain import easy_chain, mine
+
+
+class StubNode:
+    def __init__(self, blockchain):
+        self.blockchain = blockchain
+        self.node_id = "test"
+
+
+def header_at(index, previous_hash, target):
+    # a mined header claiming whatever height it is given
+    block = Block(index, previous_hash, [], target=target)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return ProofOfWork(block).mine().header()
+
+
+class HeaderCheckTest(unittest.TestCase):
+    def setUp(self):
+        self.blockchain = easy_chain()
+        for _ in range(3):
+            mine(self.blockchain)
+        self.sync = ChainSync(StubNode(self.blockchain))
+        self.genesis_hash = self.blockchain.chain[0].hash
+
+    def check(self, headers):
+        return self.sync._valid_headers(headers, self.genesis_hash, 0, self.blockchain.retarget_history(1))
+
+    def test_our_own_headers_are_valid(self):
+        self.assertTrue(self.check(self.blockchain.get_headers(1, 3)))
+
+    def test_header_at_the_wrong_height_is_rejected(self):
+        target = self.blockchain.next_target(1)
+        self.assertFalse(self.check([header_at(5, self.genesis_hash, target)]))
+
+    def test_header_that_does_not_link_is_rejected(self):
+        headers = self.blockchain.get_headers(1, 3)
+        self.assertFalse(self.check(headers[1:]))
+
+
+if __name__ == '__main__':
+    unittest.main()
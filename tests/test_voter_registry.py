@@ -0,0 +1,58 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from blockchain.voter_registry import VoterRegistry, read_voter_roll, voter_digest
+from blockchain.wallet import Wallet
+
+
+class VoterRollTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write_roll(self, lines):
+        path = os.path.join(self.directory, 'roll.txt')
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        return path
+
+    def test_pem_keys_and_hex_digests_are_read(self):
+        wallet = Wallet()
+        digest = voter_digest('other key')
+        path = self.write_roll([wallet.public_key.strip(), '', digest.hex()])
+        self.assertEqual(list(read_voter_roll(path)), [voter_digest(wallet.public_key), digest])
+
+    def test_malformed_hex_lines_are_skipped_and_reported(self):
+        digest = voter_digest('voter')
+        path = self.write_roll([digest.hex()[:-2], 'zz' * 32, digest.hex() + '00', digest.hex()])
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.assertEqual(list(read_voter_roll(path)), [digest])
+        for number in (1, 2, 3):
+            self.assertIn(f"line {number} ", output.getvalue())
+
+    def test_bulk_import_registers_the_roll(self):
+        wallets = [Wallet() for _ in range(3)]
+        path = self.write_roll([voter_digest(wallet.public_key).hex() for wallet in wallets])
+        registry = VoterRegistry(os.path.join(self.directory, 'voters.bin'))
+        self.addCleanup(registry.registered_voters.close)
+        self.assertEqual(registry.bulk_import(path), 3)
+        self.assertEqual(registry.bulk_import(path), 0)
+        for wallet in wallets:
+            self.assertTrue(registry.is_registered(wallet.public_key))
+        self.assertFalse(registry.is_registered(Wallet().public_key))
+
+    def test_snapshot_voters_count_once(self):
+        registry = VoterRegistry()
+        registry.register_voter('a')
+        registry.load_snapshot_voters([voter_digest('a'), voter_digest('b')])
+        self.assertTrue(registry.is_registered('b'))
+        self.assertEqual(len(registry), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,218 @@
+import bisect
+import threading
+import time
+
+# latency buckets in seconds, from sub-millisecond signature checks to multi-second audits
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        escaped.append(f'{name}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+class _CounterChild:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        return [('', (), self.value)]
+
+
+class _GaugeChild:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0.0
+        self.function = None
+
+    def set(self, value):
+        with self.lock:
+            self.value = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self.lock:
+            self.value -= amount
+
+    def set_function(self, function):
+        # reading the value only when scraped, for things that are already counted elsewhere
+        self.function = function
+
+    def samples(self):
+        if self.function is not None:
+            try:
+                return [('', (), self.function())]
+            except Exception:
+                return []
+        return [('', (), self.value)]
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+
+    def observe(self, value):
+        position = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[position] += 1
+            self.total += value
+
+    def time(self):
+        return _Timer(self)
+
+    def samples(self):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.total
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            samples.append(('_bucket', (('le', _format_value(bound)),), cumulative))
+        samples.append(('_sum', (), total))
+        samples.append(('_count', (), cumulative))
+        return samples
+
+
+class _Timer:
+    # with histogram.time(): ... observes how long the block took
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.child.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Metric:
+    # A named metric, optionally split into one child per combination of label values
+
+    def __init__(self, kind, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.children = {}
+        if not self.labelnames:
+            self.children[()] = self._new_child()
+
+    def _new_child(self):
+        if self.kind == 'counter':
+            return _CounterChild()
+        if self.kind == 'gauge':
+            return _GaugeChild()
+        return _HistogramChild(self.buckets)
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self._new_child())
+        return child
+
+    def remove(self, *values):
+        # dropping a label combination, e.g. once a peer disconnects
+        with self.lock:
+            self.children.pop(tuple(str(value) for value in values), None)
+
+    # shortcuts for metrics without labels
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_function(self, function):
+        self.labels().set_function(function)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            children = list(self.children.items())
+        for values, child in children:
+            for suffix, extra, value in child.samples():
+                labels = _format_labels(self.labelnames, values, extra)
+                lines.append(f'{self.name}{suffix}{labels} {_format_value(value)}')
+        return lines
+
+
+class MetricsRegistry:
+    # Process-wide set of metrics, rendered in the Prometheus text format
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _get_or_create(self, kind, name, documentation, labelnames, buckets=DEFAULT_BUCKETS):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = Metric(kind, name, documentation, labelnames, buckets)
+                self.metrics[name] = metric
+            elif metric.kind != kind or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} is already registered differently")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create('counter', name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create('gauge', name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create('histogram', name, documentation, labelnames, buckets)
+
+    def render(self):
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# shared by every component of the node
+registry = MetricsRegistry()
@@ -1,4 +1,12 @@
-from flask import Flask
+import time
+from flask import Flask, g, request
+from web.vote_queue import VoteQueue
+from blockchain.key_pool import KeyPool
+from blockchain.wallet import DEFAULT_SCHEME
+from utils.metrics import registry
+
+# request timings exported on /metrics
+request_seconds = registry.histogram('http_request_seconds', 'Time spent serving a web request', ['endpoint', 'status'])
 
 def create_app():
     app = Flask(__name__)
@@ -7,10 +15,32 @@ def create_app():
     #Importing and registering routes with the app
     from web.routes import register_routes
     register_routes(app)
+
+    #Timing every request, labelled by route rather than URL so the series stay bounded
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.get('request_started')
+        if started is not None:
+            request_seconds.labels(request.endpoint or 'unknown', response.status_code).observe(
+                time.perf_counter() - started
+            )
+        return response
     
     return app
 
-def start_web_server(blockchain, host='0.0.0.0', port=5000):
+def start_web_server(blockchain, host='0.0.0.0', port=5000, mining_scheduler=None,
+                     signature_scheme=DEFAULT_SCHEME):
     app = create_app()
     app.blockchain = blockchain
-    app.run(host=host, port=port, debug=True)
+    app.mining_scheduler = mining_scheduler
+    app.vote_queue = VoteQueue(blockchain)
+    app.vote_queue.start()
+    app.key_pool = KeyPool(signature_scheme)
+    app.key_pool.start()
+    # no reloader: it would run main() again in a child that opens the same block store,
+    # voter roll and snapshots while this process still has its node and miner running
+    app.run(host=host, port=port, debug=True, use_reloader=False)
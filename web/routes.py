@@ -1,6 +1,7 @@
-from flask import render_template, redirect, url_for, request, flash
+from flask import render_template, redirect, url_for, request, flash, jsonify
 from blockchain.transaction import Transaction
 from blockchain.wallet import Wallet
+from utils.metrics import registry
 import json
 
 def register_routes(app):
@@ -11,10 +12,14 @@ def register_routes(app):
     @app.route('/register', methods=['GET', 'POST'])
     def register():
         if request.method == 'POST':
-            # Generate a new wallet for the voter
-            wallet = Wallet()
-            private_key = wallet.private_key
-            public_key = wallet.public_key
+            # Take a pre-generated key pair for the voter, or generate one if there is no pool
+            key_pool = getattr(app, 'key_pool', None)
+            if key_pool is not None:
+                public_key, private_key = key_pool.take()
+            else:
+                wallet = Wallet()
+                private_key = wallet.private_key
+                public_key = wallet.public_key
             
             # Register the voter
             if app.blockchain.register_voter(public_key):
@@ -36,11 +41,25 @@ def register_routes(app):
             private_key = request.form.get('private_key')
             selected_candidate = request.form.get('candidate')
             
+            # Cheap checks only, the signing and admission happen on the vote queue workers
+            if selected_candidate not in candidates:
+                flash('Please select one of the listed candidates.', 'danger')
+                return render_template('vote.html', candidates=candidates)
+            if not private_key or 'PRIVATE KEY' not in private_key:
+                flash('Please paste the private key you received at registration.', 'danger')
+                return render_template('vote.html', candidates=candidates)
+
+            vote_queue = getattr(app, 'vote_queue', None)
+            if vote_queue is not None:
+                ticket = vote_queue.submit(private_key, selected_candidate)
+                if ticket is None:
+                    flash('The system is busy right now, please try again shortly.', 'warning')
+                    return render_template('vote.html', candidates=candidates)
+                return redirect(url_for('vote_ticket', ticket=ticket))
+
             try:
                 # Create a wallet with the provided private key
-                wallet = Wallet()
-                wallet.private_key = private_key
-                wallet.generate_public_key()
+                wallet = Wallet(private_key=private_key)
                 
                 # Create and sign a transaction
                 transaction = Transaction(
@@ -52,7 +71,7 @@ def register_routes(app):
                 
                 # Add the transaction to the blockchain
                 if app.blockchain.add_transaction(transaction):
-                    flash('Vote cast successfully!', 'success')
+                    flash(f'Vote cast successfully! Your receipt: {transaction.calculate_txid()}', 'success')
                     return redirect(url_for('results'))
                 else:
                     flash('Failed to cast vote. You may have already voted or not be registered.', 'danger')
@@ -61,27 +80,66 @@ def register_routes(app):
         
         return render_template('vote.html', candidates=candidates)
 
+    @app.route('/vote/ticket/<ticket>')
+    def vote_ticket(ticket):
+        # Show where a queued vote is, the page polls the status endpoint
+        return render_template('ticket.html', ticket=ticket)
+
+    @app.route('/vote/status/<ticket>')
+    def vote_status(ticket):
+        # Report pending, accepted, rejected or included for a vote ticket
+        vote_queue = getattr(app, 'vote_queue', None)
+        record = vote_queue.status(ticket) if vote_queue is not None else None
+        if record is None:
+            return jsonify({'error': 'Unknown or expired ticket'}), 404
+        return jsonify(record)
+
     @app.route('/results')
     def results():
-        # Count votes from the blockchain
-        vote_counts = {}
+        # Read the running counts kept by the blockchain's tally index
+        vote_counts = app.blockchain.get_vote_counts()
+        scheduler = getattr(app, 'mining_scheduler', None)
+        mining_state = scheduler.state() if scheduler else None
         
-        for block in app.blockchain.chain:
-            for transaction in block.transactions:
-                if transaction.recipient == "ELECTION" and "vote" in transaction.data:
-                    candidate = transaction.data["vote"]
-                    if candidate in vote_counts:
-                        vote_counts[candidate] += 1
-                    else:
-                        vote_counts[candidate] = 1
-        
-        return render_template('results.html', results=vote_counts)
+        return render_template('results.html', results=vote_counts, mining_state=mining_state)
+
+    @app.route('/proof/<tx_hash>')
+    def proof(tx_hash):
+        # returning a merkle inclusion proof for a vote receipt
+        inclusion_proof = app.blockchain.get_transaction_proof(tx_hash)
+        if inclusion_proof is None:
+            return jsonify({'error': 'Transaction not found in any mined block'}), 404
+        return jsonify(inclusion_proof)
 
     @app.route('/mine')
     def mine():
-        # Mine pending transactions
+        # Ask the background scheduler for a block and return right away
+        scheduler = getattr(app, 'mining_scheduler', None)
+        if scheduler is not None:
+            scheduler.trigger()
+            flash('Mining started in the background. Results update once the block is found.', 'info')
+            return redirect(url_for('results'))
+
+        # Without a scheduler, mine pending transactions inline
         miner_address = "SYSTEM"
         mined_block = app.blockchain.mine_pending_transactions(miner_address)
         
+        if mined_block is None:
+            flash('Mining was interrupted by a competing block from the network.', 'warning')
+            return redirect(url_for('results'))
+
         flash(f'Block mined! Hash: {mined_block.hash[:10]}...', 'success')
         return redirect(url_for('results'))
+
+    @app.route('/metrics')
+    def metrics():
+        # Export the node's counters in the Prometheus text format
+        return registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+    @app.route('/mining/status')
+    def mining_status():
+        # Report what the background miner is doing
+        scheduler = getattr(app, 'mining_scheduler', None)
+        if scheduler is None:
+            return jsonify({'status': 'disabled'})
+        return jsonify(scheduler.state())
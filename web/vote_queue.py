@@ -0,0 +1,151 @@
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from blockchain.transaction import Transaction
+from blockchain.wallet import Wallet
+
+# ticket states, in the order a vote moves through them
+TICKET_PENDING = 'pending'
+TICKET_ACCEPTED = 'accepted'
+TICKET_REJECTED = 'rejected'
+TICKET_INCLUDED = 'included'
+# how long a worker waits for room in the verification queue
+SUBMIT_TIMEOUT = 5.0
+
+
+class VoteQueue:
+    # Takes vote submissions off the request thread, workers do key derivation, signing and admission
+
+    def __init__(self, blockchain, workers=2, max_queue=10000, max_tickets=100000, ticket_ttl=3600.0):
+        self.blockchain = blockchain
+        self.workers = workers
+        self.submissions = queue.Queue(maxsize=max_queue)
+        # finished tickets are kept this long so voters can still poll them
+        self.max_tickets = max_tickets
+        self.ticket_ttl = ticket_ttl
+        self.lock = threading.Lock()
+        # ticket id -> record, oldest first
+        self.tickets = OrderedDict()
+        # txid -> ticket id for accepted votes, so a vote that expires unmined can be reported
+        self.accepted = {}
+        self.threads = []
+        self.running = False
+        blockchain.evict_listeners.append(self._on_evicted)
+
+    def start(self):
+        self.running = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.running = False
+        for _ in self.threads:
+            self.submissions.put(None)
+        for thread in self.threads:
+            thread.join(2.0)
+        self.threads = []
+
+    def submit(self, private_key, candidate):
+        # returns a ticket id, or None when the queue is full
+        ticket = uuid.uuid4().hex
+        with self.lock:
+            self._prune()
+            self.tickets[ticket] = {
+                'status': TICKET_PENDING,
+                'submitted_at': time.time(),
+                'txid': None,
+                'reason': None
+            }
+        try:
+            self.submissions.put_nowait((ticket, private_key, candidate))
+        except queue.Full:
+            with self.lock:
+                del self.tickets[ticket]
+            return None
+        return ticket
+
+    def _prune(self):
+        # dropping expired tickets, then the oldest ones if there are too many
+        cutoff = time.time() - self.ticket_ttl
+        while self.tickets:
+            ticket, record = next(iter(self.tickets.items()))
+            if record['submitted_at'] > cutoff and len(self.tickets) < self.max_tickets:
+                break
+            del self.tickets[ticket]
+            self.accepted.pop(record['txid'], None)
+
+    def _update(self, ticket, **fields):
+        with self.lock:
+            record = self.tickets.get(ticket)
+            if record is not None:
+                record.update(fields)
+
+    def _work(self):
+        while self.running:
+            item = self.submissions.get()
+            if item is None:
+                break
+            ticket, private_key, candidate = item
+            try:
+                self._process(ticket, private_key, candidate)
+            except Exception as e:
+                self._update(ticket, status=TICKET_REJECTED, reason=str(e))
+
+    def _process(self, ticket, private_key, candidate):
+        # building and signing the vote, then handing it to the verifier without waiting on it
+        wallet = Wallet(private_key=private_key)
+        transaction = Transaction(
+            sender=wallet.public_key,
+            recipient="ELECTION",
+            data={"vote": candidate}
+        )
+        transaction.sign_transaction(wallet)
+        self._update(ticket, txid=transaction.calculate_txid())
+
+        def on_verified(tx, accepted):
+            if accepted:
+                with self.lock:
+                    record = self.tickets.get(ticket)
+                    if record is not None:
+                        record['status'] = TICKET_ACCEPTED
+                        self.accepted[record['txid']] = ticket
+            else:
+                self._update(ticket, status=TICKET_REJECTED,
+                             reason='The voter may have already voted or not be registered.')
+
+        if not self.blockchain.submit_transaction(transaction, on_verified, timeout=SUBMIT_TIMEOUT):
+            self._update(ticket, status=TICKET_REJECTED, reason='The node is too busy, try again later.')
+
+    def _on_evicted(self, transaction):
+        # the vote aged out of the mempool before any block took it, it will not be counted
+        with self.lock:
+            ticket = self.accepted.pop(transaction.calculate_txid(), None)
+            record = self.tickets.get(ticket)
+            if record is not None and record['status'] == TICKET_ACCEPTED:
+                record['status'] = TICKET_REJECTED
+                record['reason'] = 'The vote expired before it was mined, please vote again.'
+
+    def status(self, ticket):
+        # returns a copy of the ticket record, or None for unknown tickets
+        with self.lock:
+            record = self.tickets.get(ticket)
+            if record is None:
+                return None
+            record = dict(record)
+
+        # accepted votes become included once a block carrying them is on the chain
+        if record['status'] == TICKET_ACCEPTED:
+            location = self.blockchain.get_transaction_location(record['txid'])
+            if location is not None:
+                record['status'] = TICKET_INCLUDED
+                record['block_index'] = location[0]
+        record['ticket'] = ticket
+        return record
+
+    def pending(self):
+        return self.submissions.qsize()